@@ -0,0 +1,207 @@
+"""
+Load test for the playlist endpoints.
+
+Drives /api/playlist/add and /api/playlist/remove with a fixed number of
+concurrent clients (each keeping one connection alive) and reports
+latency percentiles, throughput and the status codes seen.
+
+Only needs the standard library:
+    python loadtest.py --url http://localhost:8001 --concurrency 32 --requests 5000
+
+Use --output to save the results as JSON and --baseline to compare a run
+against saved results; the exit code is 1 when p95 latency or throughput
+regressed by more than --tolerance.
+"""
+import argparse
+import http.client
+import json
+import random
+import string
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+BASE62 = string.ascii_letters + string.digits
+
+
+def random_song_id():
+    return ''.join(random.choice(BASE62) for _ in range(22))
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Worker(threading.Thread):
+    """One client: sends requests back to back over a kept-alive connection."""
+
+    def __init__(self, options, budget, deadline):
+        super().__init__(daemon=True)
+        self.options = options
+        self.budget = budget
+        self.deadline = deadline
+        self.latencies = []
+        self.statuses = Counter()
+        split = urlsplit(options.url)
+        self.host, self.port = split.hostname, split.port or 80
+        self.connection = None
+
+    def _connect(self):
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.options.timeout)
+
+    def _operation(self, added):
+        mode = self.options.operation
+        if mode == 'mixed':
+            # Remove something we added earlier about half the time
+            mode = 'remove' if added and random.random() < 0.5 else 'add'
+        if mode == 'remove':
+            return 'remove', added.pop() if added else random_song_id()
+        return 'add', random_song_id()
+
+    def _send(self, operation, song_id):
+        path = f'/api/playlist/{operation}'
+        if self.options.async_mode:
+            path += '?async=1'
+        body = json.dumps({'playlist_id': self.options.playlist, 'song_id': song_id})
+
+        if self.connection is None:
+            self._connect()
+        try:
+            self.connection.request('POST', path, body, {'Content-Type': 'application/json'})
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException) as e:
+            self.connection.close()
+            self.connection = None
+            return type(e).__name__
+
+    def run(self):
+        added = []
+        while time.monotonic() < self.deadline and self.budget.take():
+            operation, song_id = self._operation(added)
+            start = time.perf_counter()
+            status = self._send(operation, song_id)
+            self.latencies.append(time.perf_counter() - start)
+            self.statuses[status] += 1
+            if operation == 'add' and status in (200, 201, 202):
+                added.append(song_id)
+
+
+class Budget:
+    """Shared countdown of requests left to send (None for unlimited)."""
+
+    def __init__(self, total):
+        self.left = total
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.left is None:
+            return True
+        with self.lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def run(options):
+    budget = Budget(options.requests if not options.duration else None)
+    deadline = time.monotonic() + (options.duration or float('inf'))
+    workers = [Worker(options, budget, deadline) for _ in range(options.concurrency)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(l for w in workers for l in w.latencies)
+    statuses = Counter()
+    for worker in workers:
+        statuses.update(worker.statuses)
+
+    ok = sum(n for status, n in statuses.items() if isinstance(status, int) and status < 400)
+    return {
+        'operation': options.operation,
+        'async': options.async_mode,
+        'concurrency': options.concurrency,
+        'requests': len(latencies),
+        'ok': ok,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        'statuses': {str(status): n for status, n in sorted(statuses.items(), key=str)},
+    }
+
+
+def compare(result, baseline, tolerance):
+    """List the ways `result` is worse than `baseline`."""
+    problems = []
+    p95, base_p95 = result['latency_ms']['p95'], baseline['latency_ms']['p95']
+    if base_p95 and p95 > base_p95 * (1 + tolerance):
+        problems.append(f'p95 latency {p95}ms vs {base_p95}ms in the baseline')
+    rps, base_rps = result['requests_per_second'], baseline['requests_per_second']
+    if base_rps and rps < base_rps * (1 - tolerance):
+        problems.append(f'throughput {rps} req/s vs {base_rps} req/s in the baseline')
+    return problems
+
+
+def print_report(result):
+    latency = result['latency_ms']
+    print(f"{result['requests']} requests ({result['ok']} ok) in {result['elapsed_seconds']}s "
+          f"at concurrency {result['concurrency']}")
+    print(f"throughput: {result['requests_per_second']} req/s")
+    print(f"latency: p50 {latency['p50']}ms  p95 {latency['p95']}ms  "
+          f"p99 {latency['p99']}ms  max {latency['max']}ms")
+    print('statuses: ' + ', '.join(f'{s}={n}' for s, n in result['statuses'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:8001', help='internal API base URL')
+    parser.add_argument('--playlist', default='benchmarkplaylist0000001')
+    parser.add_argument('--operation', choices=('add', 'remove', 'mixed'), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000, help='total requests to send')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='run for this many seconds instead of a fixed number of requests')
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='queue the changes (?async=1) instead of waiting for Spotify')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed regression against the baseline (0.2 = 20%%)')
+    options = parser.parse_args()
+
+    result = run(options)
+    print_report(result)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            problems = compare(result, json.load(f), options.tolerance)
+        for problem in problems:
+            print(f'REGRESSION: {problem}')
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+Offline stand-in for the parts of Spotify this project talks to.
+
+Serves, on one port:
+    GET    /authorize                  redirects straight back with a code
+    POST   /api/token                  authorization_code and refresh_token grants
+    GET    /v1/me
+    GET    /v1/playlists/<id>          (snapshot_id)
+    GET    /v1/playlists/<id>/tracks   paged like Spotify
+    POST   /v1/playlists/<id>/tracks   add
+    DELETE /v1/playlists/<id>/tracks   remove
+    PUT    /v1/playlists/<id>/tracks   reorder
+    GET    /v1/search?q=isrc:<isrc>    track search by ISRC
+    GET    /_stub/stats                request counters (reset with ?reset=1)
+
+Playlists live in memory. Every response can be delayed and 401/429/5xx
+answers can be injected at random, and issued access tokens expire after
+--token-ttl seconds, so refresh and retry paths get exercised too. ISRC
+searches find a track whose ID is derived from the ISRC, except for a
+--rate-isrc-miss fraction of ISRCs, which find nothing.
+
+Only needs the standard library:
+    python spotify_stub.py --port 9000 --latency-ms 80 --jitter-ms 40 --rate-429 0.01
+
+Then point the service at it:
+    SPOTIFY_API_BASE_URL=http://localhost:9000/v1
+    SPOTIFY_ACCOUNTS_BASE_URL=http://localhost:9000
+"""
+import argparse
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+PAGE_LIMIT = 100
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+class State:
+    """Playlists, issued tokens and counters, shared by all handler threads."""
+
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.playlists = {}
+        self.snapshots = {}
+        self.tokens = {}
+        self.stats = Counter()
+
+    def issue_token(self):
+        token = 'stub-' + secrets.token_urlsafe(16)
+        with self.lock:
+            self.tokens[token] = time.time() + self.options.token_ttl
+        return token
+
+    def token_valid(self, token):
+        with self.lock:
+            expires_at = self.tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _bump(self, playlist_id):
+        self.snapshots[playlist_id] = self.snapshots.get(playlist_id, 0) + 1
+        return f'{playlist_id}-{self.snapshots[playlist_id]}'
+
+    def snapshot_id(self, playlist_id):
+        with self.lock:
+            return f'{playlist_id}-{self.snapshots.get(playlist_id, 0)}'
+
+    def add(self, playlist_id, uris, position=None):
+        with self.lock:
+            tracks = self.playlists.setdefault(playlist_id, [])
+            if position is None or position > len(tracks):
+                position = len(tracks)
+            tracks[position:position] = uris
+            return self._bump(playlist_id)
+
+    def remove(self, playlist_id, items):
+        with self.lock:
+            tracks = self.playlists.setdefault(playlist_id, [])
+            # Like Spotify, every position refers to the playlist as it was
+            # before this call
+            doomed = set()
+            for item in items:
+                uri = item.get('uri')
+                positions = item.get('positions')
+                if positions:
+                    doomed.update(p for p in positions if p < len(tracks) and tracks[p] == uri)
+                else:
+                    doomed.update(p for p, t in enumerate(tracks) if t == uri)
+            tracks[:] = [t for p, t in enumerate(tracks) if p not in doomed]
+            return self._bump(playlist_id)
+
+    def reorder(self, playlist_id, range_start, insert_before, range_length):
+        with self.lock:
+            tracks = self.playlists.setdefault(playlist_id, [])
+            block = tracks[range_start:range_start + range_length]
+            if insert_before > range_start:
+                insert_before -= len(block)
+            del tracks[range_start:range_start + range_length]
+            tracks[insert_before:insert_before] = block
+            return self._bump(playlist_id)
+
+    def page(self, playlist_id, offset, limit):
+        with self.lock:
+            tracks = list(self.playlists.get(playlist_id, []))
+        return tracks[offset:offset + limit], len(tracks)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SpotifyStub/1.0'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.state.options.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=None, headers=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+        self.state.count(f'status_{status}')
+
+    def _error(self, status, message, headers=None):
+        self._send(status, {'error': {'status': status, 'message': message}}, headers)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _delay(self):
+        options = self.state.options
+        delay = options.latency_ms + random.uniform(-options.jitter_ms, options.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _injected_failure(self):
+        """Send a random 429/5xx if one is due; returns True if it did."""
+        options = self.state.options
+        roll = random.random()
+        if roll < options.rate_429:
+            self._error(429, 'API rate limit exceeded', {'Retry-After': str(options.retry_after)})
+            return True
+        if roll < options.rate_429 + options.rate_5xx:
+            self._error(random.choice((500, 502, 503)), 'Injected server error')
+            return True
+        return False
+
+    def _authorized(self):
+        header = self.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+        if token is None or not self.state.token_valid(token):
+            self._error(401, 'The access token expired')
+            return False
+        if random.random() < self.state.options.rate_401:
+            self._error(401, 'The access token expired')
+            return False
+        return True
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.state.count(f'{self.command} /{"/".join(parts[:2])}')
+
+        if parts == ['_stub', 'stats']:
+            return self._stats(query)
+        if parts == ['authorize']:
+            return self._authorize(query)
+
+        # Drain the body first so the connection stays usable when we
+        # answer before looking at it
+        body = self._read_body() if self.command in ('POST', 'DELETE', 'PUT') else b''
+        self._delay()
+
+        if self.command == 'HEAD':
+            return self._send(200)
+        if parts == ['api', 'token'] and self.command == 'POST':
+            return self._token(body)
+        if not parts or parts[0] != 'v1':
+            return self._error(404, 'Not found')
+        if self._injected_failure() or not self._authorized():
+            return
+
+        if parts == ['v1', 'me'] and self.command == 'GET':
+            return self._send(200, {
+                'id': 'stub-user',
+                'display_name': 'Stub User',
+                'email': 'stub@example.com',
+            })
+        if len(parts) == 3 and parts[1] == 'playlists' and self.command == 'GET':
+            return self._send(200, {'snapshot_id': self.state.snapshot_id(parts[2])})
+        if len(parts) == 4 and parts[1] == 'playlists' and parts[3] == 'tracks':
+            return self._tracks(parts[2], query, body)
+        if parts == ['v1', 'search'] and self.command == 'GET':
+            return self._search(query)
+        return self._error(404, 'Not found')
+
+    def _stats(self, query):
+        with self.state.lock:
+            stats = dict(self.state.stats)
+            if query.get('reset'):
+                self.state.stats.clear()
+        self._send(200, stats)
+
+    def _authorize(self, query):
+        params = {'code': 'stub-code', 'state': query.get('state', '')}
+        self.send_response(302)
+        self.send_header('Location', f"{query.get('redirect_uri', '/')}?{urlencode(params)}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _token(self, body):
+        form = {k: v[-1] for k, v in parse_qs(body.decode()).items()}
+        grant = form.get('grant_type')
+        if grant not in ('authorization_code', 'refresh_token'):
+            return self._send(400, {'error': 'unsupported_grant_type'})
+
+        data = {
+            'access_token': self.state.issue_token(),
+            'token_type': 'Bearer',
+            'expires_in': self.state.options.token_ttl,
+            'scope': 'playlist-modify-public playlist-modify-private',
+        }
+        if grant == 'authorization_code':
+            data['refresh_token'] = 'stub-refresh-' + secrets.token_urlsafe(8)
+        self._send(200, data)
+
+    def _search(self, query):
+        q = query.get('q', '')
+        if not q or 'track' not in query.get('type', '').split(','):
+            return self._error(400, 'q and type=track are required')
+
+        items = []
+        if q.lower().startswith('isrc:'):
+            # The same ISRC always finds the same track (or always nothing)
+            digest = hashlib.sha256(q[len('isrc:'):].upper().encode()).digest()
+            if int.from_bytes(digest[:4], 'big') / 2 ** 32 >= self.state.options.rate_isrc_miss:
+                track_id = ''.join(BASE62[b % 62] for b in digest[4:26])
+                items.append({'id': track_id, 'uri': f'spotify:track:{track_id}'})
+        self._send(200, {'tracks': {
+            'items': items,
+            'limit': int(query.get('limit', 20)),
+            'offset': 0,
+            'total': len(items),
+            'next': None,
+        }})
+
+    def _tracks(self, playlist_id, query, body):
+        if self.command == 'GET':
+            offset = int(query.get('offset', 0))
+            limit = min(int(query.get('limit', PAGE_LIMIT)), PAGE_LIMIT)
+            uris, total = self.state.page(playlist_id, offset, limit)
+            following = offset + limit
+            next_url = None
+            if following < total:
+                path = urlsplit(self.path).path
+                next_url = f"http://{self.headers.get('Host')}{path}?offset={following}&limit={limit}"
+            return self._send(200, {
+                'items': [{'track': {'uri': uri}} for uri in uris],
+                'offset': offset,
+                'limit': limit,
+                'total': total,
+                'next': next_url,
+            })
+
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return self._error(400, 'Invalid JSON')
+
+        if self.command == 'POST':
+            uris = data.get('uris') or []
+            if not uris or len(uris) > PAGE_LIMIT:
+                return self._error(400, 'Invalid number of uris')
+            return self._send(201, {'snapshot_id': self.state.add(playlist_id, uris, data.get('position'))})
+        if self.command == 'DELETE':
+            items = data.get('tracks') or []
+            if not items or len(items) > PAGE_LIMIT:
+                return self._error(400, 'Invalid number of tracks')
+            return self._send(200, {'snapshot_id': self.state.remove(playlist_id, items)})
+        if self.command == 'PUT':
+            try:
+                range_start = int(data['range_start'])
+                insert_before = int(data['insert_before'])
+                range_length = int(data.get('range_length', 1))
+            except (KeyError, TypeError, ValueError):
+                return self._error(400, 'range_start and insert_before are required')
+            return self._send(200, {
+                'snapshot_id': self.state.reorder(playlist_id, range_start, insert_before, range_length)
+            })
+        return self._error(405, 'Method not allowed')
+
+    do_GET = do_POST = do_DELETE = do_PUT = do_HEAD = _route
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=50,
+                        help='mean delay added to every API response')
+    parser.add_argument('--jitter-ms', type=float, default=20,
+                        help='the delay varies uniformly by up to this much')
+    parser.add_argument('--token-ttl', type=int, default=3600,
+                        help='lifetime of issued access tokens in seconds')
+    parser.add_argument('--rate-401', type=float, default=0.0,
+                        help='fraction of API calls answered with 401')
+    parser.add_argument('--rate-429', type=float, default=0.0,
+                        help='fraction of API calls answered with 429')
+    parser.add_argument('--rate-5xx', type=float, default=0.0,
+                        help='fraction of API calls answered with 500/502/503')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='Retry-After sent with injected 429s')
+    parser.add_argument('--rate-isrc-miss', type=float, default=0.1,
+                        help='fraction of ISRCs that search finds no track for')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    options = parser.parse_args()
+
+    server = ThreadingHTTPServer((options.host, options.port), Handler)
+    server.daemon_threads = True
+    server.state = State(options)
+    print(f'Spotify stub listening on http://{options.host}:{options.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
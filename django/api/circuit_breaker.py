@@ -0,0 +1,137 @@
+"""
+Circuit breakers for the Spotify hosts.
+
+Each host (api.spotify.com, accounts.spotify.com) has its own breaker, so
+an outage of the accounts service doesn't block Web API calls made with
+a still-valid token, and the reverse.
+
+A breaker starts closed. When SPOTIFY_BREAKER_FAILURE_THRESHOLD calls
+fail in a row, it opens. A failure is a connection error, a timeout or a
+5xx. While the breaker is open, calls to that host fail at once with
+CircuitOpen (a 503 with Retry-After) instead of tying up workers. After
+SPOTIFY_BREAKER_RESET_TIMEOUT seconds it goes half-open and lets
+SPOTIFY_BREAKER_HALF_OPEN_PROBES calls through. If a probe succeeds the
+breaker closes again; if it fails the breaker opens for another reset
+timeout.
+
+State is per process, like the rate limiter, so every worker decides for
+itself.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from api import metrics
+from api.rate_limiter import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Values of the state gauge
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Calls to a Spotify host are suspended after repeated failures."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f'Spotify ({host}) is failing, calls are paused; try again later', retry_after)
+        self.host = host
+
+
+def _breaker(host):
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = {
+            'state': CLOSED,
+            'failures': 0,
+            'opened_at': 0.0,
+            'probes': 0,
+        }
+    return breaker
+
+
+def _set_state(host, breaker, state):
+    if breaker['state'] != state:
+        logger.warning('Circuit breaker for %s is now %s', host, state)
+    breaker['state'] = state
+    metrics.CIRCUIT_STATE.labels(host).set(_STATE_VALUES[state])
+
+
+def _open(host, breaker):
+    breaker['opened_at'] = time.monotonic()
+    breaker['probes'] = 0
+    _set_state(host, breaker, OPEN)
+
+
+def _before_call(host):
+    """Raise CircuitOpen unless a call to `host` may go ahead."""
+    with _lock:
+        breaker = _breaker(host)
+        if breaker['state'] == OPEN:
+            wait = breaker['opened_at'] + settings.SPOTIFY_BREAKER_RESET_TIMEOUT - time.monotonic()
+            if wait > 0:
+                metrics.CIRCUIT_REJECTED.labels(host).inc()
+                raise CircuitOpen(host, wait)
+            _set_state(host, breaker, HALF_OPEN)
+
+        if breaker['state'] == HALF_OPEN:
+            if breaker['probes'] >= settings.SPOTIFY_BREAKER_HALF_OPEN_PROBES:
+                metrics.CIRCUIT_REJECTED.labels(host).inc()
+                raise CircuitOpen(host, 1)
+            breaker['probes'] += 1
+            return True
+    return False
+
+
+def _after_call(host, failed, probe):
+    """Record a call's outcome; `failed` None means it says nothing either way."""
+    with _lock:
+        breaker = _breaker(host)
+        if probe and breaker['state'] == HALF_OPEN:
+            breaker['probes'] -= 1
+            if failed:
+                _open(host, breaker)
+            elif failed is False:
+                breaker['failures'] = 0
+                _set_state(host, breaker, CLOSED)
+        elif breaker['state'] == CLOSED:
+            if failed:
+                breaker['failures'] += 1
+                if breaker['failures'] >= settings.SPOTIFY_BREAKER_FAILURE_THRESHOLD:
+                    _open(host, breaker)
+            elif failed is False:
+                breaker['failures'] = 0
+
+
+@contextmanager
+def guard(url):
+    """
+    Guard one call to Spotify.
+
+    Raises CircuitOpen if the host's breaker doesn't allow the call. Set
+    `call['failed']` inside the block to True or False once the outcome
+    is known; left at None (e.g. the caller gave up) it isn't counted.
+    """
+    call = {'failed': None}
+    if settings.SPOTIFY_BREAKER_FAILURE_THRESHOLD <= 0:
+        yield call
+        return
+
+    host = urlsplit(url).hostname or ''
+    probe = _before_call(host)
+    try:
+        yield call
+    finally:
+        _after_call(host, call['failed'], probe)
+
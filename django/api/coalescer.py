@@ -0,0 +1,303 @@
+"""
+Write coalescing for single-track playlist adds and removes.
+
+Concurrent adds (or removes) for the same playlist that arrive within
+SPOTIFY_COALESCE_WINDOW_MS of each other are merged into one Spotify call
+of up to 100 tracks. The first caller of a batch is its leader: it waits
+out the window (or until the batch is full), sends the batch and hands
+the resulting snapshot_id to every caller that joined.
+
+Ordering per playlist is kept: an add arriving after a remove (or vice
+versa), or from a different account, starts a new batch, and every batch
+waits for the previous batch of its playlist to finish before it is sent.
+
+The async views use submit_async(), which batches the same way on the
+event loop with the async client. Its batches are kept per event loop,
+apart from the sync ones: under ASGI only the job workers use the sync
+path, and a job and a request racing on the same playlist were never
+ordered anyway.
+"""
+import asyncio
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from api import spotify_api, timing
+
+ADD = 'add'
+REMOVE = 'remove'
+
+SUCCESS_STATUS = {
+    ADD: 201,
+    REMOVE: 200,
+}
+
+Result = namedtuple('Result', ['status_code', 'snapshot_id', 'error', 'token_refreshed'])
+
+_lock = threading.Lock()
+_open_batches = {}
+_last_batches = {}
+_pending = {
+    'items': 0,
+}
+# Async batches, keyed by (event loop, playlist_id)
+_async_open_batches = {}
+_async_last_batches = {}
+
+
+class _Batch:
+    def __init__(self, operation, playlist_id, account, previous):
+        self.operation = operation
+        self.playlist_id = playlist_id
+        self.account = account
+        self.previous = previous
+        self.uris = []
+        self.results = None
+        self.exception = None
+        self.sealed = threading.Event()
+        self.done = threading.Event()
+
+    def result(self, index):
+        if self.exception is not None:
+            raise self.exception
+        return self.results[index]
+
+
+def _result_from_response(response):
+    if response.status_code in SUCCESS_STATUS.values():
+        return Result(response.status_code, response.json().get('snapshot_id'), None,
+                      response.token_refreshed)
+    return Result(response.status_code, None, spotify_api.error_message(response, None),
+                  response.token_refreshed)
+
+
+def _send(operation, playlist_id, uris, account):
+    if operation == ADD:
+        return spotify_api.add_tracks(playlist_id, uris, account=account)
+    # Removing a URI removes every occurrence, so send each URI once
+    tracks = [{'uri': uri} for uri in dict.fromkeys(uris)]
+    return spotify_api.remove_tracks(playlist_id, tracks, account=account)
+
+
+def _execute(operation, playlist_id, uris, account=None):
+    """Send a batch and return one Result per URI, in order."""
+    response = _send(operation, playlist_id, uris, account)
+    result = _result_from_response(response)
+
+    if response.status_code == 400 and len(set(uris)) > 1:
+        # One bad track ID fails the whole call; retry one by one so it
+        # doesn't take the other callers' tracks down with it.
+        per_uri = {}
+        results = []
+        for uri in uris:
+            if operation == REMOVE and uri in per_uri:
+                results.append(per_uri[uri])
+                continue
+            per_uri[uri] = _result_from_response(_send(operation, playlist_id, [uri], account))
+            results.append(per_uri[uri])
+        return results
+
+    return [result] * len(uris)
+
+
+def _seal(batch):
+    """Stop a batch from accepting items. Caller must hold _lock."""
+    if _open_batches.get(batch.playlist_id) is batch:
+        del _open_batches[batch.playlist_id]
+    batch.sealed.set()
+
+
+def _run(batch):
+    """Leader side: wait for the batch to fill, then send it."""
+    with timing.span('coalesce'):
+        batch.sealed.wait(settings.SPOTIFY_COALESCE_WINDOW_MS / 1000)
+
+        with _lock:
+            _seal(batch)
+
+        if batch.previous is not None:
+            batch.previous.done.wait()
+            batch.previous = None
+
+    try:
+        batch.results = _execute(batch.operation, batch.playlist_id, batch.uris, batch.account)
+    except Exception as e:
+        batch.exception = e
+    finally:
+        with _lock:
+            _pending['items'] -= len(batch.uris)
+            if _last_batches.get(batch.playlist_id) is batch:
+                del _last_batches[batch.playlist_id]
+        batch.done.set()
+
+
+def submit(operation, playlist_id, uri, account=None):
+    """
+    Queue one track for `operation` on a playlist and wait for the result.
+    The change is made with `account`'s token (None: the default account).
+
+    Returns a Result; exceptions raised while talking to Spotify (e.g.
+    spotify_api.NotAuthenticated, requests errors) are re-raised in every
+    caller of the batch.
+    """
+    if settings.SPOTIFY_COALESCE_WINDOW_MS <= 0:
+        return _execute(operation, playlist_id, [uri], account)[0]
+
+    with _lock:
+        batch = _open_batches.get(playlist_id)
+        if batch is not None and (batch.operation != operation or batch.account != account):
+            _seal(batch)
+            batch = None
+
+        leader = batch is None
+        if leader:
+            batch = _Batch(operation, playlist_id, account, _last_batches.get(playlist_id))
+            _last_batches[playlist_id] = batch
+            if _pending['items'] >= settings.SPOTIFY_COALESCE_MAX_PENDING:
+                # Too much buffered already: send this one on its own
+                # without waiting for others to join.
+                batch.sealed.set()
+            else:
+                _open_batches[playlist_id] = batch
+
+        index = len(batch.uris)
+        batch.uris.append(uri)
+        _pending['items'] += 1
+
+        if len(batch.uris) >= spotify_api.MAX_ITEMS_PER_REQUEST:
+            _seal(batch)
+
+    if leader:
+        _run(batch)
+    else:
+        with timing.span('coalesce'):
+            batch.done.wait()
+
+    return batch.result(index)
+
+
+def add_track(playlist_id, uri, account=None):
+    return submit(ADD, playlist_id, uri, account)
+
+
+def remove_track(playlist_id, uri, account=None):
+    return submit(REMOVE, playlist_id, uri, account)
+
+
+class _AsyncBatch:
+    def __init__(self, operation, playlist_id, account, previous):
+        self.operation = operation
+        self.playlist_id = playlist_id
+        self.account = account
+        self.previous = previous
+        self.uris = []
+        self.sealed = asyncio.Event()
+        self.task = None
+
+
+async def _send_async(operation, playlist_id, uris, account):
+    if operation == ADD:
+        return await spotify_api.add_tracks_async(playlist_id, uris, account=account)
+    tracks = [{'uri': uri} for uri in dict.fromkeys(uris)]
+    return await spotify_api.remove_tracks_async(playlist_id, tracks, account=account)
+
+
+async def _execute_async(operation, playlist_id, uris, account=None):
+    """Async _execute()."""
+    response = await _send_async(operation, playlist_id, uris, account)
+    result = _result_from_response(response)
+
+    if response.status_code == 400 and len(set(uris)) > 1:
+        per_uri = {}
+        results = []
+        for uri in uris:
+            if operation == REMOVE and uri in per_uri:
+                results.append(per_uri[uri])
+                continue
+            per_uri[uri] = _result_from_response(await _send_async(operation, playlist_id, [uri], account))
+            results.append(per_uri[uri])
+        return results
+
+    return [result] * len(uris)
+
+
+def _seal_async(key, batch):
+    if _async_open_batches.get(key) is batch:
+        del _async_open_batches[key]
+    batch.sealed.set()
+
+
+async def _run_async(key, batch):
+    """Wait for the batch to fill, then send it; returns one Result per URI."""
+    try:
+        await asyncio.wait_for(batch.sealed.wait(), settings.SPOTIFY_COALESCE_WINDOW_MS / 1000)
+    except asyncio.TimeoutError:
+        pass
+    _seal_async(key, batch)
+
+    if batch.previous is not None:
+        await asyncio.wait([batch.previous.task])
+        batch.previous = None
+
+    try:
+        return await _execute_async(batch.operation, batch.playlist_id, batch.uris, batch.account)
+    finally:
+        with _lock:
+            _pending['items'] -= len(batch.uris)
+        if _async_last_batches.get(key) is batch:
+            del _async_last_batches[key]
+
+
+async def submit_async(operation, playlist_id, uri, account=None):
+    """
+    submit() for async views. The batch is sent by a task of its own, so a
+    caller that goes away doesn't take the others' tracks with it.
+    """
+    if settings.SPOTIFY_COALESCE_WINDOW_MS <= 0:
+        return (await _execute_async(operation, playlist_id, [uri], account))[0]
+
+    key = (asyncio.get_running_loop(), playlist_id)
+    batch = _async_open_batches.get(key)
+    if batch is not None and (batch.operation != operation or batch.account != account):
+        _seal_async(key, batch)
+        batch = None
+
+    if batch is None:
+        batch = _AsyncBatch(operation, playlist_id, account, _async_last_batches.get(key))
+        _async_last_batches[key] = batch
+        with _lock:
+            crowded = _pending['items'] >= settings.SPOTIFY_COALESCE_MAX_PENDING
+        if crowded:
+            batch.sealed.set()
+        else:
+            _async_open_batches[key] = batch
+        batch.task = asyncio.ensure_future(_run_async(key, batch))
+
+    index = len(batch.uris)
+    batch.uris.append(uri)
+    with _lock:
+        _pending['items'] += 1
+    if len(batch.uris) >= spotify_api.MAX_ITEMS_PER_REQUEST:
+        _seal_async(key, batch)
+
+    with timing.span('coalesce'):
+        results = await asyncio.shield(batch.task)
+    return results[index]
+
+
+async def add_track_async(playlist_id, uri, account=None):
+    return await submit_async(ADD, playlist_id, uri, account)
+
+
+async def remove_track_async(playlist_id, uri, account=None):
+    return await submit_async(REMOVE, playlist_id, uri, account)
+
+
+def get_stats():
+    """Current number of buffered tracks and playlists with an open batch."""
+    with _lock:
+        return {
+            'pending_items': _pending['items'],
+            'open_batches': len(_open_batches) + len(_async_open_batches),
+        }
@@ -0,0 +1,73 @@
+"""
+End-to-end time budgets for work that calls Spotify.
+
+A budget is a deadline stored in a context variable, so it follows the
+request through sync and async code (asgiref copies the context into
+sync_to_async threads) without being passed around. DeadlineMiddleware
+gives every request SPOTIFY_REQUEST_DEADLINE seconds. The Spotify clients
+shrink their timeouts to what is left, skip retries that wouldn't fit,
+and refuse to start a call once it has run out. The budget covers
+everything a request does: a token refresh and the retry after a 401 come
+out of the same budget. Callers get a 503 instead of a worker hanging on
+a slow Spotify.
+
+Nested budgets only ever shorten the deadline. Code outside a budget
+(background threads, management commands) is only bound by the HTTP
+timeouts.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from api.rate_limiter import UpstreamUnavailable
+
+_deadline = contextvars.ContextVar('spotify_deadline', default=None)
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """The request's time budget ran out before Spotify answered."""
+
+    def __init__(self):
+        super().__init__('Spotify did not answer within the request deadline, try again later')
+
+
+@contextmanager
+def budget(seconds):
+    """Run the block with at most `seconds` for Spotify calls (None or 0: no limit)."""
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, or None without one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check():
+    """Raise DeadlineExceeded if the current budget has run out."""
+    if expired():
+        raise DeadlineExceeded()
+
+
+def cap(seconds):
+    """`seconds`, shortened to what is left of the budget."""
+    left = remaining()
+    return seconds if left is None else max(0.001, min(seconds, left))
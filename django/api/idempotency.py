@@ -0,0 +1,266 @@
+"""
+Idempotency keys for playlist mutations.
+
+A caller that sends an `Idempotency-Key` header (or an `idempotency_key`
+body field) gets the stored response when it repeats the request, with no
+second call to Spotify. A repeat that arrives while the first request is
+still running waits for its result instead of running it again.
+
+Records live in the Django database (IdempotencyRecord), so every worker
+process sees them. They expire after IDEMPOTENCY_TTL seconds, and the
+least recently used ones are dropped beyond IDEMPOTENCY_MAX_ENTRIES.
+Responses that are worth retrying (5xx, 401, 429) are not stored.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from api.models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+BODY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+NOT_STORED_STATUS = {401, 429}
+
+# Outcomes of claim()
+EXECUTE = 'execute'
+REPLAY = 'replay'
+MISMATCH = 'mismatch'
+BUSY = 'busy'
+
+
+def get_key(request):
+    """The caller's idempotency key, or None."""
+    key = request.headers.get(HEADER)
+    if not key:
+        try:
+            data = json.loads(request.body)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        key = data.get(BODY_FIELD) if isinstance(data, dict) else None
+    if not isinstance(key, str) or not key:
+        return None
+    return key
+
+
+def _fingerprint(request):
+    # The account a request acts for can come from the query string or a
+    # header, so both are part of what must match on a retry
+    signature = ' '.join((
+        request.method,
+        request.get_full_path(),
+        request.headers.get('X-Spotify-Account', ''),
+    ))
+    return hashlib.sha256(signature.encode() + b' ' + request.body).hexdigest()
+
+
+def _prune():
+    """Drop expired records and keep the table under its size bound."""
+    now = timezone.now()
+    IdempotencyRecord.objects.filter(expires_at__lt=now).delete()
+
+    overflow = IdempotencyRecord.objects.count() - settings.IDEMPOTENCY_MAX_ENTRIES
+    if overflow > 0:
+        oldest = (
+            IdempotencyRecord.objects
+            .filter(status=IdempotencyRecord.COMPLETED)
+            .order_by('last_used_at')
+            .values_list('pk', flat=True)[:overflow]
+        )
+        IdempotencyRecord.objects.filter(pk__in=list(oldest)).delete()
+
+
+def _try_claim(key, fingerprint):
+    """Insert an in-progress record; returns it, or None if the key exists."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(
+                key=key,
+                fingerprint=fingerprint,
+                last_used_at=now,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+            )
+    except IntegrityError:
+        return None
+
+
+def claim(key, fingerprint):
+    """
+    Decide what to do with a request carrying an idempotency key.
+
+    Returns (EXECUTE, record) when this caller should run the request,
+    (REPLAY, record) when a stored response exists, (MISMATCH, record)
+    when the key was used for a different request, or (BUSY, None) when
+    another request with the key is still running after waiting
+    IDEMPOTENCY_WAIT_SECONDS.
+    """
+    if random.random() < settings.IDEMPOTENCY_PRUNE_PROBABILITY:
+        _prune()
+
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.02
+
+    while True:
+        record = _try_claim(key, fingerprint)
+        if record is not None:
+            return EXECUTE, record
+
+        now = timezone.now()
+        record = IdempotencyRecord.objects.filter(key=key).first()
+
+        if record is None:
+            continue
+
+        if record.expires_at < now:
+            record.delete()
+            continue
+
+        if record.fingerprint != fingerprint:
+            return MISMATCH, record
+
+        if record.status == IdempotencyRecord.COMPLETED:
+            IdempotencyRecord.objects.filter(pk=record.pk).update(last_used_at=now)
+            return REPLAY, record
+
+        stale_at = record.last_used_at + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+        if stale_at < now:
+            # The request holding the key died without finishing; take over
+            taken = IdempotencyRecord.objects.filter(
+                pk=record.pk, status=IdempotencyRecord.IN_PROGRESS, last_used_at=record.last_used_at
+            ).update(last_used_at=now)
+            if taken:
+                record.last_used_at = now
+                return EXECUTE, record
+            continue
+
+        if time.monotonic() >= deadline:
+            return BUSY, None
+
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def complete(record, response):
+    """Store the response for replays, or release the key if it shouldn't be kept."""
+    if response.status_code >= 500 or response.status_code in NOT_STORED_STATUS:
+        release(record)
+        return
+
+    IdempotencyRecord.objects.filter(pk=record.pk).update(
+        status=IdempotencyRecord.COMPLETED,
+        response_status=response.status_code,
+        response_body=response.content.decode(response.charset or 'utf-8'),
+        content_type=response.get('Content-Type', 'application/json'),
+        last_used_at=timezone.now()
+    )
+
+
+def release(record):
+    """Forget an in-progress key so the request can be tried again."""
+    IdempotencyRecord.objects.filter(pk=record.pk, status=IdempotencyRecord.IN_PROGRESS).delete()
+
+
+def replay_response(record):
+    response = HttpResponse(
+        record.response_body,
+        status=record.response_status,
+        content_type=record.content_type
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def invalid_key_response():
+    return JsonResponse({
+        'success': False,
+        'error': f'Idempotency key must be at most {MAX_KEY_LENGTH} characters'
+    }, status=400)
+
+
+def mismatch_response():
+    return JsonResponse({
+        'success': False,
+        'error': 'Idempotency key was already used for a different request'
+    }, status=422)
+
+
+def busy_response():
+    response = JsonResponse({
+        'success': False,
+        'error': 'A request with this idempotency key is still being processed'
+    }, status=409)
+    response['Retry-After'] = '1'
+    return response
+
+
+def _early_response(outcome, record):
+    if outcome == REPLAY:
+        return replay_response(record)
+    if outcome == MISMATCH:
+        return mismatch_response()
+    return busy_response()
+
+
+def idempotent(view_func):
+    """
+    Make a playlist mutation view honour idempotency keys.
+
+    Works for sync and async views. The key is scoped to the request
+    path, so the same key can be used on different endpoints.
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            key = get_key(request)
+            if key is None:
+                return await view_func(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return invalid_key_response()
+
+            outcome, record = await sync_to_async(claim)(f'{request.path}:{key}', _fingerprint(request))
+            if outcome != EXECUTE:
+                return _early_response(outcome, record)
+
+            try:
+                response = await view_func(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(complete)(record, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = get_key(request)
+        if key is None:
+            return view_func(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return invalid_key_response()
+
+        outcome, record = claim(f'{request.path}:{key}', _fingerprint(request))
+        if outcome != EXECUTE:
+            return _early_response(outcome, record)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        complete(record, response)
+        return response
+
+    return wrapper
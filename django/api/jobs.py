@@ -0,0 +1,208 @@
+"""
+Durable asynchronous execution of playlist changes.
+
+Add/remove requests made in async mode are written to the PlaylistJob
+table (the outbox) and acknowledged straight away. A pool of worker
+threads in every serving process claims pending jobs, runs them through
+the coalescer like any other single-track change and records the result.
+
+Claiming a job sets a lease (`locked_until`). Jobs whose worker died,
+e.g. because the container restarted, are picked up again once their
+lease expires, so accepted jobs survive restarts. Failures that may go
+away on their own (429/5xx, network errors, nobody logged in) are
+retried with exponential backoff up to JOB_MAX_ATTEMPTS times.
+"""
+import logging
+import os
+import random
+import threading
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api import coalescer, spotify_api, spotify_client, track_resolver
+from api.models import PlaylistJob
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_STATUS = {
+    PlaylistJob.ADD: 201,
+    PlaylistJob.REMOVE: 200,
+}
+
+_wake_up = threading.Event()
+_workers_lock = threading.Lock()
+_workers = {
+    'pid': None,
+    'threads': [],
+}
+
+
+def job_to_dict(job):
+    return {
+        'job_id': str(job.id),
+        'operation': job.operation,
+        'playlist_id': job.playlist_id,
+        'song_id': job.song_id,
+        'account': job.account or None,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def enqueue(operation, playlist_id, song_id, account=None):
+    """Store a playlist change in the outbox and make sure workers run."""
+    job = PlaylistJob.objects.create(
+        operation=operation,
+        playlist_id=playlist_id,
+        song_id=song_id,
+        account=account or '',
+        available_at=timezone.now()
+    )
+    ensure_workers()
+    _wake_up.set()
+    return job
+
+
+def claim_next_job():
+    """Lease the next runnable job to this worker, or return None."""
+    now = timezone.now()
+    runnable = (
+        Q(status=PlaylistJob.PENDING, available_at__lte=now)
+        | Q(status=PlaylistJob.RUNNING, locked_until__lt=now)
+    )
+
+    for job in PlaylistJob.objects.filter(runnable).order_by('available_at')[:10]:
+        # Only one worker wins the conditional update
+        claimed = PlaylistJob.objects.filter(
+            pk=job.pk,
+            status=job.status,
+            locked_until=job.locked_until
+        ).update(
+            status=PlaylistJob.RUNNING,
+            locked_until=now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return PlaylistJob.objects.get(pk=job.pk)
+    return None
+
+
+def _finish(job, status, result=None, error=''):
+    PlaylistJob.objects.filter(pk=job.pk).update(
+        status=status,
+        result=result,
+        error=error,
+        locked_until=None,
+        updated_at=timezone.now()
+    )
+
+
+def _retry_later(job, error, delay=None):
+    if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+        _finish(job, PlaylistJob.FAILED, error=error)
+        return
+
+    if delay is None:
+        delay = settings.JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+        delay *= random.uniform(0.8, 1.2)
+
+    PlaylistJob.objects.filter(pk=job.pk).update(
+        status=PlaylistJob.PENDING,
+        error=error,
+        available_at=timezone.now() + timedelta(seconds=delay),
+        locked_until=None,
+        updated_at=timezone.now()
+    )
+
+
+def run_job(job):
+    """Execute one claimed job and record its outcome."""
+    account = job.account or None
+
+    try:
+        uri = track_resolver.resolve(job.song_id, account)
+        if job.operation == PlaylistJob.ADD:
+            result = coalescer.add_track(job.playlist_id, uri, account)
+        else:
+            result = coalescer.remove_track(job.playlist_id, uri, account)
+    except (track_resolver.InvalidTrack, track_resolver.TrackNotFound) as e:
+        _finish(job, PlaylistJob.FAILED, error=str(e))
+        return
+    except spotify_api.NotAuthenticated:
+        _retry_later(job, 'Not authenticated. Please authenticate with Spotify first.')
+        return
+    except spotify_api.SpotifyError as e:
+        if e.status_code in (401, 429) or e.status_code >= 500:
+            _retry_later(job, str(e))
+        else:
+            _finish(job, PlaylistJob.FAILED, result={'status_code': e.status_code}, error=str(e))
+        return
+    except spotify_client.UpstreamUnavailable as e:
+        _retry_later(job, str(e), delay=e.retry_after)
+        return
+    except requests.exceptions.RequestException as e:
+        _retry_later(job, f'Request to Spotify API failed: {str(e)}')
+        return
+    except Exception as e:
+        logger.exception('Playlist job %s crashed', job.pk)
+        _finish(job, PlaylistJob.FAILED, error=f'Unexpected error: {str(e)}')
+        return
+
+    if result.status_code == SUCCESS_STATUS[job.operation]:
+        _finish(job, PlaylistJob.SUCCEEDED, result={
+            'snapshot_id': result.snapshot_id,
+            'status_code': result.status_code,
+        })
+    elif result.status_code == 429 or result.status_code >= 500 or result.status_code == 401:
+        _retry_later(job, result.error or f'Spotify returned {result.status_code}')
+    else:
+        _finish(job, PlaylistJob.FAILED, result={'status_code': result.status_code},
+                error=result.error or f'Spotify returned {result.status_code}')
+
+
+def _worker_loop():
+    while True:
+        close_old_connections()
+        try:
+            job = claim_next_job()
+            if job is not None:
+                run_job(job)
+                continue
+        except Exception:
+            logger.exception('Playlist job worker error')
+
+        _wake_up.wait(settings.JOB_POLL_SECONDS)
+        _wake_up.clear()
+
+
+def ensure_workers():
+    """Start this process's job workers if they aren't running."""
+    if settings.JOB_WORKERS <= 0:
+        return
+
+    pid = os.getpid()
+    with _workers_lock:
+        if _workers['pid'] == pid and all(t.is_alive() for t in _workers['threads']):
+            return
+
+        threads = [t for t in _workers['threads'] if t.is_alive()] if _workers['pid'] == pid else []
+        while len(threads) < settings.JOB_WORKERS:
+            thread = threading.Thread(
+                target=_worker_loop,
+                name=f'playlist-job-worker-{len(threads)}',
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+
+        _workers['pid'] = pid
+        _workers['threads'] = threads
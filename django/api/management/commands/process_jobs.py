@@ -0,0 +1,38 @@
+"""
+Run playlist job workers in the foreground.
+
+Serving processes already run JOB_WORKERS worker threads each; this
+command is for draining the outbox from a separate process, e.g. with
+JOB_WORKERS=0 on the web containers.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued playlist jobs until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=max(settings.JOB_WORKERS, 1),
+            help='Number of worker threads'
+        )
+
+    def handle(self, *args, **options):
+        settings.JOB_WORKERS = options['workers']
+        jobs.ensure_workers()
+        self.stdout.write(f"Processing playlist jobs with {options['workers']} workers")
+
+        try:
+            while True:
+                time.sleep(settings.JOB_POLL_SECONDS)
+                # Restart any worker thread that died
+                jobs.ensure_workers()
+        except KeyboardInterrupt:
+            pass
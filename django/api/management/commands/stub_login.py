@@ -0,0 +1,68 @@
+"""
+Log the service in against the benchmark Spotify stub, without a browser.
+
+The browser login can't reach the stub from the host (it only lives on
+the compose network), so this runs the same authorization code exchange
+as /callback from inside a container and stores the tokens:
+
+    docker compose -f docker-compose.yml -f docker-compose.bench.yml \
+        exec django python manage.py stub_login
+
+The stub accepts any code. Against real Spotify, use /login instead.
+"""
+import base64
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import spotify_client, token_manager
+from api.views.auth import profile_from_user_data
+
+
+class Command(BaseCommand):
+    help = 'Log in against the benchmark Spotify stub and store the tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--code',
+            default='stub-code',
+            help='Authorization code to exchange'
+        )
+
+    def handle(self, *args, **options):
+        credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
+        headers = {
+            'Authorization': f'Basic {base64.b64encode(credentials.encode()).decode()}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        data = {
+            'grant_type': 'authorization_code',
+            'code': options['code'],
+            'redirect_uri': settings.SPOTIFY_REDIRECT_URI,
+        }
+
+        try:
+            response = spotify_client.post(
+                f'{spotify_client.ACCOUNTS_BASE_URL}/api/token', headers=headers, data=data
+            )
+            response.raise_for_status()
+            token_data = response.json()
+
+            me = spotify_client.get(f'{spotify_client.API_BASE_URL}/me', headers={
+                'Authorization': f"Bearer {token_data.get('access_token')}"
+            })
+            me.raise_for_status()
+        except (requests.exceptions.RequestException, spotify_client.UpstreamUnavailable) as e:
+            raise CommandError(f'Login against {spotify_client.ACCOUNTS_BASE_URL} failed: {e}')
+
+        profile = profile_from_user_data(me.json())
+        token_manager.save_tokens(
+            access_token=token_data.get('access_token'),
+            refresh_token=token_data.get('refresh_token'),
+            token_type=token_data.get('token_type'),
+            expires_in=token_data.get('expires_in'),
+            account=profile['id']
+        )
+        token_manager.save_profile(profile, account=profile['id'])
+        self.stdout.write(f"Logged in as {profile['id']}")
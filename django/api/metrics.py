@@ -0,0 +1,163 @@
+"""
+Prometheus metrics for the hot paths.
+
+Recorded here:
+- latency of every request Django serves, by endpoint, method and status;
+- latency of every call to Spotify, by host, method and status;
+- token refreshes (outcome and duration) and 401 retries;
+- token cache hits/misses and the time spent reading the token file;
+- requests in flight, both served and upstream;
+- circuit breaker state per Spotify host and the calls it turned away;
+- the rate limiter's queue, waits, 429 pauses and rejections, and retries;
+- playlist changes answered by an identical one already in flight.
+
+Metrics are plain prometheus_client objects, so recording one is a lock
+and an addition. When PROMETHEUS_MULTIPROC_DIR is set (see the
+Dockerfile) every worker process writes its values to mmapped files in
+that directory and /metrics adds them up across processes.
+"""
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Every entry point that imports Django records metrics (manage.py migrate
+# and process_jobs too), not only the server started by the Dockerfile's
+# CMD, so don't count on the directory having been created beforehand
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+REQUEST_LATENCY = Histogram(
+    'spotify_controller_request_duration_seconds',
+    'Time spent serving a request',
+    ['endpoint', 'method', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'spotify_controller_requests_in_flight',
+    'Requests currently being served',
+    multiprocess_mode='livesum'
+)
+
+UPSTREAM_LATENCY = Histogram(
+    'spotify_upstream_request_duration_seconds',
+    'Time spent on a single call to Spotify, retries counted separately',
+    ['host', 'method', 'status']
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'spotify_upstream_requests_in_flight',
+    'Calls to Spotify currently waiting for a response',
+    ['host'],
+    multiprocess_mode='livesum'
+)
+CIRCUIT_STATE = Gauge(
+    'spotify_upstream_circuit_state',
+    'Circuit breaker state per Spotify host: 0 closed, 1 half-open, 2 open',
+    ['host'],
+    multiprocess_mode='max'
+)
+CIRCUIT_REJECTED = Counter(
+    'spotify_upstream_circuit_rejected_total',
+    'Calls to Spotify refused because the host\'s circuit breaker was open',
+    ['host']
+)
+
+RATE_LIMIT_QUEUE_DEPTH = Gauge(
+    'spotify_rate_limit_queue_depth',
+    'Calls to Spotify waiting for a rate limiter slot',
+    multiprocess_mode='livesum'
+)
+RATE_LIMIT_WAIT = Histogram(
+    'spotify_rate_limit_wait_seconds',
+    'Time a call to Spotify waited for its rate limiter slot (0 if none)',
+    buckets=(0, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+RATE_LIMIT_PAUSES = Counter(
+    'spotify_rate_limit_pauses_total',
+    'Spotify 429 answers that paused the rate limiter for their Retry-After'
+)
+RATE_LIMIT_REJECTED = Counter(
+    'spotify_rate_limit_rejected_total',
+    'Calls to Spotify refused because they would wait longer than SPOTIFY_RATE_LIMIT_MAX_WAIT'
+)
+UPSTREAM_RETRIES = Counter(
+    'spotify_upstream_retries_total',
+    'Calls to Spotify retried after a 429 or 5xx answer'
+)
+
+COLLAPSED_REQUESTS = Counter(
+    'spotify_collapsed_requests_total',
+    'Playlist changes that waited for an identical one in flight instead of calling Spotify',
+    ['operation']
+)
+
+TOKEN_REFRESHES = Counter(
+    'spotify_token_refreshes_total',
+    'Access token refresh attempts against the accounts service',
+    ['result']
+)
+TOKEN_REFRESH_LATENCY = Histogram(
+    'spotify_token_refresh_duration_seconds',
+    'Time spent refreshing the access token'
+)
+UNAUTHORIZED_RETRIES = Counter(
+    'spotify_unauthorized_retries_total',
+    'Spotify calls answered with 401 and retried with a refreshed token',
+    ['result']
+)
+
+TOKEN_CACHE = Counter(
+    'spotify_token_cache_lookups_total',
+    'Token lookups served from the in-process cache (hit) or the file (miss)',
+    ['result']
+)
+# Bound once; token lookups are too hot for a labels() call each time
+TOKEN_CACHE_HIT = TOKEN_CACHE.labels('hit')
+TOKEN_CACHE_MISS = TOKEN_CACHE.labels('miss')
+TOKEN_FILE_READ_LATENCY = Histogram(
+    'spotify_token_file_read_duration_seconds',
+    'Time spent reading and parsing the token file',
+    buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1)
+)
+
+
+@contextmanager
+def upstream_call(method, url):
+    """
+    Time one call to Spotify.
+
+    Set `call['status']` to the response status inside the block; calls
+    that raise are recorded with status "error".
+    """
+    host = urlsplit(url).hostname or ''
+    call = {'status': 'error'}
+    in_flight = UPSTREAM_IN_FLIGHT.labels(host)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        in_flight.dec()
+        UPSTREAM_LATENCY.labels(host, method.upper(), str(call['status'])).observe(
+            time.perf_counter() - start
+        )
+
+
+def render():
+    """Current metrics in the Prometheus text format, and their content type."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,162 @@
+"""
+Middleware for the spotify_controller project.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+from api import deadline, metrics, timing
+
+
+def _endpoint(request):
+    """The matched URL pattern, so the label set stays bounded."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route
+
+
+class MetricsMiddleware:
+    """
+    Record request count, latency and in-flight requests (api.metrics).
+
+    Works under WSGI and ASGI; place it first so the time spent in the
+    other middleware is included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _observe(self, request, status, start):
+        metrics.REQUEST_LATENCY.labels(
+            _endpoint(request), request.method, str(status)
+        ).observe(time.perf_counter() - start)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        status = 500
+        start = time.perf_counter()
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            self._observe(request, status, start)
+
+    async def __acall__(self, request):
+        status = 500
+        start = time.perf_counter()
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            self._observe(request, status, start)
+
+
+class DeadlineMiddleware:
+    """
+    Give every request SPOTIFY_REQUEST_DEADLINE seconds for its calls to
+    Spotify (api.deadline); past that they fail with a 503.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with deadline.budget(settings.SPOTIFY_REQUEST_DEADLINE):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with deadline.budget(settings.SPOTIFY_REQUEST_DEADLINE):
+            return await self.get_response(request)
+
+
+class TimingMiddleware:
+    """
+    Time each request's stages (api.timing), send them back in a
+    Server-Timing header and log slow requests.
+
+    Place it right after MetricsMiddleware, and ViewTimingMiddleware last,
+    so the time spent in the middleware in between can be told apart from
+    the view.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _finish(self, request, response, recorder, start):
+        total = time.perf_counter() - start
+        recorder.add('middleware', max(0.0, total - recorder.spans.get('view', 0.0)))
+        recorder.add('total', total)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timing.server_timing(recorder)
+        timing.log_if_slow(request, response.status_code, recorder)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        recorder, token = timing.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.stop(token)
+        self._finish(request, response, recorder, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        recorder, token = timing.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.stop(token)
+        self._finish(request, response, recorder, start)
+        return response
+
+
+class ViewTimingMiddleware:
+    """Record the view's own time for TimingMiddleware; place it last."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with timing.span('view'):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with timing.span('view'):
+            return await self.get_response(request)
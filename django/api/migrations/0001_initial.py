@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirroredPlaylist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playlist_id', models.CharField(max_length=64, unique=True)),
+                ('snapshot_id', models.CharField(blank=True, max_length=128)),
+                ('synced_at', models.DateTimeField()),
+                ('checked_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirroredTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uri', models.CharField(max_length=128)),
+                ('position', models.IntegerField()),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='api.mirroredplaylist')),
+            ],
+            options={
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['playlist', 'uri'], name='api_mirrore_playlis_f53a7a_idx'), models.Index(fields=['playlist', 'position'], name='api_mirrore_playlis_5bfc8d_idx')],
+            },
+        ),
+    ]
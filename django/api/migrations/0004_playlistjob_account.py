@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlistjob',
+            name='account',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
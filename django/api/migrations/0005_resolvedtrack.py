@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_playlistjob_account'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResolvedTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('isrc', models.CharField(max_length=12, unique=True)),
+                ('track_id', models.CharField(blank=True, max_length=22)),
+                ('resolved_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,119 @@
+"""
+Database models for the Spotify controller.
+"""
+import uuid
+
+from django.db import models
+
+
+class MirroredPlaylist(models.Model):
+    """Local copy of a playlist's contents, valid for `snapshot_id`."""
+    playlist_id = models.CharField(max_length=64, unique=True)
+    # Empty when the local copy is known to be out of date
+    snapshot_id = models.CharField(max_length=128, blank=True)
+    synced_at = models.DateTimeField()
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.playlist_id
+
+
+class MirroredTrack(models.Model):
+    """One occurrence of a track in a mirrored playlist."""
+    playlist = models.ForeignKey(MirroredPlaylist, related_name='tracks', on_delete=models.CASCADE)
+    uri = models.CharField(max_length=128)
+    # Sort key, not the exact Spotify position: removals leave gaps
+    position = models.IntegerField()
+
+    class Meta:
+        ordering = ['position']
+        indexes = [
+            models.Index(fields=['playlist', 'uri']),
+            models.Index(fields=['playlist', 'position']),
+        ]
+
+    def __str__(self):
+        return self.uri
+
+
+class PlaylistJob(models.Model):
+    """A playlist change accepted for asynchronous execution (the outbox)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    ADD = 'add'
+    REMOVE = 'remove'
+    OPERATION_CHOICES = [
+        (ADD, 'Add'),
+        (REMOVE, 'Remove'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    operation = models.CharField(max_length=16, choices=OPERATION_CHOICES)
+    playlist_id = models.CharField(max_length=64)
+    song_id = models.CharField(max_length=128)
+    # Spotify user id whose token makes the change; blank for the default account
+    account = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Not picked up before this time (retry backoff)
+    available_at = models.DateTimeField()
+    # A running job whose lease has expired belongs to a dead worker
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.operation} {self.song_id} ({self.status})'
+
+
+class IdempotencyRecord(models.Model):
+    """Stored outcome of a playlist mutation made with an Idempotency-Key."""
+    IN_PROGRESS = 'in_progress'
+    COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (IN_PROGRESS, 'In progress'),
+        (COMPLETED, 'Completed'),
+    ]
+
+    # Endpoint path plus the caller's key
+    key = models.CharField(max_length=512, unique=True)
+    # Hash of the request body, so a key can't be reused for another request
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=IN_PROGRESS)
+    response_status = models.IntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    content_type = models.CharField(max_length=128, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class ResolvedTrack(models.Model):
+    """Cached result of looking up an ISRC with Spotify search."""
+    isrc = models.CharField(max_length=12, unique=True)
+    # Blank when Spotify has no track with this ISRC
+    track_id = models.CharField(max_length=22, blank=True)
+    resolved_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.isrc} -> {self.track_id or "not found"}'
@@ -0,0 +1,262 @@
+"""
+Local mirror of playlist contents for membership lookups.
+
+Playlist contents are kept in the Django database (MirroredPlaylist /
+MirroredTrack), indexed by playlist and track URI. A mirror is trusted
+for PLAYLIST_MIRROR_CHECK_INTERVAL seconds; after that one cheap
+snapshot_id request decides whether the full playlist has to be fetched
+again. Our own adds and removes are applied to the mirror directly from
+their responses, so they don't force a re-fetch, but only when the caller
+says which version of the playlist it changed and that is the mirror's
+version. Otherwise someone else may have edited the playlist in between,
+and the mirror is marked stale instead of taking on the new snapshot_id.
+
+Changes made by someone else at the same moment as one of ours can be
+masked by that shortcut, so every mirror is fully re-fetched at least
+every PLAYLIST_MIRROR_MAX_AGE seconds.
+
+A playlist's contents are the same whichever account reads them, so
+mirrors are shared between accounts; `account` only picks the token used
+to fetch them.
+
+Most playlists written to are never read through the mirror, so each
+process keeps the set of mirrored playlist IDs, reloaded every
+PLAYLIST_MIRROR_CHECK_INTERVAL seconds, and skips the database for
+writes to the others. A mirror another process creates in the meantime
+may miss one of those writes until its next snapshot check, the same
+window as for changes made by someone else.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from api import spotify_api
+from api.models import MirroredPlaylist, MirroredTrack
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+QUERY_CHUNK_SIZE = 500
+
+_uris_lock = threading.Lock()
+_uris_cache = OrderedDict()
+
+_mirrored_lock = threading.Lock()
+_mirrored = {'ids': frozenset(), 'loaded_at': None}
+
+
+def _is_mirrored(playlist_id):
+    """Whether a playlist may have a mirror (see the module docstring)."""
+    now = time.monotonic()
+    with _mirrored_lock:
+        loaded_at = _mirrored['loaded_at']
+        if loaded_at is not None and now - loaded_at < settings.PLAYLIST_MIRROR_CHECK_INTERVAL:
+            return playlist_id in _mirrored['ids']
+
+    ids = frozenset(MirroredPlaylist.objects.values_list('playlist_id', flat=True))
+    with _mirrored_lock:
+        _mirrored.update(ids=ids, loaded_at=now)
+    return playlist_id in ids
+
+
+def _note_mirrored(playlist_id):
+    with _mirrored_lock:
+        if playlist_id not in _mirrored['ids']:
+            _mirrored['ids'] = _mirrored['ids'] | {playlist_id}
+
+
+def replace(playlist_id, uris, snapshot_id):
+    """Store the full contents of a playlist as of `snapshot_id`."""
+    now = timezone.now()
+    with transaction.atomic():
+        mirror, _ = MirroredPlaylist.objects.update_or_create(
+            playlist_id=playlist_id,
+            defaults={
+                'snapshot_id': snapshot_id or '',
+                'synced_at': now,
+                'checked_at': now,
+            }
+        )
+        mirror.tracks.all().delete()
+        MirroredTrack.objects.bulk_create(
+            [MirroredTrack(playlist=mirror, uri=uri, position=i) for i, uri in enumerate(uris)],
+            batch_size=QUERY_CHUNK_SIZE
+        )
+    _note_mirrored(playlist_id)
+    return mirror
+
+
+def sync_playlist(playlist_id, account=None):
+    """Fetch the whole playlist from Spotify and replace the local copy."""
+    # Read the snapshot first: if the playlist changes while the pages are
+    # fetched, the stored snapshot is already outdated and the next check
+    # re-syncs instead of trusting a mixed copy.
+    snapshot_id = spotify_api.get_playlist_snapshot_id(playlist_id, account)
+    uris = spotify_api.get_playlist_track_uris(playlist_id, account)
+    return replace(playlist_id, uris, snapshot_id)
+
+
+def get_fresh_mirror(playlist_id, account=None):
+    """Get the mirror of a playlist, re-syncing it if Spotify's copy changed."""
+    now = timezone.now()
+    mirror = MirroredPlaylist.objects.filter(playlist_id=playlist_id).first()
+
+    if mirror is not None and mirror.snapshot_id:
+        if now - mirror.checked_at < timedelta(seconds=settings.PLAYLIST_MIRROR_CHECK_INTERVAL):
+            return mirror
+
+        if now - mirror.synced_at < timedelta(seconds=settings.PLAYLIST_MIRROR_MAX_AGE):
+            if spotify_api.get_playlist_snapshot_id(playlist_id, account) == mirror.snapshot_id:
+                MirroredPlaylist.objects.filter(pk=mirror.pk).update(checked_at=now)
+                mirror.checked_at = now
+                return mirror
+
+    return sync_playlist(playlist_id, account)
+
+
+def track_counts(playlist_id, uris, account=None):
+    """
+    Count the occurrences of each URI in a playlist.
+
+    Returns (mirror, {uri: count}); URIs not in the playlist are absent.
+    """
+    mirror = get_fresh_mirror(playlist_id, account)
+    wanted = list(dict.fromkeys(uris))
+    counts = {}
+    for start in range(0, len(wanted), QUERY_CHUNK_SIZE):
+        rows = (
+            MirroredTrack.objects
+            .filter(playlist=mirror, uri__in=wanted[start:start + QUERY_CHUNK_SIZE])
+            .values('uri')
+            .annotate(count=Count('id'))
+            .values_list('uri', 'count')
+        )
+        counts.update(rows)
+    return mirror, counts
+
+
+def track_uris(mirror):
+    """
+    The URIs in a mirror, in playlist order.
+
+    Kept in memory per (playlist, snapshot_id) for the
+    PLAYLIST_READ_CACHE_ENTRIES most recently read playlists: a snapshot
+    always has the same contents, so repeated reads skip the database.
+    """
+    key = (mirror.playlist_id, mirror.snapshot_id)
+    if mirror.snapshot_id:
+        with _uris_lock:
+            uris = _uris_cache.get(key)
+            if uris is not None:
+                _uris_cache.move_to_end(key)
+                return list(uris)
+
+    uris = tuple(mirror.tracks.order_by('position').values_list('uri', flat=True))
+    if mirror.snapshot_id and settings.PLAYLIST_READ_CACHE_ENTRIES > 0:
+        with _uris_lock:
+            _uris_cache[key] = uris
+            _uris_cache.move_to_end(key)
+            while len(_uris_cache) > settings.PLAYLIST_READ_CACHE_ENTRIES:
+                _uris_cache.popitem(last=False)
+    return list(uris)
+
+
+def contains(playlist_id, uri, account=None):
+    """Whether a track is currently in a playlist."""
+    _mirror, counts = track_counts(playlist_id, [uri], account)
+    return uri in counts
+
+
+def _mark_stale(mirror):
+    MirroredPlaylist.objects.filter(pk=mirror.pk).update(snapshot_id='')
+
+
+def _based_on_mirror(mirror, base_snapshot_id):
+    """Whether a write was made against the version the mirror holds."""
+    return base_snapshot_id is not None and base_snapshot_id == mirror.snapshot_id
+
+
+def record_added(playlist_id, uris, snapshot_id, position=None, base_snapshot_id=None):
+    """
+    Apply one of our own successful adds to the mirror, if there is one.
+
+    `base_snapshot_id` is the version the add was made against; without
+    it (or if it isn't the mirror's) the mirror is marked stale.
+    """
+    try:
+        if not _is_mirrored(playlist_id):
+            return
+        with transaction.atomic():
+            mirror = MirroredPlaylist.objects.filter(playlist_id=playlist_id).first()
+            if mirror is None or not mirror.snapshot_id:
+                return
+
+            if position is not None or not _based_on_mirror(mirror, base_snapshot_id):
+                # Inserting shifts everything after it; simpler to re-sync.
+                # Without a known base the playlist may have changed since.
+                _mark_stale(mirror)
+                return
+
+            last = mirror.tracks.aggregate(last=Max('position'))['last']
+            start = last + 1 if last is not None else 0
+            MirroredTrack.objects.bulk_create(
+                [MirroredTrack(playlist=mirror, uri=uri, position=start + i) for i, uri in enumerate(uris)],
+                batch_size=QUERY_CHUNK_SIZE
+            )
+            MirroredPlaylist.objects.filter(pk=mirror.pk).update(
+                snapshot_id=snapshot_id or '',
+                checked_at=timezone.now()
+            )
+    except Exception:
+        logger.exception('Could not update mirror of playlist %s', playlist_id)
+
+
+def record_removed(playlist_id, tracks, snapshot_id, base_snapshot_id=None):
+    """
+    Apply one of our own successful removes to the mirror, if there is one.
+
+    `base_snapshot_id` works as in record_added.
+    """
+    try:
+        if not _is_mirrored(playlist_id):
+            return
+        with transaction.atomic():
+            mirror = MirroredPlaylist.objects.filter(playlist_id=playlist_id).first()
+            if mirror is None or not mirror.snapshot_id:
+                return
+
+            if (
+                any(track.get('positions') is not None for track in tracks)
+                or not _based_on_mirror(mirror, base_snapshot_id)
+            ):
+                # Positional removes are resolved against a snapshot we may
+                # not have; re-sync rather than guess
+                _mark_stale(mirror)
+                return
+
+            uris = [track['uri'] for track in tracks]
+            for start in range(0, len(uris), QUERY_CHUNK_SIZE):
+                mirror.tracks.filter(uri__in=uris[start:start + QUERY_CHUNK_SIZE]).delete()
+            MirroredPlaylist.objects.filter(pk=mirror.pk).update(
+                snapshot_id=snapshot_id or '',
+                checked_at=timezone.now()
+            )
+    except Exception:
+        logger.exception('Could not update mirror of playlist %s', playlist_id)
+
+
+def record_reordered(playlist_id):
+    """Note one of our own reorders; the mirror is re-synced on next use."""
+    try:
+        if not _is_mirrored(playlist_id):
+            return
+        MirroredPlaylist.objects.filter(playlist_id=playlist_id).update(snapshot_id='')
+    except Exception:
+        logger.exception('Could not update mirror of playlist %s', playlist_id)
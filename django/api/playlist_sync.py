@@ -0,0 +1,257 @@
+"""
+Make a playlist hold exactly a target list of tracks, with as few edits as
+possible.
+
+plan() compares the current track URIs with the target as multisets: if
+a track is wanted n times, its first n occurrences stay and any later
+ones are removed. Tracks wanted more often than they appear are added.
+Nothing that already matches is touched, so a sync that changes one
+track costs one Spotify call instead of a full rewrite.
+
+Order is only enforced when asked for. A reorder keeps the longest run
+of tracks already in the right relative order (a longest increasing
+subsequence of their target positions) and moves only the others,
+moving neighbouring tracks together in one range. New tracks are then
+inserted at their target positions. Without a reorder, new tracks are
+appended in target order.
+
+Items Spotify no longer has a track for (empty URIs) are left in the
+playlist; a reorder moves them to the end.
+
+apply() sends the plan as DELETE, PUT (reorder) and POST calls of up to
+100 items each, chaining snapshot_ids so positions always refer to the
+version the previous call produced. It stops at the first failed call.
+"""
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+import requests
+
+from api import playlist_mirror, spotify_api, spotify_client
+
+REMOVE = 'remove'
+MOVE = 'move'
+ADD = 'add'
+
+
+def _longest_increasing(ranks):
+    """Indexes into `ranks` of one longest strictly increasing subsequence."""
+    tails = []      # smallest tail rank of an increasing run of each length
+    tail_index = []
+    previous = [None] * len(ranks)
+    for i, rank in enumerate(ranks):
+        length = bisect_left(tails, rank)
+        if length == len(tails):
+            tails.append(rank)
+            tail_index.append(i)
+        else:
+            tails[length] = rank
+            tail_index[length] = i
+        previous[i] = tail_index[length - 1] if length else None
+
+    keep = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        keep.add(i)
+        i = previous[i]
+    return keep
+
+
+def _moves(ranks):
+    """
+    Range moves that sort a list whose items have the given distinct ranks
+    0..n-1. Returns [(range_start, range_length, insert_before)] in
+    Spotify's terms: indexes refer to the list as it is before each move.
+    """
+    items = list(ranks)
+    placed = [False] * len(items)
+    for i in _longest_increasing(items):
+        placed[items[i]] = True
+
+    moves = []
+    rank = 0
+    while rank < len(items):
+        if placed[rank]:
+            rank += 1
+            continue
+
+        start = items.index(rank)
+        length = 1
+        while (start + length < len(items) and items[start + length] == rank + length
+               and not placed[rank + length]):
+            length += 1
+        block = items[start:start + length]
+        rest = items[:start] + items[start + length:]
+
+        # Everything ranked lower that is already placed is in order, so
+        # the block goes right after the highest of them
+        target = 0
+        for i, other in enumerate(rest):
+            if other < rank and placed[other]:
+                target = i + 1
+        insert_before = target if target <= start else target + length
+
+        if insert_before not in (start, start + length):
+            moves.append((start, length, insert_before))
+        items = rest[:target] + block + rest[target:]
+        for other in block:
+            placed[other] = True
+        rank += length
+    return moves
+
+
+def plan(current, target, reorder=False):
+    """
+    Work out the edits that turn `current` into `target` (lists of URIs).
+
+    Returns a dict with:
+    - removes: [(position, uri)], positions in `current`, highest first;
+    - moves: [(range_start, range_length, insert_before)], applied after
+      the removes;
+    - adds: [(position, uris)], applied in order after the moves;
+      position None appends;
+    - final: the playlist as it will be afterwards;
+    - unchanged: how many tracks stay where they are relative to each other.
+    """
+    wanted = Counter(target)
+    seen = Counter()
+    kept = []
+    removes = []
+    for position, uri in enumerate(current):
+        seen[uri] += 1
+        if not uri or seen[uri] <= wanted[uri]:
+            kept.append(uri)
+        else:
+            removes.append((position, uri))
+    removes.reverse()
+
+    # The k-th kept occurrence of a URI stands for its k-th target occurrence
+    target_positions = defaultdict(list)
+    for index, uri in enumerate(target):
+        target_positions[uri].append(index)
+    claimed = Counter()
+    kept_targets = []
+    unavailable = len(target)
+    for uri in kept:
+        if uri:
+            kept_targets.append(target_positions[uri][claimed[uri]])
+            claimed[uri] += 1
+        else:
+            kept_targets.append(unavailable)
+            unavailable += 1
+
+    new = sorted(
+        index
+        for uri, indexes in target_positions.items()
+        for index in indexes[claimed[uri]:]
+    )
+
+    if not reorder:
+        moves = []
+        adds = []
+        appended = [target[index] for index in new]
+        for start in range(0, len(appended), spotify_api.MAX_ITEMS_PER_REQUEST):
+            adds.append((None, appended[start:start + spotify_api.MAX_ITEMS_PER_REQUEST]))
+        final = kept + appended
+        unchanged = len(kept)
+    else:
+        order = sorted(range(len(kept_targets)), key=kept_targets.__getitem__)
+        ranks = [0] * len(order)
+        for rank, i in enumerate(order):
+            ranks[i] = rank
+        moves = _moves(ranks)
+        unchanged = len(kept) - sum(length for _start, length, _before in moves)
+
+        # Every earlier target track is in place by the time a run is
+        # inserted, so its target index is also its playlist position
+        adds = []
+        for index in new:
+            last = adds[-1] if adds else None
+            if (last is not None and last[0] + len(last[1]) == index
+                    and len(last[1]) < spotify_api.MAX_ITEMS_PER_REQUEST):
+                last[1].append(target[index])
+            else:
+                adds.append((index, [target[index]]))
+        final = list(target) + [uri for uri in kept if not uri]
+
+    return {
+        'removes': removes,
+        'moves': moves,
+        'adds': adds,
+        'final': final,
+        'unchanged': unchanged,
+    }
+
+
+def _calls(edits):
+    """The Spotify calls for a plan, in order: (action, count, arguments)."""
+    removes = edits['removes']
+    for start in range(0, len(removes), spotify_api.MAX_ITEMS_PER_REQUEST):
+        chunk = removes[start:start + spotify_api.MAX_ITEMS_PER_REQUEST]
+        positions = defaultdict(list)
+        for position, uri in chunk:
+            positions[uri].append(position)
+        tracks = [{'uri': uri, 'positions': found} for uri, found in positions.items()]
+        yield REMOVE, len(chunk), tracks
+
+    for move in edits['moves']:
+        yield MOVE, move[1], move
+
+    for position, uris in edits['adds']:
+        yield ADD, len(uris), (position, uris)
+
+
+def apply(playlist_id, edits, snapshot_id=None, account=None):
+    """
+    Send a plan to Spotify.
+
+    Returns (snapshot_id, steps, failed_status): the last snapshot_id
+    Spotify returned, one result per call made, and the status of the
+    call that failed (None if every call succeeded).
+    """
+    snapshot = snapshot_id
+    steps = []
+
+    for action, count, arguments in _calls(edits):
+        step = {'action': action, 'count': count}
+        steps.append(step)
+        try:
+            if action == REMOVE:
+                response = spotify_api.remove_tracks(playlist_id, arguments, snapshot_id=snapshot, account=account)
+                expected, default = 200, 'Failed to remove songs from playlist'
+            elif action == MOVE:
+                range_start, range_length, insert_before = arguments
+                response = spotify_api.reorder_tracks(
+                    playlist_id, range_start, insert_before,
+                    range_length=range_length, snapshot_id=snapshot, account=account
+                )
+                expected, default = 200, 'Failed to reorder playlist'
+            else:
+                position, uris = arguments
+                response = spotify_api.add_tracks(
+                    playlist_id, uris, position=position, account=account, base_snapshot_id=snapshot
+                )
+                expected, default = 201, 'Failed to add songs to playlist'
+        except spotify_client.UpstreamUnavailable as e:
+            status_code, error = 503, str(e)
+        except requests.exceptions.RequestException as e:
+            status_code, error = 500, f'Request to Spotify API failed: {str(e)}'
+        else:
+            status_code = response.status_code
+            if status_code == expected:
+                error = None
+            elif status_code == 401:
+                error = 'Access token expired and refresh failed. Please re-authenticate at /login'
+            else:
+                error = spotify_api.error_message(response, default)
+
+        if error is not None:
+            step.update(success=False, status_code=status_code, error=error)
+            return snapshot, steps, status_code
+
+        snapshot = response.json().get('snapshot_id') or snapshot
+        step.update(success=True, snapshot_id=snapshot)
+
+    if steps:
+        playlist_mirror.replace(playlist_id, edits['final'], snapshot)
+    return snapshot, steps, None
@@ -0,0 +1,108 @@
+"""
+Rate limiting for calls to the Spotify Web API.
+
+Calls are scheduled through a token bucket (implemented as GCRA: every
+caller reserves the next free slot, so waiting callers are served in
+arrival order). A 429 pauses the whole bucket until its Retry-After has
+passed, and callers resume one slot at a time afterwards instead of all
+at once. Nobody waits longer than SPOTIFY_RATE_LIMIT_MAX_WAIT; callers
+that would are rejected with UpstreamUnavailable so they can fail fast.
+
+The bucket and the Retry-After pause are per process: with N worker
+processes in each of C containers, Spotify sees up to
+N x C x SPOTIFY_RATE_LIMIT_PER_SECOND calls a second, so set the rate
+to the account's budget divided by that. Queue depth, waits, 429
+pauses, rejections and retries are exported as Prometheus metrics
+(api/metrics.py), added up over the processes.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+from api import metrics, timing
+
+_lock = threading.Lock()
+_state = {
+    # Theoretical arrival time of the next request (GCRA)
+    'tat': 0.0,
+    # No requests before this time (set from Retry-After)
+    'paused_until': 0.0,
+}
+
+
+class UpstreamUnavailable(Exception):
+    """Spotify can't be called right now; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _reserve(max_wait=None):
+    """Reserve the next free slot and return how long to wait for it."""
+    rate = settings.SPOTIFY_RATE_LIMIT_PER_SECOND
+    interval = 1.0 / rate
+    tolerance = (settings.SPOTIFY_RATE_LIMIT_BURST - 1) * interval
+    if max_wait is None or max_wait > settings.SPOTIFY_RATE_LIMIT_MAX_WAIT:
+        max_wait = settings.SPOTIFY_RATE_LIMIT_MAX_WAIT
+
+    with _lock:
+        now = time.monotonic()
+        start = max(now, _state['tat'] - tolerance, _state['paused_until'])
+        wait = start - now
+
+        if wait > max_wait:
+            metrics.RATE_LIMIT_REJECTED.inc()
+            raise UpstreamUnavailable(
+                'Spotify rate limit reached, try again later',
+                retry_after=wait
+            )
+
+        _state['tat'] = max(_state['tat'], start) + interval
+
+    metrics.RATE_LIMIT_WAIT.observe(max(0.0, wait))
+    if wait > 0:
+        metrics.RATE_LIMIT_QUEUE_DEPTH.inc()
+    return wait
+
+
+def _done_waiting():
+    metrics.RATE_LIMIT_QUEUE_DEPTH.dec()
+
+
+def acquire(max_wait=None):
+    """
+    Block until this caller may send a request to Spotify, waiting no
+    longer than `max_wait` (or SPOTIFY_RATE_LIMIT_MAX_WAIT if shorter).
+    """
+    wait = _reserve(max_wait)
+    if wait > 0:
+        timing.record('ratelimit', wait)
+        try:
+            time.sleep(wait)
+        finally:
+            _done_waiting()
+
+
+async def acquire_async(max_wait=None):
+    """Async version of acquire()."""
+    wait = _reserve(max_wait)
+    if wait > 0:
+        timing.record('ratelimit', wait)
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            _done_waiting()
+
+
+def pause(seconds):
+    """Stop all requests for `seconds` (Spotify answered 429)."""
+    metrics.RATE_LIMIT_PAUSES.inc()
+    with _lock:
+        _state['paused_until'] = max(_state['paused_until'], time.monotonic() + seconds)
+
+
+def record_retry():
+    metrics.UPSTREAM_RETRIES.inc()
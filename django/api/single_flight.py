@@ -0,0 +1,96 @@
+"""
+Collapsing of identical in-flight single-track playlist changes.
+
+Retrying VMs often send the same add or remove several times at once.
+The first request for an (operation, playlist, track URI, account) key
+makes the call; identical requests arriving while it runs attach to it
+and get its result, or its exception, instead of calling Spotify again.
+An add then happens once instead of adding duplicates, and a repeated
+remove doesn't fail on a track that is already gone. Once the call has
+finished the key is free: a later identical request is sent again.
+
+Keys use the track URI the views resolve song_id to, so a track ID, its
+spotify:track: URI and its open.spotify.com link collapse together.
+
+Requests are collapsed within a process (and per event loop for the async
+views), like the coalescer's batches. Repeats that land on different
+workers are caught by Idempotency-Key if the caller sends one.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+
+from api import metrics, timing
+
+_lock = threading.Lock()
+_calls = {}
+_tasks = {}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'exception')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+def key(operation, playlist_id, track_uri, account=None):
+    return (operation, playlist_id, track_uri, account)
+
+
+def do(flight_key, call):
+    """
+    Run `call()` unless an identical call is in flight; then wait for that
+    one and return its result (or raise its exception).
+    """
+    if not settings.SPOTIFY_SINGLE_FLIGHT:
+        return call()
+
+    with _lock:
+        flight = _calls.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _calls[flight_key] = _Call()
+
+    if not leader:
+        metrics.COLLAPSED_REQUESTS.labels(flight_key[0]).inc()
+        with timing.span('collapse'):
+            flight.done.wait()
+        if flight.exception is not None:
+            raise flight.exception
+        return flight.result
+
+    try:
+        flight.result = call()
+        return flight.result
+    except Exception as e:
+        flight.exception = e
+        raise
+    finally:
+        with _lock:
+            del _calls[flight_key]
+        flight.done.set()
+
+
+async def do_async(flight_key, call):
+    """
+    do() for coroutines: `call()` returns an awaitable. It runs as a task
+    of its own, so a caller that goes away doesn't cancel it for the
+    others.
+    """
+    if not settings.SPOTIFY_SINGLE_FLIGHT:
+        return await call()
+
+    task_key = (asyncio.get_running_loop(), flight_key)
+    task = _tasks.get(task_key)
+    if task is None:
+        task = _tasks[task_key] = asyncio.ensure_future(call())
+        task.add_done_callback(lambda _task: _tasks.pop(task_key, None))
+        return await asyncio.shield(task)
+
+    metrics.COLLAPSED_REQUESTS.labels(flight_key[0]).inc()
+    with timing.span('collapse'):
+        return await asyncio.shield(task)
@@ -0,0 +1,284 @@
+"""
+Spotify Web API operations shared by the playlist views.
+
+Wraps the pooled client with an account's access token, including the
+refresh-and-retry on a 401, and knows about Spotify's per-request limits.
+Every operation takes an optional `account` (a Spotify user id); None
+means the default account.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from api import metrics, playlist_mirror, spotify_async_client, spotify_client, timing, token_refresher
+
+# Spotify accepts at most 100 URIs per add/remove call
+MAX_ITEMS_PER_REQUEST = 100
+
+
+class NotAuthenticated(Exception):
+    """No Spotify tokens are stored for the account; someone has to log in first."""
+
+
+def playlist_tracks_url(playlist_id):
+    return f'{spotify_client.API_BASE_URL}/playlists/{playlist_id}/tracks'
+
+
+def chunked(items, size=MAX_ITEMS_PER_REQUEST):
+    """Split a list into consecutive chunks of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+def error_message(response, default):
+    """Pull Spotify's error message out of a failed response."""
+    try:
+        error = response.json().get('error', {})
+    except ValueError:
+        return default
+    if isinstance(error, dict):
+        return error.get('message') or default
+    return error or default
+
+
+def authorized_request(method, url, account=None, **kwargs):
+    """
+    Send an authenticated request to Spotify.
+
+    On a 401 the token is refreshed (single-flight) and the request is
+    retried once. The returned response has a `token_refreshed` attribute.
+    Raises NotAuthenticated if there is no token at all.
+    """
+    access_token = token_refresher.get_valid_access_token(account)
+    if not access_token:
+        raise NotAuthenticated()
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Authorization'] = f'Bearer {access_token}'
+    if 'json' in kwargs:
+        headers.setdefault('Content-Type', 'application/json')
+
+    response = spotify_client.request(method, url, headers=headers, **kwargs)
+    response.token_refreshed = False
+
+    if response.status_code == 401:
+        new_token = token_refresher.refresh_access_token(stale_token=access_token, account=account)
+        if new_token:
+            headers['Authorization'] = f'Bearer {new_token}'
+            with timing.span('retry_401'):
+                response = spotify_client.request(method, url, headers=headers, **kwargs)
+            response.token_refreshed = True
+        metrics.UNAUTHORIZED_RETRIES.labels('retried' if new_token else 'no_token').inc()
+
+    return response
+
+
+async def authorized_request_async(method, url, account=None, **kwargs):
+    """
+    Async version of authorized_request, using the async client.
+
+    Token refreshes still go through the single-flight refresher, run in
+    a worker thread so the event loop never blocks on it.
+    """
+    access_token = token_refresher.get_cached_access_token(account)
+    if not access_token:
+        access_token = await sync_to_async(
+            token_refresher.get_valid_access_token, thread_sensitive=False
+        )(account)
+    if not access_token:
+        raise NotAuthenticated()
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Authorization'] = f'Bearer {access_token}'
+
+    response = await spotify_async_client.request(method, url, headers=headers, **kwargs)
+    response.token_refreshed = False
+
+    if response.status_code == 401:
+        new_token = await sync_to_async(
+            token_refresher.refresh_access_token, thread_sensitive=False
+        )(stale_token=access_token, account=account)
+        if new_token:
+            headers['Authorization'] = f'Bearer {new_token}'
+            with timing.span('retry_401'):
+                response = await spotify_async_client.request(method, url, headers=headers, **kwargs)
+            response.token_refreshed = True
+        metrics.UNAUTHORIZED_RETRIES.labels('retried' if new_token else 'no_token').inc()
+
+    return response
+
+
+def add_tracks(playlist_id, uris, position=None, account=None, base_snapshot_id=None):
+    """
+    Add up to MAX_ITEMS_PER_REQUEST track URIs in one call.
+
+    `base_snapshot_id` is the playlist version the caller last saw, if it
+    knows one; see playlist_mirror.record_added.
+    """
+    payload = {'uris': list(uris)}
+    if position is not None:
+        payload['position'] = position
+    response = authorized_request('POST', playlist_tracks_url(playlist_id), account=account, json=payload)
+    if response.status_code == 201:
+        playlist_mirror.record_added(
+            playlist_id, payload['uris'], response.json().get('snapshot_id'), position, base_snapshot_id
+        )
+    return response
+
+
+def remove_tracks(playlist_id, tracks, snapshot_id=None, account=None, base_snapshot_id=None):
+    """
+    Remove up to MAX_ITEMS_PER_REQUEST tracks in one call.
+
+    `tracks` are Spotify track objects: {'uri': ...} removes every
+    occurrence, {'uri': ..., 'positions': [...]} only those positions.
+    With `snapshot_id` the positions are interpreted against that
+    playlist version, even if the playlist changed since.
+    `base_snapshot_id` (default: `snapshot_id`) is the version the caller
+    last saw; see playlist_mirror.record_removed.
+    """
+    payload = {'tracks': list(tracks)}
+    if snapshot_id:
+        payload['snapshot_id'] = snapshot_id
+    response = authorized_request('DELETE', playlist_tracks_url(playlist_id), account=account, json=payload)
+    if response.status_code == 200:
+        playlist_mirror.record_removed(
+            playlist_id, payload['tracks'], response.json().get('snapshot_id'),
+            base_snapshot_id or snapshot_id
+        )
+    return response
+
+
+def reorder_tracks(playlist_id, range_start, insert_before, range_length=1, snapshot_id=None, account=None):
+    """
+    Move `range_length` items starting at `range_start` so they sit before
+    the item at `insert_before`; both positions are from before the move.
+    """
+    payload = {
+        'range_start': range_start,
+        'insert_before': insert_before,
+        'range_length': range_length,
+    }
+    if snapshot_id:
+        payload['snapshot_id'] = snapshot_id
+    response = authorized_request('PUT', playlist_tracks_url(playlist_id), account=account, json=payload)
+    if response.status_code == 200:
+        playlist_mirror.record_reordered(playlist_id)
+    return response
+
+
+async def add_tracks_async(playlist_id, uris, position=None, account=None, base_snapshot_id=None):
+    """Async version of add_tracks."""
+    payload = {'uris': list(uris)}
+    if position is not None:
+        payload['position'] = position
+    response = await authorized_request_async(
+        'POST', playlist_tracks_url(playlist_id), account=account, json=payload
+    )
+    if response.status_code == 201:
+        await sync_to_async(playlist_mirror.record_added)(
+            playlist_id, payload['uris'], response.json().get('snapshot_id'), position, base_snapshot_id
+        )
+    return response
+
+
+async def remove_tracks_async(playlist_id, tracks, snapshot_id=None, account=None, base_snapshot_id=None):
+    """Async version of remove_tracks."""
+    payload = {'tracks': list(tracks)}
+    if snapshot_id:
+        payload['snapshot_id'] = snapshot_id
+    response = await authorized_request_async(
+        'DELETE', playlist_tracks_url(playlist_id), account=account, json=payload
+    )
+    if response.status_code == 200:
+        await sync_to_async(playlist_mirror.record_removed)(
+            playlist_id, payload['tracks'], response.json().get('snapshot_id'),
+            base_snapshot_id or snapshot_id
+        )
+    return response
+
+
+class SpotifyError(Exception):
+    """Spotify answered a read request with an error status."""
+
+    def __init__(self, response, default='Spotify request failed'):
+        self.status_code = response.status_code
+        super().__init__(error_message(response, default))
+
+
+def playlist_url(playlist_id):
+    return f'{spotify_client.API_BASE_URL}/playlists/{playlist_id}'
+
+
+def get_playlist_snapshot_id(playlist_id, account=None):
+    """Fetch just the current snapshot_id of a playlist."""
+    response = authorized_request(
+        'GET', playlist_url(playlist_id), account=account, params={'fields': 'snapshot_id'}
+    )
+    if response.status_code != 200:
+        raise SpotifyError(response, 'Failed to fetch playlist')
+    return response.json().get('snapshot_id')
+
+
+def _track_page(playlist_id, offset, fields, account=None):
+    response = authorized_request(
+        'GET', playlist_tracks_url(playlist_id), account=account,
+        params={'fields': fields, 'limit': MAX_ITEMS_PER_REQUEST, 'offset': offset}
+    )
+    if response.status_code != 200:
+        raise SpotifyError(response, 'Failed to fetch playlist tracks')
+    return response.json()
+
+
+def _page_uris(page):
+    # Unavailable items have no track but still take up a position
+    return [(item.get('track') or {}).get('uri') or '' for item in page.get('items', [])]
+
+
+def get_playlist_track_uris(playlist_id, account=None):
+    """
+    Fetch the URIs of every item in a playlist, in order.
+
+    The first page tells how many items there are; the remaining pages
+    are then fetched SPOTIFY_PAGE_FETCH_CONCURRENCY at a time over the
+    pooled connections (each still goes through the rate limiter).
+
+    Items without a track (e.g. removed from Spotify) are returned as ''
+    so list indexes match playlist positions.
+    """
+    first = _track_page(playlist_id, 0, 'items(track(uri)),next,total', account)
+    uris = _page_uris(first)
+    total = first.get('total')
+
+    if total is None:
+        # No total to plan with; follow `next` one page at a time
+        url = first.get('next')
+        while url:
+            response = authorized_request('GET', url, account=account)
+            if response.status_code != 200:
+                raise SpotifyError(response, 'Failed to fetch playlist tracks')
+            page = response.json()
+            uris.extend(_page_uris(page))
+            url = page.get('next')
+        return uris
+
+    offsets = range(MAX_ITEMS_PER_REQUEST, total, MAX_ITEMS_PER_REQUEST)
+    if not offsets:
+        return uris
+
+    workers = max(1, min(settings.SPOTIFY_PAGE_FETCH_CONCURRENCY, len(offsets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='playlist-pages') as executor:
+        # Each page runs in a copy of this context, so the request's
+        # deadline and timing follow it into the pool
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _track_page, playlist_id, offset, 'items(track(uri))', account
+            )
+            for offset in offsets
+        ]
+        for future in futures:
+            uris.extend(_page_uris(future.result()))
+    return uris
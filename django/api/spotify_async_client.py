@@ -0,0 +1,133 @@
+"""
+Async counterpart of api.spotify_client for the async views.
+
+One pooled httpx.AsyncClient per event loop keeps connections to Spotify
+alive, so a single ASGI worker can have hundreds of upstream calls in
+flight. Pool limits and timeouts come from the same SPOTIFY_HTTP_*
+settings as the sync client, and requests share its rate limiter,
+retry rules, circuit breakers and request budget.
+"""
+import asyncio
+import logging
+import weakref
+
+import httpx
+from django.conf import settings
+
+from api import circuit_breaker, deadline, metrics, rate_limiter, timing
+from api.spotify_client import (
+    ACCOUNTS_BASE_URL,
+    API_BASE_URL,
+    is_failure,
+    is_rate_limited,
+    retry_delay,
+    timing_stage,
+)
+
+logger = logging.getLogger(__name__)
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def _build_client():
+    if settings.SPOTIFY_HTTP_KEEPALIVE:
+        limits = httpx.Limits(
+            max_connections=settings.SPOTIFY_HTTP_POOL_CONNECTIONS * settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+            keepalive_expiry=settings.SPOTIFY_HTTP_KEEPALIVE_EXPIRY
+        )
+    else:
+        limits = httpx.Limits(max_keepalive_connections=0)
+
+    timeout = httpx.Timeout(
+        settings.SPOTIFY_HTTP_READ_TIMEOUT,
+        connect=settings.SPOTIFY_HTTP_CONNECT_TIMEOUT
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def get_client():
+    """Get the pooled client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _build_client()
+        _clients[loop] = client
+    return client
+
+
+def _capped_timeout():
+    """The client's timeouts shortened to the remaining request budget."""
+    return httpx.Timeout(
+        deadline.cap(settings.SPOTIFY_HTTP_READ_TIMEOUT),
+        connect=deadline.cap(settings.SPOTIFY_HTTP_CONNECT_TIMEOUT)
+    )
+
+
+async def request(method, url, **kwargs):
+    """Send a request to Spotify over the pooled async client."""
+    limited = is_rate_limited(url)
+    stage = timing_stage(url)
+    attempt = 0
+
+    while True:
+        deadline.check()
+        if limited:
+            await rate_limiter.acquire_async(deadline.remaining())
+        if deadline.remaining() is not None:
+            kwargs['timeout'] = _capped_timeout()
+
+        with circuit_breaker.guard(url) as guard, metrics.upstream_call(method, url) as call, timing.span(stage):
+            try:
+                response = await get_client().request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                # A timeout we shortened ourselves says nothing about Spotify
+                if deadline.expired():
+                    raise deadline.DeadlineExceeded() from e
+                guard['failed'] = True
+                raise
+            call['status'] = response.status_code
+            guard['failed'] = is_failure(response.status_code)
+
+        delay = retry_delay(method, response, attempt)
+        if delay is None:
+            return response
+
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            # No time for another attempt; let the caller see this answer
+            return response
+
+        rate_limiter.record_retry()
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def get(url, **kwargs):
+    return await request('GET', url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request('POST', url, **kwargs)
+
+
+async def delete(url, **kwargs):
+    return await request('DELETE', url, **kwargs)
+
+
+async def warm_up():
+    """Open a pooled connection to each Spotify host."""
+    if not settings.SPOTIFY_HTTP_WARM_UP:
+        return
+    for url in (API_BASE_URL, ACCOUNTS_BASE_URL):
+        try:
+            await request('HEAD', url)
+        except (httpx.HTTPError, rate_limiter.UpstreamUnavailable):
+            logger.warning('Could not warm connection to %s', url, exc_info=True)
+
+
+async def close():
+    """Close the client of the running event loop."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,242 @@
+"""
+Shared HTTP client for all calls to Spotify.
+
+Every view and the token refresher go through one pooled requests.Session
+per process, so TCP+TLS connections to api.spotify.com and
+accounts.spotify.com are reused instead of being set up on every call.
+All requests get connect/read timeouts so a slow upstream can't hang a
+worker indefinitely.
+
+Calls to the Web API (not the accounts service) are paced by
+api.rate_limiter. 429s are retried once their Retry-After has passed, and
+5xx errors of idempotent requests are retried with jittered backoff.
+Every call also goes through its host's circuit breaker
+(api.circuit_breaker) and stays within the request's time budget
+(api.deadline).
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from api import circuit_breaker, deadline, metrics, rate_limiter, timing
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = settings.SPOTIFY_API_BASE_URL
+ACCOUNTS_BASE_URL = settings.SPOTIFY_ACCOUNTS_BASE_URL
+
+RETRYABLE_STATUS = {500, 502, 503, 504}
+# A POST that failed with a 5xx may still have been applied; only retry
+# requests that are safe to repeat. Not PUT: the only one we send is a
+# playlist reorder, which moves the tracks again when repeated.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'DELETE'}
+
+UpstreamUnavailable = rate_limiter.UpstreamUnavailable
+
+_session_lock = threading.Lock()
+_session = {
+    'pid': None,
+    'session': None,
+}
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on pooled sockets."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 20))
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3))
+        kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _build_session():
+    session = requests.Session()
+
+    if settings.SPOTIFY_HTTP_KEEPALIVE:
+        adapter = KeepAliveAdapter(
+            pool_connections=settings.SPOTIFY_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+            pool_block=settings.SPOTIFY_HTTP_POOL_BLOCK,
+            max_retries=0
+        )
+    else:
+        adapter = HTTPAdapter(max_retries=0)
+        session.headers['Connection'] = 'close'
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Get the pooled session for this process.
+
+    A new session is built after a fork so worker processes never share
+    sockets with their parent.
+    """
+    pid = os.getpid()
+    if _session['pid'] == pid:
+        return _session['session']
+
+    with _session_lock:
+        if _session['pid'] != pid:
+            _session['session'] = _build_session()
+            _session['pid'] = pid
+        return _session['session']
+
+
+def default_timeout():
+    """(connect, read) timeout applied to every Spotify call."""
+    return (
+        settings.SPOTIFY_HTTP_CONNECT_TIMEOUT,
+        settings.SPOTIFY_HTTP_READ_TIMEOUT,
+    )
+
+
+def capped_timeout(timeout):
+    """A requests timeout shortened to the remaining request budget."""
+    if isinstance(timeout, tuple):
+        return tuple(deadline.cap(part) for part in timeout)
+    return deadline.cap(timeout)
+
+
+def is_failure(status):
+    """Whether a response counts against the host's circuit breaker."""
+    return status >= 500
+
+
+def timing_stage(url):
+    """The api.timing span name for calls to `url`'s host."""
+    return 'accounts' if url.startswith(ACCOUNTS_BASE_URL) else 'spotify'
+
+
+def is_rate_limited(url):
+    """Only Web API calls count against Spotify's rate limit."""
+    return url.startswith(API_BASE_URL)
+
+
+def retry_after(response):
+    """Seconds from a Retry-After header, or None."""
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(method, response, attempt):
+    """
+    Decide whether to retry a response.
+
+    Returns the seconds to sleep before the next attempt, or None to hand
+    the response back to the caller. A 429 always pauses the rate limiter,
+    even when it isn't retried.
+    """
+    status = response.status_code
+    backoff = settings.SPOTIFY_RETRY_BACKOFF
+
+    if status == 429:
+        wait = retry_after(response)
+        if wait is None:
+            wait = backoff
+        rate_limiter.pause(wait)
+        if attempt >= settings.SPOTIFY_MAX_RETRIES or wait > settings.SPOTIFY_RATE_LIMIT_MAX_WAIT:
+            return None
+        # The limiter holds everyone until the pause is over; the jitter
+        # only spreads out the retries themselves.
+        return random.uniform(0, backoff)
+
+    if status in RETRYABLE_STATUS and method.upper() in IDEMPOTENT_METHODS:
+        if attempt >= settings.SPOTIFY_MAX_RETRIES:
+            return None
+        return backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    return None
+
+
+def request(method, url, **kwargs):
+    """
+    Send a request to Spotify over the pooled session.
+
+    Raises rate_limiter.UpstreamUnavailable if the rate limiter can't
+    schedule the request within SPOTIFY_RATE_LIMIT_MAX_WAIT, and its
+    subclasses CircuitOpen and DeadlineExceeded when the host's breaker
+    is open or the request's budget has run out.
+    """
+    timeout = kwargs.pop('timeout', None) or default_timeout()
+    limited = is_rate_limited(url)
+    stage = timing_stage(url)
+    attempt = 0
+
+    while True:
+        deadline.check()
+        if limited:
+            rate_limiter.acquire(deadline.remaining())
+
+        with circuit_breaker.guard(url) as guard, metrics.upstream_call(method, url) as call, timing.span(stage):
+            try:
+                response = get_session().request(method, url, timeout=capped_timeout(timeout), **kwargs)
+            except requests.exceptions.RequestException as e:
+                # A timeout we shortened ourselves says nothing about Spotify
+                if deadline.expired():
+                    raise deadline.DeadlineExceeded() from e
+                guard['failed'] = True
+                raise
+            call['status'] = response.status_code
+            guard['failed'] = is_failure(response.status_code)
+
+        delay = retry_delay(method, response, attempt)
+        if delay is None:
+            return response
+
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            # No time for another attempt; let the caller see this answer
+            return response
+
+        rate_limiter.record_retry()
+        attempt += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def warm_up():
+    """
+    Open a pooled connection to each Spotify host.
+
+    The response status doesn't matter, only that the TCP+TLS handshake
+    has happened before the first real request needs it.
+    """
+    for url in (API_BASE_URL, ACCOUNTS_BASE_URL):
+        try:
+            request('HEAD', url, allow_redirects=False)
+        except (requests.exceptions.RequestException, UpstreamUnavailable):
+            logger.warning('Could not warm connection to %s', url, exc_info=True)
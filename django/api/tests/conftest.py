@@ -0,0 +1,31 @@
+"""
+Test setup: Django configured for tests, with a throwaway database.
+
+Runs without pytest-django: the test database is created once per
+session, and tests that touch it use django.test.TestCase, which rolls
+back after every test.
+"""
+import os
+
+# No background threads or network from the app while testing
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_controller.settings')
+os.environ.setdefault('SPOTIFY_BACKGROUND_REFRESH', 'False')
+os.environ.setdefault('SPOTIFY_HTTP_WARM_UP', 'False')
+os.environ.setdefault('JOB_WORKERS', '0')
+
+import django  # noqa: E402
+
+django.setup()
+
+import pytest  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def django_test_database():
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    yield
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
@@ -0,0 +1,155 @@
+import json
+from unittest import mock
+
+from django.test import Client, TestCase, override_settings
+
+from api import spotify_api, spotify_client
+
+ENDPOINTS = [
+    '/api/playlist/add/batch',
+    '/api/playlist/remove/batch',
+    '/api/playlist/contains',
+    '/api/tracks/resolve',
+]
+
+
+def track_ids(count):
+    return [f'{i:022d}' for i in range(count)]
+
+
+def spotify_response(status_code, body=None):
+    return mock.Mock(status_code=status_code, **{'json.return_value': body or {}})
+
+
+class BatchViewTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        # Nothing here may reach Spotify unless a test patches the call in
+        patcher = mock.patch.object(spotify_client, 'request', side_effect=AssertionError('Spotify called'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, path, body, raw=False):
+        data = body if raw else json.dumps(body)
+        response = self.client.post(path, data, content_type='application/json')
+        return response, json.loads(response.content)
+
+
+class MalformedBodyTests(BatchViewTestCase):
+    def test_invalid_json_is_rejected(self):
+        for path in ENDPOINTS:
+            response, body = self.post(path, '{"playlist_id": ', raw=True)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(body['error'], 'Invalid JSON in request body')
+
+    def test_bodies_that_are_not_objects_are_rejected(self):
+        for path in ENDPOINTS:
+            for payload in ([1, 2], 'text', 3, None):
+                response, body = self.post(path, payload)
+                self.assertEqual(response.status_code, 400, (path, payload))
+                self.assertEqual(body, {'success': False, 'error': 'Request body must be a JSON object'})
+
+    def test_invalid_account_is_rejected(self):
+        for path in ENDPOINTS:
+            response, _body = self.post(path, {'account': 42, 'playlist_id': 'p', 'song_ids': ['x']})
+            self.assertEqual(response.status_code, 400, path)
+
+
+class AddBatchTests(BatchViewTestCase):
+    path = '/api/playlist/add/batch'
+
+    def test_required_fields_and_types_are_checked(self):
+        for payload in (
+            {'song_ids': track_ids(1)},
+            {'playlist_id': 'p'},
+            {'playlist_id': 'p', 'song_ids': 'not a list'},
+            {'playlist_id': 'p', 'song_ids': [1]},
+            {'playlist_id': 'p', 'song_ids': track_ids(1), 'position': -1},
+            {'playlist_id': 'p', 'song_ids': track_ids(1), 'position': True},
+        ):
+            response, body = self.post(self.path, payload)
+            self.assertEqual(response.status_code, 400, payload)
+            self.assertFalse(body['success'])
+
+    @override_settings(SPOTIFY_BATCH_MAX_ITEMS=2)
+    def test_too_many_songs_are_rejected(self):
+        response, _body = self.post(self.path, {'playlist_id': 'p', 'song_ids': track_ids(3)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_invalid_song_rejects_the_batch_before_calling_spotify(self):
+        with mock.patch.object(spotify_api, 'add_tracks') as add_tracks:
+            response, _body = self.post(self.path, {'playlist_id': 'p', 'song_ids': track_ids(2) + ['garbage']})
+        self.assertEqual(response.status_code, 400)
+        add_tracks.assert_not_called()
+
+    def test_failed_chunk_keeps_the_results_of_earlier_ones(self):
+        responses = [spotify_response(201, {'snapshot_id': 's1'}), spotify_response(502)]
+        with mock.patch.object(spotify_api, 'add_tracks', side_effect=responses):
+            response, body = self.post(self.path, {'playlist_id': 'p', 'song_ids': track_ids(150)})
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(body['added'], 100)
+        self.assertEqual(body['snapshot_id'], 's1')
+        self.assertEqual([chunk['success'] for chunk in body['chunks']], [True, False])
+        self.assertEqual(body['results'][-1]['status'], 'failed')
+
+    def test_not_logged_in_is_a_401(self):
+        with mock.patch.object(spotify_api, 'add_tracks', side_effect=spotify_api.NotAuthenticated()):
+            response, _body = self.post(self.path, {'playlist_id': 'p', 'song_ids': track_ids(1)})
+        self.assertEqual(response.status_code, 401)
+
+
+class RemoveBatchTests(BatchViewTestCase):
+    path = '/api/playlist/remove/batch'
+
+    def test_tracks_must_be_ids_or_objects_with_positions(self):
+        for tracks in ('x', [1], [{'positions': [0]}], [{'song_id': track_ids(1)[0], 'positions': 'x'}]):
+            response, _body = self.post(self.path, {'playlist_id': 'p', 'tracks': tracks})
+            self.assertEqual(response.status_code, 400, tracks)
+
+    def test_losing_auth_in_a_later_chunk_keeps_earlier_results(self):
+        side_effect = [spotify_response(200, {'snapshot_id': 's1'}), spotify_api.NotAuthenticated()]
+        with mock.patch.object(spotify_api, 'remove_tracks', side_effect=side_effect):
+            response, body = self.post(self.path, {'playlist_id': 'p', 'tracks': track_ids(150)})
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((body['removed'], body['failed']), (100, 50))
+        self.assertEqual(body['chunks'][1]['status_code'], 401)
+
+    def test_upstream_unavailable_is_reported_per_chunk(self):
+        side_effect = spotify_client.UpstreamUnavailable('Spotify rate limit reached', 2)
+        with mock.patch.object(spotify_api, 'remove_tracks', side_effect=side_effect):
+            response, body = self.post(self.path, {'playlist_id': 'p', 'tracks': track_ids(3)})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(body['failed'], 3)
+
+
+class ContainsTests(BatchViewTestCase):
+    path = '/api/playlist/contains'
+
+    def test_required_fields_are_checked(self):
+        for payload in ({'song_ids': track_ids(1)}, {'playlist_id': 'p', 'song_ids': [None]}):
+            response, _body = self.post(self.path, payload)
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_not_logged_in_is_a_401(self):
+        with mock.patch('api.playlist_mirror.track_counts', side_effect=spotify_api.NotAuthenticated()):
+            response, _body = self.post(self.path, {'playlist_id': 'p', 'song_ids': track_ids(1)})
+        self.assertEqual(response.status_code, 401)
+
+
+class ResolveTests(BatchViewTestCase):
+    path = '/api/tracks/resolve'
+
+
+    def test_tracks_must_be_a_list(self):
+        for payload in ({}, {'tracks': 'x'}, {'tracks': []}):
+            response, _body = self.post(self.path, payload)
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_track_references_resolve_without_spotify(self):
+        track_id = track_ids(1)[0]
+        response, body = self.post(self.path, {'tracks': [track_id, f'spotify:track:{track_id}']})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(body['success'])
@@ -0,0 +1,101 @@
+import pytest
+from django.test import override_settings
+
+from api import circuit_breaker
+from api.rate_limiter import UpstreamUnavailable
+
+URL = 'https://api.spotify.com/v1/me'
+HOST = 'api.spotify.com'
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    circuit_breaker._breakers.clear()
+    with override_settings(
+        SPOTIFY_BREAKER_FAILURE_THRESHOLD=3,
+        SPOTIFY_BREAKER_RESET_TIMEOUT=30,
+        SPOTIFY_BREAKER_HALF_OPEN_PROBES=1
+    ):
+        yield
+    circuit_breaker._breakers.clear()
+
+
+def call(failed, url=URL):
+    with circuit_breaker.guard(url) as guard:
+        guard['failed'] = failed
+
+
+def state(host=HOST):
+    return circuit_breaker._breakers[host]['state']
+
+
+def reset_timeout_passes(host=HOST):
+    circuit_breaker._breakers[host]['opened_at'] -= 30
+
+
+def test_opens_after_consecutive_failures():
+    for _ in range(3):
+        call(True)
+    assert state() == circuit_breaker.OPEN
+
+    with pytest.raises(circuit_breaker.CircuitOpen) as raised:
+        call(False)
+    assert isinstance(raised.value, UpstreamUnavailable)
+    assert 0 < raised.value.retry_after <= 30
+
+
+def test_a_success_resets_the_failure_count():
+    call(True)
+    call(True)
+    call(False)
+    call(True)
+    call(True)
+    assert state() == circuit_breaker.CLOSED
+
+
+def test_calls_without_an_outcome_are_not_counted():
+    for _ in range(5):
+        call(None)
+    call(True)
+    call(True)
+    assert state() == circuit_breaker.CLOSED
+
+
+def test_hosts_have_separate_breakers():
+    for _ in range(3):
+        call(True)
+    call(False, url='https://accounts.spotify.com/api/token')
+    assert state('accounts.spotify.com') == circuit_breaker.CLOSED
+
+
+def test_half_open_probe_success_closes():
+    for _ in range(3):
+        call(True)
+    reset_timeout_passes()
+
+    with circuit_breaker.guard(URL) as probe:
+        assert state() == circuit_breaker.HALF_OPEN
+        # Only one probe at a time
+        with pytest.raises(circuit_breaker.CircuitOpen):
+            call(False)
+        probe['failed'] = False
+    assert state() == circuit_breaker.CLOSED
+    call(False)
+
+
+def test_half_open_probe_failure_opens_again():
+    for _ in range(3):
+        call(True)
+    reset_timeout_passes()
+
+    call(True)
+    assert state() == circuit_breaker.OPEN
+    with pytest.raises(circuit_breaker.CircuitOpen):
+        call(False)
+
+
+def test_threshold_zero_disables_the_breaker():
+    with override_settings(SPOTIFY_BREAKER_FAILURE_THRESHOLD=0):
+        for _ in range(10):
+            call(True)
+    assert HOST not in circuit_breaker._breakers
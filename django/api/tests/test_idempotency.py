@@ -0,0 +1,104 @@
+import json
+from datetime import timedelta
+
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from api import idempotency
+from api.models import IdempotencyRecord
+
+
+@override_settings(IDEMPOTENCY_PRUNE_PROBABILITY=0, IDEMPOTENCY_WAIT_SECONDS=0)
+class ClaimTests(TestCase):
+    def test_first_claim_executes_and_a_repeat_replays(self):
+        outcome, record = idempotency.claim('/add:k1', 'f1')
+        self.assertEqual(outcome, idempotency.EXECUTE)
+        idempotency.complete(record, JsonResponse({'success': True}, status=201))
+
+        outcome, record = idempotency.claim('/add:k1', 'f1')
+        self.assertEqual(outcome, idempotency.REPLAY)
+        response = idempotency.replay_response(record)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(response.content), {'success': True})
+
+    def test_key_reused_for_another_request_is_a_mismatch(self):
+        idempotency.claim('/add:k1', 'f1')
+        outcome, _record = idempotency.claim('/add:k1', 'f2')
+        self.assertEqual(outcome, idempotency.MISMATCH)
+
+    def test_repeat_while_the_first_is_running_is_busy(self):
+        idempotency.claim('/add:k1', 'f1')
+        self.assertEqual(idempotency.claim('/add:k1', 'f1'), (idempotency.BUSY, None))
+
+    def test_retryable_responses_are_not_stored(self):
+        for status in (401, 429, 500, 503):
+            outcome, record = idempotency.claim(f'/add:{status}', 'f1')
+            idempotency.complete(record, JsonResponse({'success': False}, status=status))
+            outcome, _record = idempotency.claim(f'/add:{status}', 'f1')
+            self.assertEqual(outcome, idempotency.EXECUTE, status)
+
+    def test_expired_record_is_replaced(self):
+        _outcome, record = idempotency.claim('/add:k1', 'f1')
+        idempotency.complete(record, JsonResponse({'success': True}))
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        outcome, _record = idempotency.claim('/add:k1', 'f2')
+        self.assertEqual(outcome, idempotency.EXECUTE)
+
+    @override_settings(IDEMPOTENCY_LOCK_SECONDS=60)
+    def test_abandoned_claim_is_taken_over(self):
+        idempotency.claim('/add:k1', 'f1')
+        IdempotencyRecord.objects.update(last_used_at=timezone.now() - timedelta(seconds=61))
+
+        outcome, _record = idempotency.claim('/add:k1', 'f1')
+        self.assertEqual(outcome, idempotency.EXECUTE)
+
+
+@override_settings(IDEMPOTENCY_PRUNE_PROBABILITY=0, IDEMPOTENCY_WAIT_SECONDS=0)
+class DecoratorTests(TestCase):
+    def setUp(self):
+        self.calls = 0
+
+        @idempotency.idempotent
+        def view(request):
+            self.calls += 1
+            return JsonResponse({'call': self.calls}, status=201)
+
+        self.view = view
+        self.factory = RequestFactory()
+
+    def post(self, body, **headers):
+        return self.view(self.factory.post('/api/playlist/add', json.dumps(body),
+                                           content_type='application/json', headers=headers))
+
+    def test_repeat_with_the_same_key_is_replayed(self):
+        first = self.post({'song_id': 'a'}, **{'Idempotency-Key': 'k1'})
+        second = self.post({'song_id': 'a'}, **{'Idempotency-Key': 'k1'})
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    def test_key_in_the_body_works_too(self):
+        self.post({'song_id': 'a', 'idempotency_key': 'k2'})
+        self.post({'song_id': 'a', 'idempotency_key': 'k2'})
+        self.assertEqual(self.calls, 1)
+
+    def test_same_key_with_another_body_is_rejected(self):
+        self.post({'song_id': 'a'}, **{'Idempotency-Key': 'k1'})
+        response = self.post({'song_id': 'b'}, **{'Idempotency-Key': 'k1'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_requests_without_a_key_always_run(self):
+        self.post({'song_id': 'a'})
+        self.post({'song_id': 'a'})
+        self.assertEqual(self.calls, 2)
+
+    def test_overlong_key_is_rejected(self):
+        response = self.post({'song_id': 'a'}, **{'Idempotency-Key': 'k' * 256})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.calls, 0)
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from api import playlist_sync, spotify_api
+
+
+def apply_edits(current, edits):
+    """Play a plan back the way Spotify applies the calls."""
+    items = list(current)
+    for position, uri in edits['removes']:
+        assert items[position] == uri
+        del items[position]
+    for range_start, range_length, insert_before in edits['moves']:
+        block = items[range_start:range_start + range_length]
+        del items[range_start:range_start + range_length]
+        if insert_before > range_start:
+            insert_before -= range_length
+        items[insert_before:insert_before] = block
+    for position, uris in edits['adds']:
+        assert len(uris) <= spotify_api.MAX_ITEMS_PER_REQUEST
+        if position is None:
+            items.extend(uris)
+        else:
+            items[position:position] = uris
+    return items
+
+
+def test_unchanged_playlist_needs_no_edits():
+    current = ['a', 'b', 'c']
+    edits = playlist_sync.plan(current, current, reorder=True)
+    assert edits['removes'] == edits['moves'] == edits['adds'] == []
+    assert edits['final'] == current
+    assert edits['unchanged'] == 3
+
+
+def test_surplus_duplicates_are_removed_from_the_end():
+    edits = playlist_sync.plan(['a', 'b', 'a', 'a'], ['a', 'b'])
+    assert edits['removes'] == [(3, 'a'), (2, 'a')]
+    assert edits['adds'] == []
+
+
+def test_missing_tracks_are_appended_in_target_order():
+    edits = playlist_sync.plan(['b'], ['c', 'b', 'a'])
+    assert edits['adds'] == [(None, ['c', 'a'])]
+    assert edits['final'] == ['b', 'c', 'a']
+
+
+def test_reorder_moves_only_tracks_out_of_place():
+    edits = playlist_sync.plan(['b', 'c', 'd', 'a'], ['a', 'b', 'c', 'd'], reorder=True)
+    assert len(edits['moves']) == 1
+    assert edits['unchanged'] == 3
+    assert apply_edits(['b', 'c', 'd', 'a'], edits) == ['a', 'b', 'c', 'd']
+
+
+def test_neighbours_are_moved_together():
+    current = ['c', 'd', 'a', 'b', 'e']
+    edits = playlist_sync.plan(current, ['a', 'b', 'c', 'd', 'e'], reorder=True)
+    assert [length for _start, length, _before in edits['moves']] == [2]
+    assert apply_edits(current, edits) == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_unavailable_items_stay_and_go_last_on_reorder():
+    current = ['b', '', 'a']
+    assert playlist_sync.plan(current, ['a', 'b'])['removes'] == []
+
+    edits = playlist_sync.plan(current, ['a', 'b'], reorder=True)
+    assert edits['final'] == ['a', 'b', '']
+    assert apply_edits(current, edits) == ['a', 'b', '']
+
+
+def test_adds_are_split_into_spotify_sized_calls():
+    target = [f'spotify:track:{i}' for i in range(250)]
+    edits = playlist_sync.plan([], target)
+    assert [len(uris) for _position, uris in edits['adds']] == [100, 100, 50]
+    assert apply_edits([], edits) == target
+
+
+@pytest.mark.parametrize('reorder', [False, True])
+def test_random_playlists_end_up_as_planned(reorder):
+    rng = random.Random(1234)
+    for _ in range(300):
+        # '' is an item Spotify no longer has a track for
+        current = [rng.choice('abcdefg') if rng.random() > 0.1 else '' for _ in range(rng.randint(0, 15))]
+        target = [rng.choice('abcdefgh') for _ in range(rng.randint(0, 15))]
+
+        edits = playlist_sync.plan(current, target, reorder=reorder)
+        result = apply_edits(current, edits)
+
+        assert result == edits['final']
+        if reorder:
+            assert [uri for uri in result if uri] == target
+        else:
+            assert sorted(uri for uri in result if uri) == sorted(target)
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from django.test import override_settings
+
+from api import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limiter():
+    rate_limiter._state.update(tat=0.0, paused_until=0.0)
+    with override_settings(
+        SPOTIFY_RATE_LIMIT_PER_SECOND=10,
+        SPOTIFY_RATE_LIMIT_BURST=3,
+        SPOTIFY_RATE_LIMIT_MAX_WAIT=1
+    ):
+        yield
+    rate_limiter._state.update(tat=0.0, paused_until=0.0)
+
+
+def test_burst_goes_through_then_calls_are_spaced():
+    waits = [rate_limiter._reserve() for _ in range(5)]
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3] == pytest.approx(0.1, abs=0.02)
+    assert waits[4] == pytest.approx(0.2, abs=0.02)
+
+
+def test_calls_that_would_wait_too_long_are_rejected_without_a_slot():
+    # 3 at once, then one every 0.1s: the 11th call waits 0.8s
+    for _ in range(10):
+        rate_limiter._reserve()
+    with pytest.raises(rate_limiter.UpstreamUnavailable) as raised:
+        rate_limiter._reserve(max_wait=0.5)
+    assert raised.value.retry_after == pytest.approx(0.8, abs=0.02)
+
+    # The rejected call didn't take the slot; the next caller gets it
+    assert rate_limiter._reserve() == pytest.approx(0.8, abs=0.02)
+
+
+def test_max_wait_argument_only_tightens_the_limit():
+    # SPOTIFY_RATE_LIMIT_MAX_WAIT (1s) still applies to a longer max_wait
+    with pytest.raises(rate_limiter.UpstreamUnavailable):
+        for _ in range(20):
+            rate_limiter._reserve(max_wait=60)
+
+
+def test_pause_holds_every_caller():
+    rate_limiter.pause(0.5)
+    assert rate_limiter._reserve() == pytest.approx(0.5, abs=0.02)
+
+    rate_limiter.pause(5)
+    with pytest.raises(rate_limiter.UpstreamUnavailable):
+        rate_limiter._reserve()
+
+
+def test_acquire_sleeps_for_its_slot():
+    for _ in range(3):
+        rate_limiter.acquire()
+    start = time.monotonic()
+    rate_limiter.acquire()
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.05)
@@ -0,0 +1,89 @@
+from unittest import mock
+
+import pytest
+from django.test import TestCase
+
+from api import track_resolver
+from api.models import ResolvedTrack
+
+TRACK_ID = '4uLU6hMCjMI75M1A2tKUQC'
+
+
+@pytest.mark.parametrize('value', [
+    TRACK_ID,
+    f'spotify:track:{TRACK_ID}',
+    f'https://open.spotify.com/track/{TRACK_ID}',
+    f'https://open.spotify.com/intl-de/track/{TRACK_ID}?si=abc123',
+    f'open.spotify.com/track/{TRACK_ID}',
+    f'  {TRACK_ID}  ',
+])
+def test_track_references_are_parsed_locally(value):
+    assert track_resolver.parse(value) == (track_resolver.TRACK, TRACK_ID)
+
+
+@pytest.mark.parametrize('value', [
+    'USUM71703861',
+    'isrc:USUM71703861',
+    'ISRC:usum71703861',
+    'US-UM7-17-03861',
+])
+def test_isrcs_are_normalised(value):
+    assert track_resolver.parse(value) == (track_resolver.ISRC, 'USUM71703861')
+
+
+@pytest.mark.parametrize('value', [
+    None,
+    42,
+    '',
+    'not a track',
+    TRACK_ID[:-1],
+    f'spotify:album:{TRACK_ID}',
+    f'https://open.spotify.com/album/{TRACK_ID}',
+    f'https://example.com/track/{TRACK_ID}',
+    'USUM7170386',
+])
+def test_anything_else_is_invalid(value):
+    with pytest.raises(track_resolver.InvalidTrack):
+        track_resolver.parse(value)
+
+
+def test_resolve_many_validates_everything_before_any_lookup():
+    with mock.patch.object(track_resolver, 'resolve_isrcs') as resolve_isrcs:
+        with pytest.raises(track_resolver.InvalidTrack):
+            track_resolver.resolve_many(['USUM71703861', 'garbage'])
+    resolve_isrcs.assert_not_called()
+
+
+class ResolveIsrcsTests(TestCase):
+    def search(self, isrc, account=None):
+        self.searched.append(isrc)
+        return '' if isrc.endswith('0') else f'{isrc}abcdefghij'
+
+    def setUp(self):
+        self.searched = []
+        patcher = mock.patch.object(track_resolver, '_search', side_effect=self.search)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_and_misses_are_cached(self):
+        isrcs = ['USUM71703861', 'USUM71703860']
+        expected = {'USUM71703861': 'USUM71703861abcdefghij', 'USUM71703860': None}
+
+        self.assertEqual(track_resolver.resolve_isrcs(isrcs), expected)
+        self.assertEqual(track_resolver.resolve_isrcs(isrcs), expected)
+        self.assertEqual(sorted(self.searched), sorted(isrcs))
+        self.assertEqual(ResolvedTrack.objects.count(), 2)
+
+    def test_many_uncached_isrcs_are_searched_and_stored(self):
+        isrcs = [f'USUM7{i:07d}' for i in range(30)]
+        with mock.patch.object(track_resolver, 'QUERY_CHUNK_SIZE', 7):
+            found = track_resolver.resolve_isrcs(isrcs + isrcs[:5])
+            self.assertEqual(list(found), isrcs)
+            self.assertEqual(len(self.searched), 30)
+            self.assertEqual(track_resolver.resolve_isrcs(isrcs), found)
+        self.assertEqual(len(self.searched), 30)
+
+    def test_resolve_raises_for_unknown_isrcs(self):
+        with self.assertRaises(track_resolver.TrackNotFound):
+            track_resolver.resolve('isrc:USUM71703860')
+        self.assertEqual(track_resolver.resolve('USUM71703861'), 'spotify:track:USUM71703861abcdefghij')
@@ -0,0 +1,126 @@
+"""
+Per-request timing of the stages a request goes through.
+
+TimingMiddleware starts a recorder for each request and the code on the
+way records named spans into it:
+- token: reading the stored token (file, cache or shared memory);
+- refresh: refresh_access_token, lock waits included;
+- spotify / accounts: each call to the Web API or the accounts service,
+  retries included; a call that failed with 401 and was retried with a
+  fresh token also shows up as retry_401;
+- ratelimit: waiting for a rate limiter slot;
+- coalesce: waiting for a coalesced batch to be sent;
+- collapse: waiting for an identical request already in flight;
+- profile / store: the auth views' profile cache and token writes;
+- middleware: the middleware around the view, both ways;
+- view and total.
+
+Spans with the same name are added up. They can overlap (refresh
+includes an accounts call), so they don't sum to the total.
+
+The result goes out in a Server-Timing header. Requests slower than
+SLOW_REQUEST_THRESHOLD_MS are written to the api.slow_requests log as
+one JSON object, for a SLOW_REQUEST_LOG_SAMPLE_RATE share of them.
+
+Outside a request (background threads) nothing is recorded, and a span
+costs one context variable lookup.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+
+slow_logger = logging.getLogger('api.slow_requests')
+
+_recorder = contextvars.ContextVar('timing_recorder', default=None)
+
+
+class Recorder:
+    """Span durations of one request, by name."""
+    __slots__ = ('spans', 'counts')
+
+    def __init__(self):
+        self.spans = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NO_SPAN = nullcontext()
+
+
+def span(name):
+    """Time a block into the current request's recorder, if there is one."""
+    recorder = _recorder.get()
+    if recorder is None:
+        return _NO_SPAN
+    return _Span(recorder, name)
+
+
+def record(name, seconds):
+    """Add a duration measured elsewhere to the current request."""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.add(name, seconds)
+
+
+def start():
+    """Start recording for the current context; returns (recorder, token)."""
+    recorder = Recorder()
+    return recorder, _recorder.set(recorder)
+
+
+def stop(token):
+    _recorder.reset(token)
+
+
+def server_timing(recorder):
+    """The Server-Timing header value for a recorder, durations in ms."""
+    parts = []
+    for name, seconds in recorder.spans.items():
+        part = f'{name};dur={seconds * 1000:.2f}'
+        count = recorder.counts[name]
+        if count > 1:
+            part += f';desc="{count}x"'
+        parts.append(part)
+    return ', '.join(parts)
+
+
+def log_if_slow(request, status, recorder):
+    """Write a sampled slow-request log line if the request was slow."""
+    total = recorder.spans.get('total', 0.0) * 1000
+    if total < settings.SLOW_REQUEST_THRESHOLD_MS:
+        return
+    if random.random() >= settings.SLOW_REQUEST_LOG_SAMPLE_RATE:
+        return
+    slow_logger.warning(json.dumps({
+        'event': 'slow_request',
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'total_ms': round(total, 2),
+        'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in recorder.spans.items()},
+        'counts': recorder.counts,
+    }))
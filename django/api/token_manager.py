@@ -1,59 +1,514 @@
 """
-Global token manager for Spotify API access.
-Stores tokens in a simple file that all requests can access.
+Token manager for Spotify API access.
+Stores each account's tokens in a simple file that all requests can access.
+
+Accounts are identified by their Spotify user id. The default account
+(used when a request names no account) lives in tokens.json, every other
+account in accounts/<user id>.json next to it. The default account is
+SPOTIFY_DEFAULT_ACCOUNT if set, otherwise whoever logged in first.
+
+Writes are safe with many worker processes: they hold an flock on the
+account's .write.lock file, write a temporary file and atomically rename
+it over the token file, so a reader only ever sees a complete file. Every
+write bumps a version counter stored with the tokens.
+
+Reads are served from an in-process cache with one entry per account
+(a dict lookup, however many accounts there are), bounded to the
+SPOTIFY_TOKEN_CACHE_MAX_ACCOUNTS most recently used; the default
+account's entry is kept outside that LRU and read without a lock. By
+default an entry is checked against its file's stat signature (inode,
+size, mtime), one stat() per read. With SPOTIFY_TOKEN_SHARED_MEMORY on, the tokens are also
+published to an mmapped buffer (api.token_shm) and readers only compare
+its version with the cached one, which needs no system calls at all.
+
+Tokens carry an absolute ``expires_at`` (unix time) next to Spotify's
+relative ``expires_in`` so callers can renew ahead of expiry.
+
+The file also caches the user's Spotify profile for /auth/status. Saving
+new tokens (login), refreshing and clearing (logout) all drop it.
 """
+import fcntl
 import json
+import logging
 import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+
+from api import metrics, token_shm
+
+logger = logging.getLogger(__name__)
 
 TOKEN_FILE = Path('/app/tokens/tokens.json')
+ACCOUNTS_DIR = 'accounts'
+
+# get_tokens() should fall back to the token file
+_USE_FILE = object()
+
+_cache_lock = threading.Lock()
+# The default account's cache entry; it is never evicted
+_default = {
+    'entry': None,
+}
+# Spotify user id -> cache entry of the other accounts, least recently
+# used first
+_cache = OrderedDict()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+}
+
+
+def _account_file(key):
+    if key is None:
+        return TOKEN_FILE
+    return TOKEN_FILE.parent / ACCOUNTS_DIR / f"{quote(key, safe='')}.json"
+
+
+def _new_entry(key):
+    return {
+        # Entries are rebuilt if TOKEN_FILE is pointed elsewhere
+        'base': TOKEN_FILE,
+        'token_file': _account_file(key),
+        'signature': None,
+        'version': None,
+        'tokens': None,
+        'shared': None,
+    }
+
+
+def _entry(key):
+    """The cache entry of a store key, created (evicting the oldest) if needed."""
+    if key is None:
+        # Lock-free: the default account is looked up on every request
+        entry = _default['entry']
+        if entry is None or entry['base'] is not TOKEN_FILE:
+            entry = _default['entry'] = _new_entry(None)
+        return entry
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry['base'] is TOKEN_FILE:
+            _cache.move_to_end(key)
+            return entry
+
+        entry = _new_entry(key)
+        _cache[key] = entry
+        while len(_cache) > settings.SPOTIFY_TOKEN_CACHE_MAX_ACCOUNTS:
+            _cache.popitem(last=False)
+        return entry
+
+
+def _store_key(account):
+    """Where `account`'s tokens are stored: None for the default account."""
+    if account is None:
+        return None
+    default = settings.SPOTIFY_DEFAULT_ACCOUNT
+    if not default:
+        tokens = get_tokens()
+        default = tokens.get('account') if tokens else None
+    return None if account == default else account
+
+
+def token_file(account=None):
+    """Path of the file holding `account`'s tokens."""
+    return _entry(_store_key(account))['token_file']
+
+
+@contextmanager
+def _write_lock(entry):
+    """Serialise writes to one account's tokens across threads and processes."""
+    path = entry['token_file']
+    lock_path = path.with_name(f'{path.stem}.write.lock')
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _file_signature(path):
+    """Return a cheap fingerprint of a token file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+
+
+def _read_file(path):
+    """Parse a token file; None if it is missing or unreadable."""
+    try:
+        with metrics.TOKEN_FILE_READ_LATENCY.time(), open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning('Could not read token file %s', path, exc_info=True)
+        return None
+
+
+def _write_file(path, payload):
+    """Atomically replace a token file with `payload`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tokens-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _open_shared_buffer(entry, create, seed=True):
+    """
+    The shared-memory buffer of an entry, opened once per entry; None if
+    it doesn't exist and `create` is false.
+    """
+    buffer = entry['shared']
+    if buffer is not None:
+        return buffer
+
+    path = entry['token_file'].with_suffix('.shm')
+    if not create and not path.exists():
+        return None
+    buffer = token_shm.SharedTokenBuffer(path)
+    entry['shared'] = buffer
 
+    if seed and not buffer.version():
+        _seed_shared_buffer(entry, buffer)
+    return buffer
 
-def save_tokens(access_token, refresh_token, token_type='Bearer', expires_in=3600):
-    """Save tokens to file."""
+
+def _seed_shared_buffer(entry, buffer):
+    """Publish the file's tokens to a buffer that was never written."""
+    with _write_lock(entry):
+        tokens = _read_file(entry['token_file'])
+        if tokens is not None and not buffer.version():
+            buffer.write(max(tokens.get('version', 0), 1), json.dumps(tokens).encode())
+
+
+def _commit(entry, tokens):
+    """
+    Store a complete token set, or remove it when `tokens` is None.
+
+    The caller holds the entry's write lock.
+    """
+    path = entry['token_file']
+    # Writers keep an existing buffer current even when they don't read
+    # from it themselves
+    shared = _open_shared_buffer(entry, create=settings.SPOTIFY_TOKEN_SHARED_MEMORY, seed=False)
+    current = _read_file(path) or {}
+    version = max(current.get('version', 0), shared.version() if shared else 0) + 1
+
+    if tokens is None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        payload = b''
+    else:
+        tokens = dict(tokens, version=version)
+        payload = json.dumps(tokens).encode()
+        _write_file(path, payload)
+
+    if shared is not None:
+        shared.write(version, payload)
+
+    with _cache_lock:
+        entry['signature'] = _file_signature(path) if tokens is not None else None
+        entry['version'] = version
+        entry['tokens'] = tokens
+
+
+def _expires_at(expires_in):
+    """Turn a relative ``expires_in`` into an absolute unix timestamp."""
+    if expires_in is None:
+        return None
+    return time.time() + int(expires_in)
+
+
+def _write_key(account):
+    """
+    Where newly saved tokens of `account` go. Without a configured default
+    account, the first account to log in (or one replacing a token file
+    from before accounts were tracked) becomes the default.
+    """
+    if account is None or settings.SPOTIFY_DEFAULT_ACCOUNT:
+        return _store_key(account)
+    tokens = get_tokens()
+    if tokens is None or tokens.get('account') in (None, account):
+        return None
+    return account
+
+
+def save_tokens(access_token, refresh_token, token_type='Bearer', expires_in=3600, account=None):
+    """Save an account's tokens to file (None: the default account)."""
     tokens = {
+        'account': account,
         'access_token': access_token,
         'refresh_token': refresh_token,
         'token_type': token_type,
-        'expires_in': expires_in
+        'expires_in': expires_in,
+        'expires_at': _expires_at(expires_in),
     }
-    
-    # Ensure the directory exists
-    TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(TOKEN_FILE, 'w') as f:
-        json.dump(tokens, f)
 
+    key = _write_key(account)
+    entry = _entry(key)
+    with _write_lock(entry):
+        _commit(entry, tokens)
+
+    if key is None and account is not None:
+        # The account is now the default; drop a copy stored under its id
+        named = _entry(account)
+        if named['token_file'].exists():
+            with _write_lock(named):
+                _commit(named, None)
+
+
+def _get_shared_tokens(entry, buffer):
+    """get_tokens() via the shared-memory buffer, or _USE_FILE."""
+    with _cache_lock:
+        known_version = entry['version']
+
+    result = buffer.read(known_version)
+    if result is None or result[1] is None:
+        return _USE_FILE
+    version, payload = result
+    if not version:
+        # Nothing published yet
+        return _USE_FILE
+
+    if payload is token_shm.UNCHANGED:
+        with _cache_lock:
+            if entry['version'] == version:
+                _stats['hits'] += 1
+                metrics.TOKEN_CACHE_HIT.inc()
+                tokens = entry['tokens']
+                return dict(tokens) if tokens is not None else None
+        return _USE_FILE
+
+    with _cache_lock:
+        _stats['misses'] += 1
+    metrics.TOKEN_CACHE_MISS.inc()
+
+    tokens = json.loads(payload) if payload else None
+    with _cache_lock:
+        entry['signature'] = None
+        entry['version'] = version
+        entry['tokens'] = tokens
+    return dict(tokens) if tokens is not None else None
+
+
+def get_tokens(account=None):
+    """Get an account's tokens from the cache, re-reading them only if they changed."""
+    if account is None:
+        return _get_entry_tokens(_entry(None))
+
+    # Named accounts are looked up under their own id first, so finding
+    # one costs a single cache check; only the default account, which is
+    # stored in tokens.json, takes a second one
+    tokens = _get_entry_tokens(_entry(account))
+    if tokens is not None:
+        return tokens
+    tokens = _get_entry_tokens(_entry(None))
+    if tokens is not None and account in (tokens.get('account'), settings.SPOTIFY_DEFAULT_ACCOUNT):
+        return tokens
+    return None
+
+
+def _get_entry_tokens(entry):
+    if settings.SPOTIFY_TOKEN_SHARED_MEMORY:
+        # Only the default account's buffer is created by readers, so
+        # unknown account names don't leave files behind
+        buffer = _open_shared_buffer(entry, create=entry['token_file'] is TOKEN_FILE)
+        if buffer is not None:
+            tokens = _get_shared_tokens(entry, buffer)
+            if tokens is not _USE_FILE:
+                return tokens
+
+    path = entry['token_file']
+    signature = _file_signature(path)
 
-def get_tokens():
-    """Get tokens from file."""
-    if not TOKEN_FILE.exists():
+    with _cache_lock:
+        if signature is not None and signature == entry['signature']:
+            _stats['hits'] += 1
+            metrics.TOKEN_CACHE_HIT.inc()
+            return dict(entry['tokens'])
+        _stats['misses'] += 1
+    metrics.TOKEN_CACHE_MISS.inc()
+
+    if signature is None:
+        with _cache_lock:
+            entry['signature'] = None
+            entry['version'] = None
+            entry['tokens'] = None
         return None
-    
-    try:
-        with open(TOKEN_FILE, 'r') as f:
-            return json.load(f)
-    except Exception:
+
+    tokens = _read_file(path)
+    if tokens is None:
         return None
 
+    with _cache_lock:
+        entry['signature'] = signature
+        entry['version'] = None
+        entry['tokens'] = tokens
+
+    return dict(tokens)
+
+
+def get_version(account=None):
+    """Version of an account's stored tokens; it goes up with every write."""
+    tokens = get_tokens(account)
+    return tokens.get('version', 0) if tokens else 0
 
-def update_access_token(access_token, expires_in=3600):
+
+def _update(account, change):
+    """Apply `change` to an account's stored tokens under its write lock."""
+    entry = _entry(_store_key(account))
+    with _write_lock(entry):
+        tokens = _read_file(entry['token_file'])
+        if tokens:
+            change(tokens)
+            _commit(entry, tokens)
+
+
+def update_access_token(access_token, expires_in=3600, account=None):
     """Update just the access token (after refresh)."""
-    tokens = get_tokens()
-    if tokens:
+    def change(tokens):
         tokens['access_token'] = access_token
         tokens['expires_in'] = expires_in
-        with open(TOKEN_FILE, 'w') as f:
-            json.dump(tokens, f)
+        tokens['expires_at'] = _expires_at(expires_in)
+        tokens.pop('profile', None)
+        tokens.pop('profile_fetched_at', None)
 
+    _update(account, change)
 
-def get_access_token():
+
+def get_access_token(account=None):
     """Get the current access token."""
-    tokens = get_tokens()
+    tokens = get_tokens(account)
     return tokens.get('access_token') if tokens else None
 
 
-def get_refresh_token():
+def get_refresh_token(account=None):
     """Get the current refresh token."""
-    tokens = get_tokens()
+    tokens = get_tokens(account)
     return tokens.get('refresh_token') if tokens else None
+
+
+def get_expires_at(tokens=None, account=None):
+    """
+    Get the absolute expiry time of the current access token.
+
+    Token files written before ``expires_at`` was tracked fall back to the
+    file's mtime plus ``expires_in``.
+    """
+    if tokens is None:
+        tokens = get_tokens(account)
+    if not tokens:
+        return None
+    if tokens.get('expires_at') is not None:
+        return tokens['expires_at']
+    if tokens.get('expires_in') is None:
+        return None
+    try:
+        return os.stat(token_file(account)).st_mtime + int(tokens['expires_in'])
+    except OSError:
+        return None
+
+
+def seconds_until_expiry(tokens=None, account=None):
+    """Seconds the current access token stays valid, or None if unknown."""
+    expires_at = get_expires_at(tokens, account)
+    if expires_at is None:
+        return None
+    return expires_at - time.time()
+
+
+def save_profile(profile, account=None):
+    """Cache the user's profile next to the current tokens."""
+    def change(tokens):
+        tokens['profile'] = profile
+        tokens['profile_fetched_at'] = time.time()
+
+    _update(account, change)
+
+
+def get_profile(max_age, tokens=None, account=None):
+    """The cached profile if it is at most `max_age` seconds old, else None."""
+    if tokens is None:
+        tokens = get_tokens(account)
+    if not tokens or tokens.get('profile') is None:
+        return None
+    fetched_at = tokens.get('profile_fetched_at') or 0
+    if time.time() - fetched_at > max_age:
+        return None
+    return tokens['profile']
+
+
+def stored_accounts():
+    """
+    Store keys of every account with tokens on disk: None for the default
+    account, followed by the Spotify user ids of the others.
+    """
+    keys = [None] if TOKEN_FILE.exists() else []
+    try:
+        names = sorted(os.listdir(TOKEN_FILE.parent / ACCOUNTS_DIR))
+    except FileNotFoundError:
+        names = []
+    keys.extend(unquote(name[:-len('.json')]) for name in names if name.endswith('.json'))
+    return keys
+
+
+def list_accounts():
+    """Spotify user ids of all logged-in accounts, the default one first."""
+    accounts = []
+    for key in stored_accounts():
+        if key is None:
+            tokens = get_tokens()
+            accounts.append(tokens.get('account') if tokens else None)
+        else:
+            accounts.append(key)
+    return accounts
+
+
+def clear_tokens(account=None):
+    """Remove an account's token file (logout)."""
+    entry = _entry(_store_key(account))
+    with _write_lock(entry):
+        _commit(entry, None)
+
+
+def invalidate_cache(account=None):
+    """Drop an account's cached tokens so the next read goes to disk."""
+    key = _store_key(account)
+    with _cache_lock:
+        entry = _default['entry'] if key is None else _cache.get(key)
+        if entry is not None:
+            entry['signature'] = None
+            entry['version'] = None
+            entry['tokens'] = None
+
+
+def get_cache_stats():
+    """Return token cache hit/miss counters for this process."""
+    with _cache_lock:
+        stats = dict(_stats)
+        stats['accounts'] = len(_cache) + (_default['entry'] is not None)
+    return stats
@@ -0,0 +1,285 @@
+"""
+Access token refresh for the stored Spotify accounts.
+
+Refreshes are single-flight per account: a thread lock serialises callers
+inside a process and an flock on a lock file next to the account's token
+file serialises worker processes. A caller that had to wait re-reads the
+tokens and reuses the token the winner fetched instead of refreshing again.
+
+A daemon thread per process renews every account's token ahead of expiry,
+so the hot path normally never sends an expired token to Spotify. It
+sleeps until the next account is due, and an account whose refresh failed
+is retried after IDLE_POLL_SECONDS without holding up the others.
+"""
+import base64
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from api import metrics, spotify_client, timing, token_manager
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = f'{spotify_client.ACCOUNTS_BASE_URL}/api/token'
+
+# How long to sleep between checks when there is nothing to schedule
+# (no tokens yet, unknown expiry, or a failed refresh).
+IDLE_POLL_SECONDS = 30
+
+_refresh_locks = {}
+_refresh_locks_lock = threading.Lock()
+_refresher = {
+    'pid': None,
+    'thread': None,
+}
+_refresher_lock = threading.Lock()
+
+
+def _lock_file_path(account=None):
+    return token_manager.token_file(account).with_suffix('.lock')
+
+
+def _refresh_lock(account):
+    with _refresh_locks_lock:
+        return _refresh_locks.setdefault(account, threading.Lock())
+
+
+@contextmanager
+def _single_flight(account=None):
+    """Hold an account's in-process and cross-process refresh locks."""
+    with _refresh_lock(account):
+        lock_path = _lock_file_path(account)
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _request_new_token(refresh_token, account=None):
+    """POST the refresh grant to Spotify and persist the result."""
+    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
+    credentials_b64 = base64.b64encode(credentials.encode()).decode()
+
+    headers = {
+        'Authorization': f'Basic {credentials_b64}',
+        'Content-Type': 'application/x-www-form-urlencoded',
+    }
+
+    data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+    }
+
+    try:
+        with metrics.TOKEN_REFRESH_LATENCY.time():
+            response = spotify_client.post(TOKEN_URL, headers=headers, data=data)
+            response.raise_for_status()
+            token_data = response.json()
+    except spotify_client.UpstreamUnavailable:
+        # Breaker open or out of time: the caller answers 503, not "log in again"
+        metrics.TOKEN_REFRESHES.labels('failed').inc()
+        raise
+    except Exception:
+        metrics.TOKEN_REFRESHES.labels('failed').inc()
+        logger.warning('Spotify token refresh failed', exc_info=True)
+        return None
+
+    metrics.TOKEN_REFRESHES.labels('refreshed').inc()
+
+    new_access_token = token_data.get('access_token')
+    expires_in = token_data.get('expires_in', 3600)
+
+    if token_data.get('refresh_token'):
+        # Refresh token was rotated, store the full set
+        token_manager.save_tokens(
+            access_token=new_access_token,
+            refresh_token=token_data.get('refresh_token'),
+            token_type=token_data.get('token_type', 'Bearer'),
+            expires_in=expires_in,
+            account=account
+        )
+    else:
+        token_manager.update_access_token(
+            access_token=new_access_token,
+            expires_in=expires_in,
+            account=account
+        )
+
+    return new_access_token
+
+
+def refresh_access_token(stale_token=None, min_ttl=None, account=None):
+    """
+    Refresh an account's access token, making sure only one refresh is in
+    flight for it.
+
+    stale_token: the token that was just rejected by Spotify. If another
+        caller has already replaced it, the replacement is returned
+        without a new refresh.
+    min_ttl: skip the refresh when the current token is still valid for
+        at least this many seconds (used for proactive renewal).
+
+    account: Spotify user id; None for the default account.
+
+    Returns the access token to use, or None if no refresh was possible.
+    """
+    with timing.span('refresh'), _single_flight(account):
+        tokens = token_manager.get_tokens(account)
+        if not tokens or not tokens.get('refresh_token'):
+            return None
+
+        current_token = tokens.get('access_token')
+        ttl = token_manager.seconds_until_expiry(tokens)
+
+        if stale_token is not None and current_token != stale_token:
+            if ttl is None or ttl > 0:
+                metrics.TOKEN_REFRESHES.labels('reused').inc()
+                return current_token
+
+        if min_ttl is not None and ttl is not None and ttl >= min_ttl:
+            metrics.TOKEN_REFRESHES.labels('reused').inc()
+            return current_token
+
+        return _request_new_token(tokens['refresh_token'], tokens.get('account', account))
+
+
+def _needs_refresh(tokens):
+    ttl = token_manager.seconds_until_expiry(tokens)
+    return ttl is not None and ttl <= settings.SPOTIFY_TOKEN_EXPIRY_SKEW
+
+
+def get_valid_access_token(account=None):
+    """
+    Get an access token for the hot path.
+
+    Returns the cached token while it is comfortably valid. Only when the
+    token has already expired (e.g. the background refresher is not
+    running yet) does the caller block on a single-flight refresh.
+    """
+    ensure_background_refresher()
+
+    with timing.span('token'):
+        tokens = token_manager.get_tokens(account)
+    if not tokens:
+        return None
+
+    access_token = tokens.get('access_token')
+
+    if _needs_refresh(tokens):
+        try:
+            return refresh_access_token(
+                min_ttl=settings.SPOTIFY_TOKEN_REFRESH_MARGIN,
+                account=account
+            ) or access_token
+        except spotify_client.UpstreamUnavailable:
+            # The accounts service is out of reach; a token that hasn't
+            # quite expired yet is still worth a try
+            ttl = token_manager.seconds_until_expiry(tokens)
+            if ttl is not None and ttl > 0:
+                return access_token
+            raise
+
+    return access_token
+
+
+def get_cached_access_token(account=None):
+    """
+    Get the access token only if it can be used without a refresh.
+
+    Never blocks on the network, so async code can call it directly and
+    fall back to get_valid_access_token() in a thread when it returns None.
+    """
+    ensure_background_refresher()
+
+    with timing.span('token'):
+        tokens = token_manager.get_tokens(account)
+    if not tokens or _needs_refresh(tokens):
+        return None
+    return tokens.get('access_token')
+
+
+def _refresh_due_accounts(failed_until):
+    """
+    Refresh every stored account whose token is within the refresh margin.
+
+    Returns how long to sleep until the next account is due.
+    """
+    now = time.monotonic()
+    delay = IDLE_POLL_SECONDS
+
+    for account in token_manager.stored_accounts():
+        if failed_until.get(account, 0) > now:
+            continue
+
+        ttl = token_manager.seconds_until_expiry(account=account)
+        if ttl is None:
+            continue
+
+        if ttl > settings.SPOTIFY_TOKEN_REFRESH_MARGIN:
+            delay = min(delay, ttl - settings.SPOTIFY_TOKEN_REFRESH_MARGIN)
+            continue
+
+        try:
+            token = refresh_access_token(
+                min_ttl=settings.SPOTIFY_TOKEN_REFRESH_MARGIN,
+                account=account
+            )
+        except Exception:
+            logger.exception('Background token refresh failed for account %s', account)
+            token = None
+
+        if token is None:
+            failed_until[account] = now + IDLE_POLL_SECONDS
+        else:
+            failed_until.pop(account, None)
+
+    # Spread workers out a little so they don't all wake at once; the
+    # losers of the lock just see the fresh token and go back to sleep.
+    delay += random.uniform(0, 5)
+    return max(1, min(delay, IDLE_POLL_SECONDS))
+
+
+def _refresher_loop():
+    failed_until = {}
+    delay = 0
+    while True:
+        time.sleep(delay)
+        try:
+            delay = _refresh_due_accounts(failed_until)
+        except Exception:
+            logger.exception('Background token refresher error')
+            delay = IDLE_POLL_SECONDS
+
+
+def ensure_background_refresher():
+    """Start the background refresher for this process if it isn't running."""
+    if not settings.SPOTIFY_BACKGROUND_REFRESH:
+        return
+
+    pid = os.getpid()
+    thread = _refresher['thread']
+    if _refresher['pid'] == pid and thread is not None and thread.is_alive():
+        return
+
+    with _refresher_lock:
+        thread = _refresher['thread']
+        if _refresher['pid'] == pid and thread is not None and thread.is_alive():
+            return
+
+        thread = threading.Thread(
+            target=_refresher_loop,
+            name='spotify-token-refresher',
+            daemon=True
+        )
+        thread.start()
+        _refresher['pid'] = pid
+        _refresher['thread'] = thread
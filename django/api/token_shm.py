@@ -0,0 +1,90 @@
+"""
+Shared-memory copy of the token file for api.token_manager.
+
+A small file next to the token file is mmapped by every process. It holds
+a header (sequence number, version, payload length) followed by the
+tokens as JSON. Writers, which already hold the token write lock, follow
+the seqlock protocol: make the sequence odd, write, make it even again.
+Readers copy the header, check the sequence is even and unchanged after
+copying the payload, and retry otherwise. A reader whose cached version
+is still current only touches mapped memory, with no system calls.
+
+The buffer lives on the token volume, so processes in different
+containers sharing that volume see the same pages.
+"""
+import mmap
+import os
+import struct
+
+# sequence, version, payload length
+HEADER = struct.Struct('<QQI')
+SEQUENCE = struct.Struct('<Q')
+SIZE = 64 * 1024
+
+# Written instead of a payload length when the tokens don't fit; readers
+# then go to the token file.
+TOO_LARGE = 0xFFFFFFFF
+
+# read() result when the caller's version is still current
+UNCHANGED = object()
+
+READ_ATTEMPTS = 100
+
+
+class SharedTokenBuffer:
+    """A mapped token buffer. Readers need no locks; writers must be serialised."""
+
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+    def version(self):
+        """The current version; 0 if the buffer was never written."""
+        return HEADER.unpack_from(self._map, 0)[1]
+
+    def read(self, known_version=None):
+        """
+        Read the current (version, payload).
+
+        payload is UNCHANGED when the version equals `known_version`, None
+        when the tokens are too large for the buffer, and b'' when there
+        are no tokens. Returns None if a consistent copy couldn't be made
+        (e.g. a writer died halfway), so the caller should use the file.
+        """
+        for _ in range(READ_ATTEMPTS):
+            sequence, version, length = HEADER.unpack_from(self._map, 0)
+            if sequence & 1:
+                os.sched_yield()
+                continue
+
+            if version == known_version:
+                payload = UNCHANGED
+            elif length == TOO_LARGE:
+                payload = None
+            else:
+                payload = self._map[HEADER.size:HEADER.size + length]
+
+            if SEQUENCE.unpack_from(self._map, 0)[0] == sequence:
+                return version, payload
+        return None
+
+    def write(self, version, payload):
+        """Publish `payload` (bytes) as `version`. Callers hold the write lock."""
+        if len(payload) > SIZE - HEADER.size:
+            length, payload = TOO_LARGE, b''
+        else:
+            length = len(payload)
+
+        # A writer that died mid-write leaves the sequence odd; the next
+        # one just carries on from there.
+        sequence = SEQUENCE.unpack_from(self._map, 0)[0] | 1
+        SEQUENCE.pack_into(self._map, 0, sequence)
+        self._map[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(self._map, 0, sequence, version, length)
+        SEQUENCE.pack_into(self._map, 0, sequence + 1)
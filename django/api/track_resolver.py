@@ -0,0 +1,228 @@
+"""
+Turn whatever a caller has for a track into a Spotify track URI.
+
+Worked out locally, without calling Spotify:
+- a track ID (22 base62 characters);
+- a track URI, spotify:track:<id>;
+- an open.spotify.com (or play.spotify.com) track link, with or without
+  the scheme, a locale prefix (/intl-de/) or a query string (?si=...).
+Anything else that isn't an ISRC is rejected with InvalidTrack, so
+garbage never costs a round-trip.
+
+ISRCs (12 characters, optionally prefixed with "isrc:") are looked up
+with Spotify search. Results, including "Spotify has no such track", are
+cached in the ResolvedTrack table, so every worker process shares them
+and they survive restarts. Found tracks are kept for
+TRACK_RESOLVER_CACHE_TTL seconds, misses for TRACK_RESOLVER_NEGATIVE_TTL,
+and the least recently used entries are dropped beyond
+TRACK_RESOLVER_CACHE_MAX_ENTRIES. ISRCs missing from the cache are
+searched for TRACK_RESOLVER_SEARCH_CONCURRENCY at a time.
+"""
+import contextvars
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils import timezone
+
+from api import spotify_api, spotify_client
+from api.models import ResolvedTrack
+
+TRACK = 'track'
+ISRC = 'isrc'
+
+URI_PREFIX = 'spotify:track:'
+LINK_HOSTS = {'open.spotify.com', 'play.spotify.com'}
+
+# Keeps `isrc__in` lookups under SQLite's bound-parameter limit
+QUERY_CHUNK_SIZE = 500
+
+_TRACK_ID = re.compile(r'[0-9A-Za-z]{22}')
+# Country, registrant, year of reference, designation code
+_ISRC = re.compile(r'[A-Z]{2}[A-Z0-9]{3}[0-9]{7}')
+_LOCALE = re.compile(r'intl-[a-z]{2}(-[a-z]{2})?', re.IGNORECASE)
+
+
+class InvalidTrack(ValueError):
+    """The value isn't a track ID, URI, link or ISRC."""
+
+    def __init__(self, value):
+        super().__init__(f'Not a Spotify track ID, URI, link or ISRC: {value!r}')
+        self.value = value
+
+
+class TrackNotFound(Exception):
+    """Spotify has no track with this ISRC."""
+
+    def __init__(self, isrc):
+        super().__init__(f'No Spotify track found for ISRC {isrc}')
+        self.isrc = isrc
+
+
+def track_uri(track_id):
+    return f'{URI_PREFIX}{track_id}'
+
+
+def _link_track_id(value):
+    """The track ID in an open.spotify.com link, or None."""
+    split = urlsplit(value if '//' in value else f'//{value}')
+    if (split.hostname or '').lower() not in LINK_HOSTS:
+        return None
+    parts = [part for part in split.path.split('/') if part]
+    if parts and _LOCALE.fullmatch(parts[0]):
+        parts = parts[1:]
+    if len(parts) == 2 and parts[0] == 'track':
+        return parts[1]
+    return None
+
+
+def parse(value):
+    """
+    Classify a track reference without calling Spotify.
+
+    Returns (TRACK, track_id) or (ISRC, isrc); raises InvalidTrack.
+    """
+    if not isinstance(value, str):
+        raise InvalidTrack(value)
+    text = value.strip()
+
+    if text.startswith(URI_PREFIX):
+        track_id = text[len(URI_PREFIX):]
+    elif '/' in text:
+        track_id = _link_track_id(text)
+    else:
+        track_id = text
+    if track_id is not None and _TRACK_ID.fullmatch(track_id):
+        return TRACK, track_id
+
+    isrc = text[len('isrc:'):] if text.lower().startswith('isrc:') else text
+    isrc = isrc.replace('-', '').upper()
+    if _ISRC.fullmatch(isrc):
+        return ISRC, isrc
+
+    raise InvalidTrack(value)
+
+
+def _fresh(entry, now):
+    ttl = settings.TRACK_RESOLVER_CACHE_TTL if entry.track_id else settings.TRACK_RESOLVER_NEGATIVE_TTL
+    return now - entry.resolved_at < timedelta(seconds=ttl)
+
+
+def _cached(isrcs):
+    """Fresh cache entries for `isrcs`: {isrc: track_id or ''}."""
+    now = timezone.now()
+    found = {}
+    for start in range(0, len(isrcs), QUERY_CHUNK_SIZE):
+        for entry in ResolvedTrack.objects.filter(isrc__in=isrcs[start:start + QUERY_CHUNK_SIZE]):
+            if _fresh(entry, now):
+                found[entry.isrc] = entry.track_id
+
+    used = list(found)
+    for start in range(0, len(used), QUERY_CHUNK_SIZE):
+        ResolvedTrack.objects.filter(isrc__in=used[start:start + QUERY_CHUNK_SIZE]).update(last_used_at=now)
+    return found
+
+
+def _prune():
+    """Drop expired entries and keep the table under its size bound."""
+    now = timezone.now()
+    ResolvedTrack.objects.filter(
+        track_id='',
+        resolved_at__lt=now - timedelta(seconds=settings.TRACK_RESOLVER_NEGATIVE_TTL)
+    ).delete()
+    ResolvedTrack.objects.filter(
+        resolved_at__lt=now - timedelta(seconds=settings.TRACK_RESOLVER_CACHE_TTL)
+    ).delete()
+
+    overflow = ResolvedTrack.objects.count() - settings.TRACK_RESOLVER_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        oldest = ResolvedTrack.objects.order_by('last_used_at').values_list('pk', flat=True)[:overflow]
+        ResolvedTrack.objects.filter(pk__in=list(oldest)).delete()
+
+
+def _store(isrc, track_id):
+    now = timezone.now()
+    ResolvedTrack.objects.update_or_create(
+        isrc=isrc,
+        defaults={
+            'track_id': track_id,
+            'resolved_at': now,
+            'last_used_at': now,
+        }
+    )
+    if random.random() < settings.TRACK_RESOLVER_PRUNE_PROBABILITY:
+        _prune()
+
+
+def _search(isrc, account=None):
+    """Ask Spotify for the track with an ISRC; '' if there is none."""
+    response = spotify_api.authorized_request(
+        'GET', f'{spotify_client.API_BASE_URL}/search', account=account,
+        params={'q': f'isrc:{isrc}', 'type': 'track', 'limit': 1}
+    )
+    if response.status_code != 200:
+        raise spotify_api.SpotifyError(response, 'Failed to search for ISRC')
+    items = (response.json().get('tracks') or {}).get('items') or []
+    return (items[0].get('id') or '') if items else ''
+
+
+def resolve_isrcs(isrcs, account=None):
+    """
+    Look up many ISRCs: {isrc: track_id or None}, from the cache where
+    possible and with one Spotify search per ISRC otherwise. The searches
+    run TRACK_RESOLVER_SEARCH_CONCURRENCY at a time, so a batch of new
+    ISRCs fits in the request's deadline.
+    """
+    wanted = list(dict.fromkeys(isrcs))
+    found = _cached(wanted)
+    missing = [isrc for isrc in wanted if isrc not in found]
+
+    if len(missing) == 1:
+        found[missing[0]] = _search(missing[0], account)
+        _store(missing[0], found[missing[0]])
+    elif missing:
+        workers = max(1, min(settings.TRACK_RESOLVER_SEARCH_CONCURRENCY, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='isrc-search') as executor:
+            # Same as the playlist page fetch: the request's deadline and
+            # timing follow each search into the pool
+            futures = [
+                executor.submit(contextvars.copy_context().run, _search, isrc, account)
+                for isrc in missing
+            ]
+            # Cached from the request thread; the pool only talks to Spotify
+            for isrc, future in zip(missing, futures):
+                found[isrc] = future.result()
+                _store(isrc, found[isrc])
+    return {isrc: found[isrc] or None for isrc in wanted}
+
+
+def resolve(value, account=None):
+    """The track URI for `value`; raises InvalidTrack or TrackNotFound."""
+    kind, ref = parse(value)
+    if kind == TRACK:
+        return track_uri(ref)
+
+    track_id = resolve_isrcs([ref], account)[ref]
+    if track_id is None:
+        raise TrackNotFound(ref)
+    return track_uri(track_id)
+
+
+def resolve_many(values, account=None):
+    """
+    Track URIs for many values, in order; None for ISRCs Spotify doesn't
+    know. Every value is validated before any ISRC is looked up, so an
+    invalid one raises InvalidTrack without calling Spotify.
+    """
+    parsed = [parse(value) for value in values]
+    isrcs = [ref for kind, ref in parsed if kind == ISRC]
+    track_ids = resolve_isrcs(isrcs, account) if isrcs else {}
+
+    uris = []
+    for kind, ref in parsed:
+        track_id = ref if kind == TRACK else track_ids[ref]
+        uris.append(track_uri(track_id) if track_id else None)
+    return uris
@@ -1,10 +1,27 @@
 """
 URL configuration for API endpoints.
 """
+from django.conf import settings
 from django.urls import path
-from api.views import playlist
+from api.views import auth, auth_async, imports, jobs, playlist, playlist_async, tracks
+
+# Single-track views are served async when running under ASGI
+single = playlist_async if settings.SPOTIFY_ASYNC_VIEWS else playlist
+upstream = auth_async if settings.SPOTIFY_ASYNC_VIEWS else auth
 
 urlpatterns = [
-    path('playlist/add', playlist.add_song_to_playlist, name='add_song'),
-    path('playlist/remove', playlist.remove_song_from_playlist, name='remove_song'),
+    path('playlist/add', single.add_song_to_playlist, name='add_song'),
+    path('playlist/add/batch', playlist.add_songs_to_playlist_batch, name='add_songs_batch'),
+    path('playlist/remove', single.remove_song_from_playlist, name='remove_song'),
+    path('playlist/remove/batch', playlist.remove_songs_from_playlist_batch, name='remove_songs_batch'),
+    path('playlist/contains', playlist.playlist_contains, name='playlist_contains'),
+    path('playlist/<str:playlist_id>/tracks', playlist.get_playlist_tracks, name='playlist_tracks'),
+    path('playlist/<str:playlist_id>/sync', playlist.sync_playlist_tracks, name='sync_playlist'),
+    path('playlist/<str:playlist_id>/import', imports.import_tracks, name='import_tracks'),
+    path('tracks/resolve', tracks.resolve_tracks, name='resolve_tracks'),
+    # Same as /auth/status, reachable from the internal port for health checks
+    path('auth/status', upstream.auth_status, name='api_auth_status'),
+    path('accounts', auth.list_accounts, name='accounts'),
+    path('jobs/status', jobs.jobs_status, name='jobs_status'),
+    path('jobs/<uuid:job_id>', jobs.job_status, name='job_status'),
 ]
@@ -1,12 +1,16 @@
 """
 URL configuration for authentication endpoints.
 """
+from django.conf import settings
 from django.urls import path
-from api.views import auth
+from api.views import auth, auth_async
+
+# Views that call Spotify are served async when running under ASGI
+upstream = auth_async if settings.SPOTIFY_ASYNC_VIEWS else auth
 
 urlpatterns = [
     path('login', auth.spotify_login, name='spotify_login'),
-    path('callback', auth.spotify_callback, name='spotify_callback'),
-    path('status', auth.auth_status, name='auth_status'),
+    path('callback', upstream.spotify_callback, name='spotify_callback'),
+    path('status', upstream.auth_status, name='auth_status'),
     path('logout', auth.logout, name='logout'),
 ]
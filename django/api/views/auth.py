@@ -3,12 +3,20 @@ Spotify OAuth authentication views.
 """
 import base64
 import secrets
+from datetime import datetime, timezone
+
 import requests
 from django.conf import settings
 from django.http import JsonResponse, HttpResponseRedirect
 from django.views.decorators.csrf import csrf_exempt
 from urllib.parse import urlencode
-from api import token_manager
+from api import spotify_api, spotify_client, timing, token_manager
+from api.views.playlist import (
+    get_account,
+    invalid_account,
+    invalid_account_response,
+    upstream_unavailable_response,
+)
 
 
 def spotify_login(request):
@@ -34,7 +42,7 @@ def spotify_login(request):
         'state': state,
     }
     
-    auth_url = f"https://accounts.spotify.com/authorize?{urlencode(auth_params)}"
+    auth_url = f"{spotify_client.ACCOUNTS_BASE_URL}/authorize?{urlencode(auth_params)}"
     return HttpResponseRedirect(auth_url)
 
 
@@ -42,6 +50,9 @@ def spotify_login(request):
 def spotify_callback(request):
     """
     Handles the callback from Spotify OAuth and exchanges the code for an access token.
+
+    The tokens are stored under the Spotify user id they belong to, so
+    logging in with several accounts keeps all of them available.
     """
     code = request.GET.get('code')
     state = request.GET.get('state')
@@ -62,7 +73,7 @@ def spotify_callback(request):
         }, status=400)
     
     # Exchange code for access token
-    token_url = 'https://accounts.spotify.com/api/token'
+    token_url = f'{spotify_client.ACCOUNTS_BASE_URL}/api/token'
     
     # Prepare credentials
     credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
@@ -80,11 +91,18 @@ def spotify_callback(request):
     }
     
     try:
-        response = requests.post(token_url, headers=headers, data=data)
+        response = spotify_client.post(token_url, headers=headers, data=data)
         response.raise_for_status()
         
         token_data = response.json()
-        
+
+        # Look up whose tokens these are
+        me = spotify_client.get(f'{spotify_client.API_BASE_URL}/me', headers={
+            'Authorization': f"Bearer {token_data.get('access_token')}"
+        })
+        me.raise_for_status()
+        profile = profile_from_user_data(me.json())
+
         # Store tokens in session (for browser)
         request.session['access_token'] = token_data.get('access_token')
         request.session['refresh_token'] = token_data.get('refresh_token')
@@ -92,19 +110,26 @@ def spotify_callback(request):
         request.session['expires_in'] = token_data.get('expires_in')
         
         # ALSO store tokens globally for API access from VMs
-        token_manager.save_tokens(
-            access_token=token_data.get('access_token'),
-            refresh_token=token_data.get('refresh_token'),
-            token_type=token_data.get('token_type'),
-            expires_in=token_data.get('expires_in')
-        )
+        with timing.span('store'):
+            token_manager.save_tokens(
+                access_token=token_data.get('access_token'),
+                refresh_token=token_data.get('refresh_token'),
+                token_type=token_data.get('token_type'),
+                expires_in=token_data.get('expires_in'),
+                account=profile['id']
+            )
+            token_manager.save_profile(profile, account=profile['id'])
         
         return JsonResponse({
             'success': True,
             'message': 'Successfully authenticated with Spotify',
+            'account': profile['id'],
             'expires_in': token_data.get('expires_in')
         })
         
+    except spotify_client.UpstreamUnavailable as e:
+        # Rate limited, circuit open or out of time: the login can be retried
+        return upstream_unavailable_response(e)
     except requests.exceptions.RequestException as e:
         return JsonResponse({
             'success': False,
@@ -112,62 +137,129 @@ def spotify_callback(request):
         }, status=500)
 
 
+def wants_verify(request):
+    return request.GET.get('verify', '').lower() in ('1', 'true', 'yes')
+
+
+def profile_from_user_data(user_data):
+    return {
+        'id': user_data.get('id'),
+        'display_name': user_data.get('display_name'),
+        'email': user_data.get('email')
+    }
+
+
+def not_authenticated_response():
+    return JsonResponse({
+        'authenticated': False,
+        'message': 'No access token found. Please authenticate first.'
+    })
+
+
+def invalid_token_response():
+    return JsonResponse({
+        'authenticated': False,
+        'message': 'Token is invalid or expired'
+    })
+
+
+def status_response(tokens, profile, verified):
+    """Status built from local token state and the (cached or fresh) profile."""
+    expires_at = token_manager.get_expires_at(tokens)
+    expires_in = token_manager.seconds_until_expiry(tokens)
+
+    return JsonResponse({
+        'authenticated': True,
+        'verified': verified,
+        'user': profile,
+        'token': {
+            'expires_at': (
+                datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat()
+                if expires_at is not None else None
+            ),
+            'expires_in': max(0, int(expires_in)) if expires_in is not None else None,
+            'expired': expires_in is not None and expires_in <= 0,
+            'refreshable': bool(tokens.get('refresh_token'))
+        }
+    })
+
+
 def auth_status(request):
     """
     Check if the user is authenticated with Spotify.
+
+    Answers from the global token store and a profile cached for
+    AUTH_STATUS_CACHE_TTL seconds, so polling it doesn't call Spotify.
+    `?verify=1` forces a live check against /v1/me. `?account=<user id>`
+    (or X-Spotify-Account) asks about another account than the default.
     """
-    access_token = request.session.get('access_token')
-    
-    if not access_token:
+    account = get_account(request)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    with timing.span('token'):
+        tokens = token_manager.get_tokens(account)
+    if not tokens or not tokens.get('access_token'):
+        return not_authenticated_response()
+
+    if not wants_verify(request):
+        with timing.span('profile'):
+            profile = token_manager.get_profile(settings.AUTH_STATUS_CACHE_TTL, tokens, account)
+        if profile is not None:
+            return status_response(tokens, profile, verified=False)
+
+    try:
+        response = spotify_api.authorized_request('GET', f'{spotify_client.API_BASE_URL}/me', account=account)
+    except spotify_api.NotAuthenticated:
+        return not_authenticated_response()
+    except spotify_client.UpstreamUnavailable as e:
         return JsonResponse({
             'authenticated': False,
-            'message': 'No access token found. Please authenticate first.'
-        })
-    
-    # Optionally verify token with Spotify
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
-    
-    try:
-        response = requests.get('https://api.spotify.com/v1/me', headers=headers)
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            return JsonResponse({
-                'authenticated': True,
-                'user': {
-                    'id': user_data.get('id'),
-                    'display_name': user_data.get('display_name'),
-                    'email': user_data.get('email')
-                }
-            })
-        else:
-            return JsonResponse({
-                'authenticated': False,
-                'message': 'Token is invalid or expired'
-            })
-            
+            'message': str(e)
+        }, status=503)
     except requests.exceptions.RequestException:
         return JsonResponse({
             'authenticated': False,
             'message': 'Failed to verify token'
         }, status=500)
 
+    if response.status_code != 200:
+        return invalid_token_response()
+
+    profile = profile_from_user_data(response.json())
+    token_manager.save_profile(profile, account)
+    return status_response(token_manager.get_tokens(account) or tokens, profile, verified=True)
+
+
+def list_accounts(request):
+    """
+    List the Spotify accounts with stored tokens, the default one first.
+    Any of them can be passed as `account` to the playlist endpoints.
+    """
+    accounts = token_manager.list_accounts()
+    return JsonResponse({
+        'success': True,
+        'default': accounts[0] if accounts and token_manager.get_tokens() else None,
+        'accounts': accounts
+    })
+
 
 def logout(request):
     """
     Clear session and token storage.
+
+    Only the default account is logged out unless `?account=<user id>`
+    (or X-Spotify-Account) names another one.
     """
+    account = get_account(request)
+    if invalid_account(account):
+        return invalid_account_response()
+
     # Clear session
     request.session.flush()
     
     # Clear global token storage
-    import os
-    from api import token_manager
-    token_file = token_manager.TOKEN_FILE
-    if token_file.exists():
-        os.remove(token_file)
+    token_manager.clear_tokens(account)
     
     return JsonResponse({
         'success': True,
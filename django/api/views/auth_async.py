@@ -0,0 +1,162 @@
+"""
+Async Spotify OAuth views.
+
+Async versions of the auth views that talk to Spotify (callback and
+status). Login and logout don't make upstream calls and stay sync.
+Session access is synchronous in Django 4.2, so it runs via sync_to_async.
+"""
+import base64
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from api import spotify_api, spotify_async_client, spotify_client, timing, token_manager
+from api.views.auth import (
+    get_account,
+    invalid_account,
+    invalid_account_response,
+    invalid_token_response,
+    not_authenticated_response,
+    profile_from_user_data,
+    status_response,
+    wants_verify,
+)
+from api.views.decorators import async_csrf_exempt
+from api.views.playlist import upstream_unavailable_response
+
+
+@async_csrf_exempt
+async def spotify_callback(request):
+    """
+    Handles the callback from Spotify OAuth and exchanges the code for an access token.
+    Tokens are stored under the Spotify user id they belong to.
+    """
+    code = request.GET.get('code')
+    state = request.GET.get('state')
+    error = request.GET.get('error')
+
+    if error:
+        return JsonResponse({
+            'success': False,
+            'error': error
+        }, status=400)
+
+    # Verify state to prevent CSRF
+    stored_state = await sync_to_async(request.session.get)('oauth_state')
+    if not state or state != stored_state:
+        return JsonResponse({
+            'success': False,
+            'error': 'State mismatch - possible CSRF attack'
+        }, status=400)
+
+    token_url = f'{spotify_async_client.ACCOUNTS_BASE_URL}/api/token'
+
+    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
+    credentials_b64 = base64.b64encode(credentials.encode()).decode()
+
+    headers = {
+        'Authorization': f'Basic {credentials_b64}',
+        'Content-Type': 'application/x-www-form-urlencoded',
+    }
+
+    data = {
+        'grant_type': 'authorization_code',
+        'code': code,
+        'redirect_uri': settings.SPOTIFY_REDIRECT_URI,
+    }
+
+    try:
+        response = await spotify_async_client.post(token_url, headers=headers, data=data)
+        response.raise_for_status()
+        token_data = response.json()
+
+        # Look up whose tokens these are
+        me = await spotify_async_client.get(f'{spotify_async_client.API_BASE_URL}/me', headers={
+            'Authorization': f"Bearer {token_data.get('access_token')}"
+        })
+        me.raise_for_status()
+    except spotify_client.UpstreamUnavailable as e:
+        # Rate limited, circuit open or out of time: the login can be retried
+        return upstream_unavailable_response(e)
+    except httpx.HTTPError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+    profile = profile_from_user_data(me.json())
+
+    def store_tokens():
+        # Store tokens in session (for browser)
+        request.session['access_token'] = token_data.get('access_token')
+        request.session['refresh_token'] = token_data.get('refresh_token')
+        request.session['token_type'] = token_data.get('token_type')
+        request.session['expires_in'] = token_data.get('expires_in')
+
+        # ALSO store tokens globally for API access from VMs
+        token_manager.save_tokens(
+            access_token=token_data.get('access_token'),
+            refresh_token=token_data.get('refresh_token'),
+            token_type=token_data.get('token_type'),
+            expires_in=token_data.get('expires_in'),
+            account=profile['id']
+        )
+        token_manager.save_profile(profile, account=profile['id'])
+
+    with timing.span('store'):
+        await sync_to_async(store_tokens)()
+
+    return JsonResponse({
+        'success': True,
+        'message': 'Successfully authenticated with Spotify',
+        'account': profile['id'],
+        'expires_in': token_data.get('expires_in')
+    })
+
+
+async def auth_status(request):
+    """
+    Check if the user is authenticated with Spotify.
+
+    Same as auth.auth_status, with the live check on the async client.
+    """
+    account = get_account(request)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    with timing.span('token'):
+        tokens = token_manager.get_tokens(account)
+    if not tokens or not tokens.get('access_token'):
+        return not_authenticated_response()
+
+    if not wants_verify(request):
+        with timing.span('profile'):
+            profile = token_manager.get_profile(settings.AUTH_STATUS_CACHE_TTL, tokens, account)
+        if profile is not None:
+            return status_response(tokens, profile, verified=False)
+
+    try:
+        response = await spotify_api.authorized_request_async(
+            'GET', f'{spotify_async_client.API_BASE_URL}/me', account=account
+        )
+    except spotify_api.NotAuthenticated:
+        return not_authenticated_response()
+    except spotify_client.UpstreamUnavailable as e:
+        return JsonResponse({
+            'authenticated': False,
+            'message': str(e)
+        }, status=503)
+    except httpx.HTTPError:
+        return JsonResponse({
+            'authenticated': False,
+            'message': 'Failed to verify token'
+        }, status=500)
+
+    if response.status_code != 200:
+        return invalid_token_response()
+
+    profile = profile_from_user_data(response.json())
+    await sync_to_async(token_manager.save_profile)(profile, account)
+    return status_response(token_manager.get_tokens(account) or tokens, profile, verified=True)
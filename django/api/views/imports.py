@@ -0,0 +1,227 @@
+"""
+Streaming bulk import views.
+"""
+import json
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api import deadline, spotify_api, spotify_client, track_resolver
+from api.views.playlist import (
+    get_access_token,
+    get_account,
+    invalid_account,
+    invalid_account_response,
+    upstream_unavailable_response,
+)
+
+# Longest line accepted; a track link with a long query string is ~200 bytes
+MAX_LINE_BYTES = 4096
+
+
+def _read_lines(request):
+    """
+    Yield (offset, line) for every line of the request body without reading
+    all of it, offset being the 0-based line number. Lines longer than
+    MAX_LINE_BYTES are yielded as None and the rest of them is discarded.
+    """
+    offset = 0
+    while True:
+        line = request.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > MAX_LINE_BYTES and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = request.readline(MAX_LINE_BYTES)
+            yield offset, None
+        else:
+            yield offset, line
+        offset += 1
+
+
+def _parse_line(line):
+    """The track value on an NDJSON line; raises ValueError."""
+    if line is None:
+        raise ValueError('line too long')
+    value = json.loads(line)
+    if isinstance(value, dict):
+        value = value.get('song_id')
+    return track_resolver.parse(value)
+
+
+def _chunks(request, skip):
+    """Non-blank lines from `skip` on, in lists of MAX_ITEMS_PER_REQUEST."""
+    chunk = []
+    for offset, line in _read_lines(request):
+        if offset < skip or (line is not None and not line.strip()):
+            continue
+        chunk.append((offset, line))
+        if len(chunk) == spotify_api.MAX_ITEMS_PER_REQUEST:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _import_chunk(playlist_id, chunk, account):
+    """Resolve and add one chunk of lines; returns its progress record."""
+    result = {
+        'offset': chunk[0][0],
+        'next_offset': chunk[-1][0] + 1,
+        'lines': len(chunk),
+        'added': 0,
+        'invalid': [],
+        'not_found': [],
+    }
+
+    parsed = []
+    for offset, line in chunk:
+        try:
+            parsed.append((offset, _parse_line(line)))
+        except ValueError:
+            result['invalid'].append(offset)
+
+    isrcs = [ref for _offset, (kind, ref) in parsed if kind == track_resolver.ISRC]
+    found = track_resolver.resolve_isrcs(isrcs, account) if isrcs else {}
+
+    uris = []
+    for offset, (kind, ref) in parsed:
+        track_id = ref if kind == track_resolver.TRACK else found[ref]
+        if track_id:
+            uris.append(track_resolver.track_uri(track_id))
+        else:
+            result['not_found'].append(offset)
+
+    if uris:
+        response = spotify_api.add_tracks(playlist_id, uris, account=account)
+        if response.status_code != 201:
+            if response.status_code == 401:
+                error = 'Access token expired and refresh failed. Please re-authenticate at /login'
+            else:
+                error = spotify_api.error_message(response, 'Failed to add songs to playlist')
+            result.update(success=False, status_code=response.status_code, error=error)
+            return result
+        result['added'] = len(uris)
+        result['snapshot_id'] = response.json().get('snapshot_id')
+
+    result['success'] = True
+    return result
+
+
+def _import_stream(request, playlist_id, skip, account):
+    """The import itself: one NDJSON progress line per chunk, then a summary."""
+    totals = {'added': 0, 'invalid': 0, 'not_found': 0}
+    next_offset = skip
+    snapshot_id = None
+
+    for chunk in _chunks(request, skip):
+        try:
+            # The stream outlives the middleware's budget; each chunk gets
+            # one of its own
+            with deadline.budget(settings.SPOTIFY_REQUEST_DEADLINE):
+                result = _import_chunk(playlist_id, chunk, account)
+        except spotify_api.NotAuthenticated:
+            result = {'success': False, 'status_code': 401,
+                      'error': 'Not authenticated. Please authenticate with Spotify first.'}
+        except spotify_api.SpotifyError as e:
+            result = {'success': False, 'status_code': e.status_code, 'error': str(e)}
+        except spotify_client.UpstreamUnavailable as e:
+            result = {'success': False, 'status_code': 503, 'error': str(e), 'retry_after': e.retry_after}
+        except requests.exceptions.RequestException as e:
+            result = {'success': False, 'status_code': 500, 'error': f'Request to Spotify API failed: {str(e)}'}
+
+        if not result['success']:
+            # Nothing from this chunk was added; resume from its first line
+            result.update(offset=chunk[0][0], resume_offset=chunk[0][0])
+            yield json.dumps(result) + '\n'
+            return
+
+        totals['added'] += result['added']
+        totals['invalid'] += len(result['invalid'])
+        totals['not_found'] += len(result['not_found'])
+        next_offset = result['next_offset']
+        snapshot_id = result.get('snapshot_id') or snapshot_id
+        yield json.dumps(result) + '\n'
+
+    yield json.dumps({
+        'done': True,
+        'success': True,
+        'playlist_id': playlist_id,
+        'next_offset': next_offset,
+        'snapshot_id': snapshot_id,
+        **totals
+    }) + '\n'
+
+
+async def _iterate_async(iterator):
+    """Drive a blocking iterator from the event loop, one item at a time."""
+    done = object()
+    step = sync_to_async(next)
+    while True:
+        item = await step(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def import_tracks(request, playlist_id):
+    """
+    Add a very long list of songs to a playlist, streaming both ways.
+
+    The body is NDJSON, one song per line: a JSON string in any form
+    song_id takes in add_song_to_playlist, or {"song_id": ...}. Blank
+    lines are skipped. The body is read line by line and sent to Spotify
+    in chunks of 100, so memory use doesn't grow with the import.
+
+    The response is NDJSON too: one line per chunk with the line offsets
+    it covered ("offset", "next_offset"), how many songs were added and
+    which lines were invalid or had an unknown ISRC, then a summary line
+    with "done": true. If a chunk fails, its line carries
+    "success": false and "resume_offset" and the stream ends.
+
+    To resume after an error or a dropped connection, send the same body
+    again with ?offset=<the last next_offset received>; earlier lines are
+    read and skipped. A chunk whose progress line never arrived may have
+    been added already.
+
+    The account is taken from the X-Spotify-Account header or ?account=.
+    """
+    account = get_account(request)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    try:
+        skip = int(request.GET.get('offset', 0))
+    except ValueError:
+        skip = -1
+    if skip < 0:
+        return JsonResponse({
+            'success': False,
+            'error': 'offset must be a non-negative line number'
+        }, status=400)
+
+    try:
+        access_token = get_access_token(account=account)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    if not access_token:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+
+    stream = _import_stream(request, playlist_id, skip, account)
+    if settings.SPOTIFY_ASYNC_VIEWS:
+        # A plain iterator would be buffered whole under ASGI
+        stream = _iterate_async(stream)
+    response = StreamingHttpResponse(stream, content_type='application/x-ndjson')
+    # Let nginx pass each progress line on as soon as it is written
+    response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,75 @@
+"""
+Status views for asynchronous playlist jobs.
+"""
+import json
+
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api import jobs
+from api.models import PlaylistJob
+
+
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    """
+    Get the status of one job.
+    """
+    job = PlaylistJob.objects.filter(pk=job_id).first()
+
+    if job is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'Job not found'
+        }, status=404)
+
+    return JsonResponse({
+        'success': True,
+        'job': jobs.job_to_dict(job)
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def jobs_status(request):
+    """
+    Get the status of many jobs at once.
+
+    Expected JSON body:
+    {
+        "job_ids": ["uuid", ...]
+    }
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+
+    job_ids = data.get('job_ids')
+
+    if not job_ids or not isinstance(job_ids, list) or not all(isinstance(j, str) for j in job_ids):
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required field: job_ids (list of job IDs)'
+        }, status=400)
+
+    valid_ids = []
+    for job_id in job_ids:
+        try:
+            valid_ids.append(str(PlaylistJob._meta.pk.to_python(job_id)))
+        except Exception:
+            pass
+
+    found = {
+        str(job.pk): jobs.job_to_dict(job)
+        for job in PlaylistJob.objects.filter(pk__in=valid_ids)
+    }
+
+    return JsonResponse({
+        'success': True,
+        'jobs': [found.get(job_id, {'job_id': job_id, 'status': 'not_found'}) for job_id in job_ids]
+    })
@@ -0,0 +1,16 @@
+"""
+Prometheus scrape endpoint, served on the internal port only.
+"""
+from django.http import HttpResponse
+from django.views.decorators.http import require_http_methods
+
+from api import metrics
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Expose all metrics (aggregated over worker processes).
+    """
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
@@ -2,79 +2,319 @@
 Spotify playlist management views.
 """
 import json
-import base64
+import math
 import requests
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from api import token_manager
+from api import (
+    coalescer,
+    idempotency,
+    jobs,
+    playlist_mirror,
+    playlist_sync,
+    single_flight,
+    spotify_api,
+    spotify_client,
+    token_refresher,
+    track_resolver,
+)
+from api.models import PlaylistJob
 
 
-def refresh_access_token(request=None):
+def refresh_access_token(request=None, stale_token=None, account=None):
     """
     Helper function to refresh the access token using the refresh token.
-    Now uses global token storage instead of session.
+    Only one refresh runs at a time across all workers; callers that lose
+    the race get the token the winner fetched.
     """
-    refresh_token = token_manager.get_refresh_token()
-    
-    if not refresh_token:
-        return None
-    
-    token_url = 'https://accounts.spotify.com/api/token'
-    
-    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
-    credentials_b64 = base64.b64encode(credentials.encode()).decode()
-    
-    headers = {
-        'Authorization': f'Basic {credentials_b64}',
-        'Content-Type': 'application/x-www-form-urlencoded',
+    return token_refresher.refresh_access_token(stale_token=stale_token, account=account)
+
+
+def get_access_token(request=None, account=None):
+    """
+    Helper function to get access token from global storage.
+    No longer dependent on session/request. Tokens close to expiry are
+    renewed before they are handed out.
+    """
+    return token_refresher.get_valid_access_token(account)
+
+
+@csrf_exempt
+@require_http_methods(["PUT"])
+@idempotency.idempotent
+def sync_playlist_tracks(request, playlist_id):
+    """
+    Make a playlist contain exactly the given tracks.
+
+    Expected JSON body:
+    {
+        "tracks": ["spotify_track_id", "spotify:track:...", ...],
+        "reorder": false,  # optional, also match the order of "tracks"
+        "dry_run": false,  # optional, only report what would change
+        "account": "spotify_user_id"  # optional, see add_song_to_playlist
     }
-    
-    data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': refresh_token,
+
+    The current contents come from the playlist mirror. Only the
+    difference is sent to Spotify (see api.playlist_sync): surplus
+    occurrences are removed by position, missing tracks are added, and
+    with "reorder" the fewest tracks needed are moved. Tracks are given
+    in the same forms as song_id in add_song_to_playlist; ISRCs Spotify
+    has no track for are reported as "not_found" and left out. An empty
+    list empties the playlist.
+
+    Calls stop at the first failure; the steps already applied are
+    reported and the response is a 207.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+
+    if not isinstance(data, dict) or not isinstance(data.get('tracks'), list):
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required field: tracks (a list)'
+        }, status=400)
+
+    account = get_account(request, data)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    tracks = data['tracks']
+    if len(tracks) > settings.SPOTIFY_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Too many tracks in one request (max {settings.SPOTIFY_BATCH_MAX_ITEMS})'
+        }, status=400)
+
+    reorder = data.get('reorder') is True
+    dry_run = data.get('dry_run') is True or request.GET.get('dry_run') in ('1', 'true')
+
+    try:
+        uris = track_resolver.resolve_many(tracks, account)
+        mirror = playlist_mirror.get_fresh_mirror(playlist_id, account)
+        current = playlist_mirror.track_uris(mirror)
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+
+    not_found = [value for value, uri in zip(tracks, uris) if uri is None]
+    target = [uri for uri in uris if uri is not None]
+    edits = playlist_sync.plan(current, target, reorder)
+
+    added = []
+    appended_at = len(edits['final']) - sum(len(chunk) for position, chunk in edits['adds'] if position is None)
+    for position, chunk in edits['adds']:
+        if position is None:
+            position, appended_at = appended_at, appended_at + len(chunk)
+        added.extend({'uri': uri, 'position': position + i} for i, uri in enumerate(chunk))
+
+    body = {
+        'success': not not_found,
+        'playlist_id': playlist_id,
+        'dry_run': dry_run,
+        'reorder': reorder,
+        'added': len(added),
+        'removed': len(edits['removes']),
+        'moved': sum(length for _start, length, _before in edits['moves']),
+        'unchanged': edits['unchanged'],
+        'not_found': not_found,
+        'in_order': edits['final'][:len(target)] == target,
+        'diff': {
+            'add': added,
+            'remove': [{'uri': uri, 'position': position} for position, uri in edits['removes']],
+            'move': [
+                {'range_start': start, 'range_length': length, 'insert_before': before}
+                for start, length, before in edits['moves']
+            ],
+        },
+        'snapshot_id': mirror.snapshot_id or None,
     }
-    
+    if dry_run:
+        return JsonResponse(body, status=207 if not_found else 200)
+
+    snapshot, steps, failed_status = playlist_sync.apply(playlist_id, edits, mirror.snapshot_id, account)
+    body['snapshot_id'] = snapshot
+    body['steps'] = steps
+
+    if failed_status is None:
+        status_code = 207 if not_found else 200
+    else:
+        body['success'] = False
+        status_code = 207 if len(steps) > 1 else failed_status
+    return JsonResponse(body, status=status_code)
+
+
+@require_http_methods(["GET", "HEAD"])
+def get_playlist_tracks(request, playlist_id):
+    """
+    Read a playlist's track URIs, in order.
+
+    Optional query parameters: offset and limit to page through the
+    result, account (or X-Spotify-Account) to read with another
+    account's token.
+
+    Served from the playlist mirror: within PLAYLIST_MIRROR_CHECK_INTERVAL
+    of the last check it costs no Spotify call at all, after that one
+    snapshot_id request, and only a changed playlist is fetched again
+    (pages in parallel). The ETag is the snapshot_id, so a client that
+    sends it back in If-None-Match gets a 304 without a body while the
+    playlist is unchanged. Positions whose track is no longer available
+    on Spotify are null.
+    """
+    account = get_account(request)
+    if invalid_account(account):
+        return invalid_account_response()
+
     try:
-        response = requests.post(token_url, headers=headers, data=data)
-        response.raise_for_status()
-        
-        token_data = response.json()
-        
-        # Update access token in global storage
-        new_access_token = token_data.get('access_token')
-        token_manager.update_access_token(
-            access_token=new_access_token,
-            expires_in=token_data.get('expires_in', 3600)
-        )
-        
-        # If refresh token is rotated, update it too
-        if token_data.get('refresh_token'):
-            # Full token update with new refresh token
-            token_manager.save_tokens(
-                access_token=new_access_token,
-                refresh_token=token_data.get('refresh_token'),
-                token_type=token_data.get('token_type', 'Bearer'),
-                expires_in=token_data.get('expires_in', 3600)
-            )
-        
-        return new_access_token
-        
-    except Exception:
-        return None
+        offset = int(request.GET.get('offset', 0))
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        offset = -1
+    if offset < 0 or (limit is not None and limit < 0):
+        return JsonResponse({
+            'success': False,
+            'error': 'offset and limit must be non-negative integers'
+        }, status=400)
+
+    try:
+        mirror = playlist_mirror.get_fresh_mirror(playlist_id, account)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+
+    etag = f'"{mirror.snapshot_id}"' if mirror.snapshot_id else None
+    if etag is not None:
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+    uris = playlist_mirror.track_uris(mirror)
+    page = uris[offset:offset + limit] if limit is not None else uris[offset:]
 
+    response = JsonResponse({
+        'success': True,
+        'playlist_id': playlist_id,
+        'snapshot_id': mirror.snapshot_id or None,
+        'total': len(uris),
+        'offset': offset,
+        'tracks': [uri or None for uri in page]
+    })
+    if etag is not None:
+        response['ETag'] = etag
+    # Cacheable, but only after checking back with the ETag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
-def get_access_token(request=None):
+
+def get_account(request, data=None):
     """
-    Helper function to get access token from global storage.
-    No longer dependent on session/request.
+    The Spotify account (user id) a request acts for: "account" in the
+    JSON body, the X-Spotify-Account header or ?account=, in that order.
+    None means the default account.
     """
-    return token_manager.get_access_token()
+    account = (data or {}).get('account') or request.headers.get('X-Spotify-Account') or request.GET.get('account')
+    return account or None
+
+
+def invalid_account(account):
+    """Whether `account` can't be a Spotify user id."""
+    return account is not None and (not isinstance(account, str) or len(account) > 255)
+
+
+def invalid_account_response():
+    return JsonResponse({
+        'success': False,
+        'error': 'account must be a Spotify user id'
+    }, status=400)
+
+
+def wants_async(request, data):
+    """Whether the caller asked for the change to run as a background job."""
+    return data.get('async') is True or request.GET.get('async') in ('1', 'true')
+
+
+def job_accepted_response(job):
+    """202 telling the caller where to poll for the job's outcome."""
+    return JsonResponse({
+        'success': True,
+        'message': 'Request accepted, it will be processed in the background',
+        'job_id': str(job.pk),
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.pk}',
+        'playlist_id': job.playlist_id,
+        'song_id': job.song_id
+    }, status=202)
+
+
+def invalid_track_response(e):
+    return JsonResponse({
+        'success': False,
+        'error': str(e)
+    }, status=400)
+
+
+def track_not_found_response(e):
+    return JsonResponse({
+        'success': False,
+        'error': str(e)
+    }, status=404)
+
+
+def upstream_unavailable_response(e):
+    """503 for when Spotify can't be called right now, with a Retry-After hint."""
+    response = JsonResponse({
+        'success': False,
+        'error': str(e)
+    }, status=503)
+    if e.retry_after is not None:
+        response['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotency.idempotent
 def add_song_to_playlist(request):
     """
     Add a song to a Spotify playlist.
@@ -85,19 +325,38 @@ def add_song_to_playlist(request):
         "song_id": "spotify_track_id"
     }
     
-    Note: song_id should be just the track ID, not the full URI.
-    The endpoint will construct the proper Spotify URI.
+    song_id may be a track ID, a spotify:track: URI, an open.spotify.com
+    link or an ISRC (see api.track_resolver); anything else is rejected
+    with 400 before Spotify is called.
+
+    Concurrent adds to the same playlist are coalesced into one Spotify
+    call (see api.coalescer); each caller still gets its own response.
+    A request identical to one still in flight gets that one's result
+    (see api.single_flight).
+
+    Pass "skip_if_present": true to leave the playlist alone if the song
+    is already in it (checked against the local playlist mirror).
+
+    Pass "async": true (or ?async=1) to get a 202 with a job_id right away
+    and have the song added by a background worker; poll /api/jobs/<id>.
+
+    Pass "account" (or X-Spotify-Account / ?account=) to act as another
+    logged-in Spotify user instead of the default account.
     """
-    access_token = get_access_token()
-    
-    if not access_token:
-        return JsonResponse({
-            'success': False,
-            'error': 'Not authenticated. Please authenticate with Spotify first.'
-        }, status=401)
-    
     try:
         data = json.loads(request.body)
+        account = get_account(request, data)
+        if invalid_account(account):
+            return invalid_account_response()
+
+        access_token = get_access_token(account=account)
+
+        if not access_token:
+            return JsonResponse({
+                'success': False,
+                'error': 'Not authenticated. Please authenticate with Spotify first.'
+            }, status=401)
+
         playlist_id = data.get('playlist_id')
         song_id = data.get('song_id')
         
@@ -107,70 +366,70 @@ def add_song_to_playlist(request):
                 'error': 'Missing required fields: playlist_id and song_id'
             }, status=400)
         
-        # Construct Spotify track URI if not already in URI format
-        if not song_id.startswith('spotify:track:'):
-            track_uri = f'spotify:track:{song_id}'
-        else:
-            track_uri = song_id
-        
-        # Spotify API endpoint to add tracks
-        url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
-        
-        payload = {
-            'uris': [track_uri]
-        }
-        
-        response = requests.post(url, headers=headers, json=payload)
+        track_uri = track_resolver.resolve(song_id, account)
+
+        if data.get('skip_if_present') and playlist_mirror.contains(playlist_id, track_uri, account):
+            return JsonResponse({
+                'success': True,
+                'message': 'Song already in playlist, not added',
+                'skipped': True,
+                'playlist_id': playlist_id,
+                'song_id': song_id
+            })
+
+        if wants_async(request, data):
+            return job_accepted_response(jobs.enqueue(PlaylistJob.ADD, playlist_id, song_id, account))
+
+        result = single_flight.do(
+            single_flight.key(coalescer.ADD, playlist_id, track_uri, account),
+            lambda: coalescer.add_track(playlist_id, track_uri, account)
+        )
         
-        if response.status_code == 201:
-            snapshot_id = response.json().get('snapshot_id')
+        if result.status_code == 201:
+            message = 'Song added to playlist successfully'
+            if result.token_refreshed:
+                message += ' (token refreshed)'
             return JsonResponse({
                 'success': True,
-                'message': 'Song added to playlist successfully',
-                'snapshot_id': snapshot_id,
+                'message': message,
+                'snapshot_id': result.snapshot_id,
                 'playlist_id': playlist_id,
                 'song_id': song_id
             })
-        elif response.status_code == 401:
-            # Try to refresh the token
-            new_token = refresh_access_token()
-            if new_token:
-                # Retry with new token
-                headers['Authorization'] = f'Bearer {new_token}'
-                retry_response = requests.post(url, headers=headers, json=payload)
-                
-                if retry_response.status_code == 201:
-                    snapshot_id = retry_response.json().get('snapshot_id')
-                    return JsonResponse({
-                        'success': True,
-                        'message': 'Song added to playlist successfully (token refreshed)',
-                        'snapshot_id': snapshot_id,
-                        'playlist_id': playlist_id,
-                        'song_id': song_id
-                    })
-            
+        elif result.status_code == 401:
             return JsonResponse({
                 'success': False,
                 'error': 'Access token expired and refresh failed. Please re-authenticate at /login'
             }, status=401)
         else:
-            error_data = response.json()
             return JsonResponse({
                 'success': False,
-                'error': error_data.get('error', {}).get('message', 'Failed to add song to playlist'),
-                'status_code': response.status_code
-            }, status=response.status_code)
+                'error': result.error or 'Failed to add song to playlist',
+                'status_code': result.status_code
+            }, status=result.status_code)
             
     except json.JSONDecodeError:
         return JsonResponse({
             'success': False,
             'error': 'Invalid JSON in request body'
         }, status=400)
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except track_resolver.TrackNotFound as e:
+        return track_not_found_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
     except requests.exceptions.RequestException as e:
         return JsonResponse({
             'success': False,
@@ -185,6 +444,7 @@ def add_song_to_playlist(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotency.idempotent
 def remove_song_from_playlist(request):
     """
     Remove a song from a Spotify playlist.
@@ -195,19 +455,35 @@ def remove_song_from_playlist(request):
         "song_id": "spotify_track_id"
     }
     
-    Note: song_id should be just the track ID, not the full URI.
-    The endpoint will construct the proper Spotify URI.
+    song_id may be a track ID, a spotify:track: URI, an open.spotify.com
+    link or an ISRC (see api.track_resolver); anything else is rejected
+    with 400 before Spotify is called.
+
+    Concurrent removes from the same playlist are coalesced into one
+    Spotify call (see api.coalescer); each caller still gets its own
+    response. A request identical to one still in flight gets that one's
+    result (see api.single_flight).
+
+    Pass "async": true (or ?async=1) to get a 202 with a job_id right away
+    and have the song removed by a background worker; poll /api/jobs/<id>.
+
+    Pass "account" (or X-Spotify-Account / ?account=) to act as another
+    logged-in Spotify user instead of the default account.
     """
-    access_token = get_access_token()
-    
-    if not access_token:
-        return JsonResponse({
-            'success': False,
-            'error': 'Not authenticated. Please authenticate with Spotify first.'
-        }, status=401)
-    
     try:
         data = json.loads(request.body)
+        account = get_account(request, data)
+        if invalid_account(account):
+            return invalid_account_response()
+
+        access_token = get_access_token(account=account)
+
+        if not access_token:
+            return JsonResponse({
+                'success': False,
+                'error': 'Not authenticated. Please authenticate with Spotify first.'
+            }, status=401)
+
         playlist_id = data.get('playlist_id')
         song_id = data.get('song_id')
         
@@ -217,74 +493,60 @@ def remove_song_from_playlist(request):
                 'error': 'Missing required fields: playlist_id and song_id'
             }, status=400)
         
-        # Construct Spotify track URI if not already in URI format
-        if not song_id.startswith('spotify:track:'):
-            track_uri = f'spotify:track:{song_id}'
-        else:
-            track_uri = song_id
-        
-        # Spotify API endpoint to remove tracks
-        url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-        }
-        
-        payload = {
-            'tracks': [
-                {
-                    'uri': track_uri
-                }
-            ]
-        }
-        
-        response = requests.delete(url, headers=headers, json=payload)
+        track_uri = track_resolver.resolve(song_id, account)
+        if wants_async(request, data):
+            return job_accepted_response(jobs.enqueue(PlaylistJob.REMOVE, playlist_id, song_id, account))
+
+        result = single_flight.do(
+            single_flight.key(coalescer.REMOVE, playlist_id, track_uri, account),
+            lambda: coalescer.remove_track(playlist_id, track_uri, account)
+        )
         
-        if response.status_code == 200:
-            snapshot_id = response.json().get('snapshot_id')
+        if result.status_code == 200:
+            message = 'Song removed from playlist successfully'
+            if result.token_refreshed:
+                message += ' (token refreshed)'
             return JsonResponse({
                 'success': True,
-                'message': 'Song removed from playlist successfully',
-                'snapshot_id': snapshot_id,
+                'message': message,
+                'snapshot_id': result.snapshot_id,
                 'playlist_id': playlist_id,
                 'song_id': song_id
             })
-        elif response.status_code == 401:
-            # Try to refresh the token
-            new_token = refresh_access_token()
-            if new_token:
-                # Retry with new token
-                headers['Authorization'] = f'Bearer {new_token}'
-                retry_response = requests.delete(url, headers=headers, json=payload)
-                
-                if retry_response.status_code == 200:
-                    snapshot_id = retry_response.json().get('snapshot_id')
-                    return JsonResponse({
-                        'success': True,
-                        'message': 'Song removed from playlist successfully (token refreshed)',
-                        'snapshot_id': snapshot_id,
-                        'playlist_id': playlist_id,
-                        'song_id': song_id
-                    })
-            
+        elif result.status_code == 401:
             return JsonResponse({
                 'success': False,
                 'error': 'Access token expired and refresh failed. Please re-authenticate at /login'
             }, status=401)
         else:
-            error_data = response.json()
             return JsonResponse({
                 'success': False,
-                'error': error_data.get('error', {}).get('message', 'Failed to remove song from playlist'),
-                'status_code': response.status_code
-            }, status=response.status_code)
+                'error': result.error or 'Failed to remove song from playlist',
+                'status_code': result.status_code
+            }, status=result.status_code)
             
     except json.JSONDecodeError:
         return JsonResponse({
             'success': False,
             'error': 'Invalid JSON in request body'
         }, status=400)
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except track_resolver.TrackNotFound as e:
+        return track_not_found_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
     except requests.exceptions.RequestException as e:
         return JsonResponse({
             'success': False,
@@ -295,3 +557,513 @@ def remove_song_from_playlist(request):
             'success': False,
             'error': f'Unexpected error: {str(e)}'
         }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotency.idempotent
+def add_songs_to_playlist_batch(request):
+    """
+    Add many songs to a Spotify playlist in as few Spotify calls as possible.
+
+    Expected JSON body:
+    {
+        "playlist_id": "spotify_playlist_id",
+        "song_ids": ["spotify_track_id", "spotify:track:...", ...],
+        "position": 0,  # optional, insert position of the first song
+        "skip_if_present": false,  # optional
+        "account": "spotify_user_id"  # optional, see add_song_to_playlist
+    }
+
+    Songs are sent in chunks of 100 (Spotify's maximum) and keep their
+    order. If a chunk fails, the remaining chunks are skipped so the
+    playlist never ends up with songs out of order; the response says
+    exactly which songs were added.
+
+    With skip_if_present, songs already in the playlist (according to the
+    local mirror) or repeated in the batch are reported as "present"
+    instead of being added again.
+
+    song_ids take the same forms as song_id in add_song_to_playlist. ISRCs
+    Spotify has no track for are reported as "not_found"; one invalid
+    value rejects the whole batch.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    account = get_account(request, data)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    playlist_id = data.get('playlist_id')
+    song_ids = data.get('song_ids')
+    position = data.get('position')
+
+    if not playlist_id or not song_ids:
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required fields: playlist_id and song_ids'
+        }, status=400)
+
+    if not isinstance(song_ids, list) or not all(isinstance(s, str) and s for s in song_ids):
+        return JsonResponse({
+            'success': False,
+            'error': 'song_ids must be a list of track IDs, URIs, links or ISRCs'
+        }, status=400)
+
+    if len(song_ids) > settings.SPOTIFY_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Too many songs in one batch (max {settings.SPOTIFY_BATCH_MAX_ITEMS})'
+        }, status=400)
+
+    if position is not None and (isinstance(position, bool) or not isinstance(position, int) or position < 0):
+        return JsonResponse({
+            'success': False,
+            'error': 'position must be a non-negative integer'
+        }, status=400)
+
+    results = [
+        {'song_id': song_id, 'uri': None, 'status': 'skipped', 'chunk': None}
+        for song_id in song_ids
+    ]
+    chunks = []
+    snapshot_id = None
+    # Version of the playlist the next chunk is added to, when known
+    base_snapshot_id = None
+    failed_status = None
+    error = None
+
+    try:
+        pending = []
+        for result, uri in zip(results, track_resolver.resolve_many(song_ids, account)):
+            result['uri'] = uri
+            if uri is None:
+                result['status'] = 'not_found'
+            else:
+                pending.append(result)
+
+        if data.get('skip_if_present'):
+            resolved = pending
+            mirror, present = playlist_mirror.track_counts(
+                playlist_id, [result['uri'] for result in resolved], account
+            )
+            base_snapshot_id = mirror.snapshot_id
+            pending = []
+            for result in resolved:
+                if result['uri'] in present:
+                    result['status'] = 'present'
+                else:
+                    present[result['uri']] = 1
+                    pending.append(result)
+        to_send = [result['uri'] for result in pending]
+
+        for index, (offset, chunk) in enumerate(spotify_api.chunked(to_send)):
+            chunk_position = position + offset if position is not None else None
+            response = spotify_api.add_tracks(
+                playlist_id, chunk, position=chunk_position, account=account, base_snapshot_id=base_snapshot_id
+            )
+
+            if response.status_code == 201:
+                snapshot_id = base_snapshot_id = response.json().get('snapshot_id')
+                chunks.append({
+                    'index': index,
+                    'offset': offset,
+                    'count': len(chunk),
+                    'success': True,
+                    'snapshot_id': snapshot_id
+                })
+                status = 'added'
+            else:
+                failed_status = response.status_code
+                if failed_status == 401:
+                    error = 'Access token expired and refresh failed. Please re-authenticate at /login'
+                else:
+                    error = spotify_api.error_message(response, 'Failed to add songs to playlist')
+                chunks.append({
+                    'index': index,
+                    'offset': offset,
+                    'count': len(chunk),
+                    'success': False,
+                    'status_code': failed_status,
+                    'error': error
+                })
+                status = 'failed'
+
+            for result in pending[offset:offset + len(chunk)]:
+                result['status'] = status
+                result['chunk'] = index
+
+            if failed_status is not None:
+                break
+
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        failed_status = e.status_code
+        error = str(e)
+    except spotify_client.UpstreamUnavailable as e:
+        failed_status = 503
+        error = str(e)
+    except requests.exceptions.RequestException as e:
+        failed_status = 500
+        error = f'Request to Spotify API failed: {str(e)}'
+
+    added = sum(1 for result in results if result['status'] == 'added')
+    present = sum(1 for result in results if result['status'] == 'present')
+    not_found = sum(1 for result in results if result['status'] == 'not_found')
+
+    if failed_status is None and not not_found:
+        status_code = 200
+    elif failed_status is None:
+        status_code = 207 if added or present else 404
+        error = 'No Spotify track found for some ISRCs'
+    elif added:
+        status_code = 207
+    else:
+        status_code = failed_status
+
+    body = {
+        'success': failed_status is None,
+        'playlist_id': playlist_id,
+        'added': added,
+        'present': present,
+        'not_found': not_found,
+        'total': len(results),
+        'snapshot_id': snapshot_id,
+        'chunks': chunks,
+        'results': results
+    }
+    if error:
+        body['error'] = error
+
+    return JsonResponse(body, status=status_code)
+
+
+def _parse_remove_items(items):
+    """
+    Normalise the `tracks` list of a batch remove request.
+
+    Each item is a track ID/URI string or {"song_id": ..., "positions": [...]}.
+    Returns (song_id, positions) pairs, or None if an item is malformed.
+    """
+    parsed = []
+    for item in items:
+        if isinstance(item, str):
+            song_id, positions = item, None
+        elif isinstance(item, dict):
+            song_id, positions = item.get('song_id'), item.get('positions')
+        else:
+            return None
+
+        if not isinstance(song_id, str) or not song_id:
+            return None
+        if positions is not None and (
+            not isinstance(positions, list)
+            or not all(isinstance(p, int) and not isinstance(p, bool) and p >= 0 for p in positions)
+        ):
+            return None
+
+        parsed.append((song_id, positions))
+    return parsed
+
+
+def _group_remove_items(parsed):
+    """
+    Merge items per URI into Spotify track objects, keeping first-seen order.
+
+    An item without positions removes every occurrence of the track, so it
+    wins over any positions given for the same URI elsewhere in the batch.
+    """
+    grouped = {}
+    for _song_id, uri, positions in parsed:
+        if uri not in grouped:
+            grouped[uri] = set(positions) if positions is not None else None
+        elif grouped[uri] is not None:
+            if positions is None:
+                grouped[uri] = None
+            else:
+                grouped[uri].update(positions)
+
+    tracks = []
+    for uri, positions in grouped.items():
+        track = {'uri': uri}
+        if positions is not None:
+            track['positions'] = sorted(positions)
+        tracks.append(track)
+    return tracks
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotency.idempotent
+def remove_songs_from_playlist_batch(request):
+    """
+    Remove many songs from a Spotify playlist in as few Spotify calls as possible.
+
+    Expected JSON body:
+    {
+        "playlist_id": "spotify_playlist_id",
+        "snapshot_id": "playlist_snapshot_id",  # optional
+        "tracks": [
+            "spotify_track_id",
+            {"song_id": "spotify_track_id", "positions": [3, 17]}
+        ],
+        "account": "spotify_user_id"  # optional, see add_song_to_playlist
+    }
+
+    A plain track removes every occurrence of it. With positions only
+    those occurrences are removed; pass the snapshot_id the positions were
+    read from so concurrent edits can't make Spotify remove the wrong ones.
+    Tracks are sent in DELETE calls of 100; a failed chunk doesn't stop the
+    others. song_id takes the same forms as in add_song_to_playlist; ISRCs
+    Spotify has no track for are reported as "not_found".
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    account = get_account(request, data)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    playlist_id = data.get('playlist_id')
+    snapshot_id = data.get('snapshot_id')
+    items = data.get('tracks')
+
+    if not playlist_id or not items:
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required fields: playlist_id and tracks'
+        }, status=400)
+
+    parsed = _parse_remove_items(items) if isinstance(items, list) else None
+    if parsed is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'tracks must be a list of track IDs/URIs or {"song_id", "positions"} objects'
+        }, status=400)
+
+    if len(parsed) > settings.SPOTIFY_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Too many songs in one batch (max {settings.SPOTIFY_BATCH_MAX_ITEMS})'
+        }, status=400)
+
+    outcome = {}
+    chunks = []
+    snapshot = None
+    last_status = None
+
+    try:
+        uris = track_resolver.resolve_many([song_id for song_id, _positions in parsed], account)
+        parsed = [(song_id, uri, positions) for (song_id, positions), uri in zip(parsed, uris)]
+        tracks = _group_remove_items([item for item in parsed if item[1] is not None])
+
+        for index, (offset, chunk) in enumerate(spotify_api.chunked(tracks)):
+            try:
+                response = spotify_api.remove_tracks(
+                    playlist_id, chunk, snapshot_id=snapshot_id, account=account,
+                    base_snapshot_id=snapshot or snapshot_id
+                )
+            except spotify_api.NotAuthenticated:
+                status_code, error = 401, 'Not authenticated. Please authenticate with Spotify first.'
+            except spotify_client.UpstreamUnavailable as e:
+                status_code, error = 503, str(e)
+            except requests.exceptions.RequestException as e:
+                status_code, error = 500, f'Request to Spotify API failed: {str(e)}'
+            else:
+                status_code = response.status_code
+                if status_code == 200:
+                    error = None
+                    snapshot = response.json().get('snapshot_id')
+                elif status_code == 401:
+                    error = 'Access token expired and refresh failed. Please re-authenticate at /login'
+                else:
+                    error = spotify_api.error_message(response, 'Failed to remove songs from playlist')
+
+            chunk_result = {
+                'index': index,
+                'offset': offset,
+                'count': len(chunk),
+                'success': error is None
+            }
+            if error is None:
+                chunk_result['snapshot_id'] = snapshot
+            else:
+                chunk_result['status_code'] = status_code
+                chunk_result['error'] = error
+                last_status = status_code
+            chunks.append(chunk_result)
+
+            for track in chunk:
+                outcome[track['uri']] = ('removed' if error is None else 'failed', index)
+
+    # Only ISRC lookups get here; the chunks handle their own errors
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+
+    results = []
+    for song_id, uri, positions in parsed:
+        status, chunk_index = outcome[uri] if uri is not None else ('not_found', None)
+        result = {'song_id': song_id, 'uri': uri, 'status': status, 'chunk': chunk_index}
+        if positions is not None:
+            result['positions'] = positions
+        results.append(result)
+
+    removed = sum(1 for result in results if result['status'] == 'removed')
+    not_found = sum(1 for result in results if result['status'] == 'not_found')
+    failed = len(results) - removed - not_found
+
+    if not failed and not not_found:
+        status_code = 200
+    elif removed:
+        status_code = 207
+    elif failed:
+        status_code = last_status
+    else:
+        status_code = 404
+
+    body = {
+        'success': not failed and not not_found,
+        'playlist_id': playlist_id,
+        'removed': removed,
+        'failed': failed,
+        'not_found': not_found,
+        'total': len(results),
+        'snapshot_id': snapshot,
+        'chunks': chunks,
+        'results': results
+    }
+    return JsonResponse(body, status=status_code)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def playlist_contains(request):
+    """
+    Check which songs are already in a playlist.
+
+    Expected JSON body:
+    {
+        "playlist_id": "spotify_playlist_id",
+        "song_ids": ["spotify_track_id", "spotify:track:...", ...],
+        "account": "spotify_user_id"  # optional, see add_song_to_playlist
+    }
+
+    Answered from the local playlist mirror, which is re-synced from
+    Spotify only when the playlist's snapshot_id has changed. ISRCs
+    Spotify has no track for come back with a null uri.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    account = get_account(request, data)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    playlist_id = data.get('playlist_id')
+    song_ids = data.get('song_ids')
+
+    if not playlist_id or not song_ids:
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required fields: playlist_id and song_ids'
+        }, status=400)
+
+    if not isinstance(song_ids, list) or not all(isinstance(s, str) and s for s in song_ids):
+        return JsonResponse({
+            'success': False,
+            'error': 'song_ids must be a list of track IDs, URIs, links or ISRCs'
+        }, status=400)
+
+    try:
+        uris = track_resolver.resolve_many(song_ids, account)
+        mirror, counts = playlist_mirror.track_counts(playlist_id, [uri for uri in uris if uri], account)
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+
+    return JsonResponse({
+        'success': True,
+        'playlist_id': playlist_id,
+        'snapshot_id': mirror.snapshot_id,
+        'results': [
+            {
+                'song_id': song_id,
+                'uri': uri,
+                'present': uri in counts,
+                'count': counts.get(uri, 0)
+            }
+            for song_id, uri in zip(song_ids, uris)
+        ]
+    })
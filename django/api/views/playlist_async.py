@@ -0,0 +1,177 @@
+"""
+Async Spotify playlist management views.
+
+Same request and response format as api.views.playlist, but the upstream
+call is made on the async client, so under ASGI a worker isn't tied up
+while Spotify responds. Concurrent adds and removes are batched per
+playlist like the sync views' (api.coalescer.submit_async). Used instead
+of the sync single-track views when SPOTIFY_ASYNC_VIEWS is enabled.
+"""
+import json
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from api import (
+    coalescer,
+    idempotency,
+    jobs,
+    playlist_mirror,
+    single_flight,
+    spotify_api,
+    spotify_client,
+    track_resolver,
+)
+from api.views.decorators import async_csrf_exempt, async_require_http_methods
+from api.views.playlist import (
+    get_account,
+    invalid_account,
+    invalid_account_response,
+    invalid_track_response,
+    job_accepted_response,
+    track_not_found_response,
+    upstream_unavailable_response,
+    wants_async,
+)
+
+
+async def _change_playlist(request, operation):
+    """Shared body of the async add and remove views."""
+    try:
+        data = json.loads(request.body)
+        account = get_account(request, data)
+        if invalid_account(account):
+            return invalid_account_response()
+
+        playlist_id = data.get('playlist_id')
+        song_id = data.get('song_id')
+
+        if not playlist_id or not song_id:
+            return JsonResponse({
+                'success': False,
+                'error': 'Missing required fields: playlist_id and song_id'
+            }, status=400)
+
+        kind, ref = track_resolver.parse(song_id)
+        if kind == track_resolver.TRACK:
+            track_uri = track_resolver.track_uri(ref)
+        else:
+            # ISRC lookups use the database cache and the sync client
+            track_uri = await sync_to_async(track_resolver.resolve)(song_id, account)
+
+        if operation == 'add' and data.get('skip_if_present'):
+            if await sync_to_async(playlist_mirror.contains)(playlist_id, track_uri, account):
+                return JsonResponse({
+                    'success': True,
+                    'message': 'Song already in playlist, not added',
+                    'skipped': True,
+                    'playlist_id': playlist_id,
+                    'song_id': song_id
+                })
+
+        if wants_async(request, data):
+            job = await sync_to_async(jobs.enqueue)(operation, playlist_id, song_id, account)
+            return job_accepted_response(job)
+
+        result = await single_flight.do_async(
+            single_flight.key(operation, playlist_id, track_uri, account),
+            lambda: coalescer.submit_async(operation, playlist_id, track_uri, account)
+        )
+        if operation == 'add':
+            message = 'Song added to playlist successfully'
+            default_error = 'Failed to add song to playlist'
+        else:
+            message = 'Song removed from playlist successfully'
+            default_error = 'Failed to remove song from playlist'
+
+        if result.status_code == coalescer.SUCCESS_STATUS[operation]:
+            if result.token_refreshed:
+                message += ' (token refreshed)'
+            return JsonResponse({
+                'success': True,
+                'message': message,
+                'snapshot_id': result.snapshot_id,
+                'playlist_id': playlist_id,
+                'song_id': song_id
+            })
+        elif result.status_code == 401:
+            return JsonResponse({
+                'success': False,
+                'error': 'Access token expired and refresh failed. Please re-authenticate at /login'
+            }, status=401)
+        else:
+            return JsonResponse({
+                'success': False,
+                'error': result.error or default_error,
+                'status_code': result.status_code
+            }, status=result.status_code)
+
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    except track_resolver.InvalidTrack as e:
+        return invalid_track_response(e)
+    except track_resolver.TrackNotFound as e:
+        return track_not_found_response(e)
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Unexpected error: {str(e)}'
+        }, status=500)
+
+
+@async_csrf_exempt
+@async_require_http_methods(["POST"])
+@idempotency.idempotent
+async def add_song_to_playlist(request):
+    """
+    Add a song to a Spotify playlist.
+
+    Expected JSON body:
+    {
+        "playlist_id": "spotify_playlist_id",
+        "song_id": "spotify_track_id",
+        "skip_if_present": false,  # optional
+        "account": "spotify_user_id"  # optional
+    }
+    """
+    return await _change_playlist(request, 'add')
+
+
+@async_csrf_exempt
+@async_require_http_methods(["POST"])
+@idempotency.idempotent
+async def remove_song_from_playlist(request):
+    """
+    Remove a song from a Spotify playlist.
+
+    Expected JSON body:
+    {
+        "playlist_id": "spotify_playlist_id",
+        "song_id": "spotify_track_id",
+        "account": "spotify_user_id"  # optional
+    }
+    """
+    return await _change_playlist(request, 'remove')
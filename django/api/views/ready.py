@@ -0,0 +1,32 @@
+"""
+Readiness probe for compose health checks and load balancers.
+"""
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from api import warmup
+
+
+@require_http_methods(["GET", "HEAD"])
+def ready_view(request):
+    """
+    200 once this process has warmed up and the database is migrated,
+    503 until then. Doesn't call Spotify and doesn't need a logged-in
+    account, so an outage or a missing login doesn't take workers out of
+    rotation.
+    """
+    ready, reason, summary = warmup.readiness()
+    if not ready:
+        response = JsonResponse({
+            'success': False,
+            'ready': False,
+            'error': reason
+        }, status=503)
+        response['Retry-After'] = '1'
+        return response
+
+    return JsonResponse({
+        'success': True,
+        'ready': True,
+        'warm_up': summary
+    })
@@ -0,0 +1,117 @@
+"""
+Track lookup views.
+"""
+import json
+
+import requests
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from api import spotify_api, spotify_client, track_resolver
+from api.views.playlist import get_account, invalid_account, invalid_account_response, upstream_unavailable_response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def resolve_tracks(request):
+    """
+    Turn track links, URIs, IDs and ISRCs into Spotify track URIs.
+
+    Expected JSON body:
+    {
+        "tracks": [
+            "https://open.spotify.com/track/3n3Ppam7vgaVa1iaRUc9Lp?si=...",
+            "spotify:track:3n3Ppam7vgaVa1iaRUc9Lp",
+            "USUM71703861"
+        ],
+        "account": "spotify_user_id"  # optional, whose token searches
+    }
+
+    Links, URIs and IDs are checked locally; only ISRCs are looked up on
+    Spotify, and those lookups are cached (see api.track_resolver). Each
+    result has a status of "resolved", "not_found" (unknown ISRC) or
+    "invalid".
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    account = get_account(request, data)
+    if invalid_account(account):
+        return invalid_account_response()
+
+    tracks = data.get('tracks')
+    if not tracks or not isinstance(tracks, list):
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing required field: tracks (a list)'
+        }, status=400)
+
+    if len(tracks) > settings.SPOTIFY_BATCH_MAX_ITEMS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Too many tracks in one request (max {settings.SPOTIFY_BATCH_MAX_ITEMS})'
+        }, status=400)
+
+    parsed = []
+    for value in tracks:
+        try:
+            parsed.append(track_resolver.parse(value))
+        except track_resolver.InvalidTrack:
+            parsed.append(None)
+
+    isrcs = [item[1] for item in parsed if item is not None and item[0] == track_resolver.ISRC]
+    try:
+        found = track_resolver.resolve_isrcs(isrcs, account) if isrcs else {}
+    except spotify_api.NotAuthenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated. Please authenticate with Spotify first.'
+        }, status=401)
+    except spotify_api.SpotifyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'status_code': e.status_code
+        }, status=e.status_code)
+    except spotify_client.UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
+    except requests.exceptions.RequestException as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Request to Spotify API failed: {str(e)}'
+        }, status=500)
+
+    results = []
+    for value, item in zip(tracks, parsed):
+        result = {'input': value, 'uri': None, 'track_id': None}
+        if item is None:
+            result['status'] = 'invalid'
+        else:
+            kind, ref = item
+            track_id = ref if kind == track_resolver.TRACK else found[ref]
+            if kind == track_resolver.ISRC:
+                result['isrc'] = ref
+            if track_id:
+                result.update(status='resolved', uri=track_resolver.track_uri(track_id), track_id=track_id)
+            else:
+                result['status'] = 'not_found'
+        results.append(result)
+
+    return JsonResponse({
+        'success': True,
+        'resolved': sum(1 for result in results if result['status'] == 'resolved'),
+        'total': len(results),
+        'results': results
+    })
@@ -0,0 +1,123 @@
+"""
+Process warm-up and readiness.
+
+Before a serving process takes traffic it:
+- loads every stored account's tokens into the token cache;
+- refreshes the tokens that are within SPOTIFY_TOKEN_REFRESH_MARGIN of
+  expiring, so the first requests don't wait for the accounts service;
+- opens a pooled connection to each Spotify host (SPOTIFY_HTTP_WARM_UP);
+- checks that the database migrations have been applied, and starts its
+  playlist job workers once they have.
+
+All of it runs within SPOTIFY_WARM_UP_TIMEOUT seconds (api/deadline.py).
+Spotify being unreachable or nobody being logged in doesn't stop a
+process from becoming ready; pending migrations do.
+
+Under gunicorn (gunicorn.conf.py) the app is imported once in the master
+and forked, so warming up there would be wasted on the master. The config
+sets WARM_UP_AFTER_FORK and each worker warms up in post_worker_init,
+before it accepts its first connection. The development server and a
+plain uvicorn warm up in a background thread instead.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+
+from api import deadline, jobs, spotify_client, token_manager, token_refresher
+
+logger = logging.getLogger(__name__)
+
+_state = {
+    'pid': None,
+    'warmed_up': False,
+    'migrated': False,
+    'summary': None,
+}
+
+
+def after_fork():
+    """Whether warm-up is left to the forked workers (see gunicorn.conf.py)."""
+    return os.environ.get('WARM_UP_AFTER_FORK') == 'True'
+
+
+def _warm_tokens(summary):
+    for account in token_manager.stored_accounts():
+        tokens = token_manager.get_tokens(account)
+        if not tokens:
+            continue
+        summary['accounts'] += 1
+
+        ttl = token_manager.seconds_until_expiry(tokens)
+        if ttl is None or ttl > settings.SPOTIFY_TOKEN_REFRESH_MARGIN:
+            continue
+        try:
+            token = token_refresher.refresh_access_token(
+                min_ttl=settings.SPOTIFY_TOKEN_REFRESH_MARGIN,
+                account=account
+            )
+        except spotify_client.UpstreamUnavailable:
+            logger.warning('Could not refresh the token of account %s during warm-up', account, exc_info=True)
+            continue
+        if token:
+            summary['refreshed'] += 1
+
+
+def migrations_applied():
+    """Whether the database exists and every migration has been applied."""
+    try:
+        executor = MigrationExecutor(connection)
+        return not executor.migration_plan(executor.loader.graph.leaf_nodes())
+    except DatabaseError as e:
+        logger.warning('Could not check the database migrations: %s', e)
+        return False
+
+
+def run():
+    """Warm this process up; returns a summary of what was done."""
+    start = time.perf_counter()
+    summary = {'accounts': 0, 'refreshed': 0}
+
+    with deadline.budget(settings.SPOTIFY_WARM_UP_TIMEOUT):
+        try:
+            _warm_tokens(summary)
+        except Exception:
+            logger.exception('Loading tokens during warm-up failed')
+        if settings.SPOTIFY_HTTP_WARM_UP:
+            spotify_client.warm_up()
+    token_refresher.ensure_background_refresher()
+
+    migrated = migrations_applied()
+    if migrated:
+        jobs.ensure_workers()
+    # Requests run on other threads; don't keep this thread's connection open
+    connection.close()
+
+    summary['ms'] = round((time.perf_counter() - start) * 1000, 1)
+    _state.update(pid=os.getpid(), warmed_up=True, migrated=migrated, summary=summary)
+    logger.info('Warm-up done: %s', summary)
+    return summary
+
+
+def start():
+    """Warm the process up in the background, unless its server's forked workers do."""
+    if after_fork():
+        return
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
+def readiness():
+    """(ready, reason, summary) of this process."""
+    if _state['pid'] != os.getpid() or not _state['warmed_up']:
+        return False, 'Warming up', None
+    if not _state['migrated']:
+        # Checked again on every probe until the migrate step has run
+        _state['migrated'] = migrations_applied()
+        if not _state['migrated']:
+            return False, 'Database migrations have not been applied', _state['summary']
+        jobs.ensure_workers()
+    return True, None, _state['summary']
@@ -0,0 +1,75 @@
+"""
+gunicorn configuration: the production server of the Docker image.
+
+    gunicorn -c gunicorn.conf.py
+
+SERVER_MODE=asgi serves spotify_controller.asgi with uvicorn workers (the
+async views); anything else serves spotify_controller.wsgi with threaded
+workers. Tuned with:
+- GUNICORN_WORKERS: worker processes (default: 2 per CPU, at most 8;
+  ASGI_WORKERS is still read in asgi mode);
+- GUNICORN_THREADS: request threads per WSGI worker (default 8). Views
+  spend most of their time waiting for Spotify, so threads are cheap
+  concurrency;
+- GUNICORN_TIMEOUT: seconds a worker may go silent before it is restarted
+  (default 60). A worker stays in touch while its threads serve long
+  requests such as streamed imports, so this doesn't cap them;
+- GUNICORN_KEEPALIVE: seconds an idle connection from nginx is kept;
+- GUNICORN_MAX_REQUESTS: restart a worker after this many requests
+  (default 0, never), with up to 10% jitter.
+
+The app is preloaded: Django and the API modules are imported once in the
+master, and workers are forked from it ready to serve. Each worker then
+warms up (api/warmup.py) in post_worker_init, before it accepts its first
+connection.
+"""
+import multiprocessing
+import os
+
+# api.warmup leaves the warm-up to each worker instead of the master
+os.environ['WARM_UP_AFTER_FORK'] = 'True'
+
+_asgi = os.environ.get('SERVER_MODE') == 'asgi'
+_default_workers = min(8, 2 * multiprocessing.cpu_count())
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+
+if _asgi:
+    wsgi_app = 'spotify_controller.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    workers = int(os.environ.get('GUNICORN_WORKERS', os.environ.get('ASGI_WORKERS', _default_workers)))
+else:
+    wsgi_app = 'spotify_controller.wsgi:application'
+    worker_class = 'gthread'
+    workers = int(os.environ.get('GUNICORN_WORKERS', _default_workers))
+    threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-' if os.environ.get('GUNICORN_ACCESS_LOG', 'False') == 'True' else None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened while importing the app belong to the master
+    from django.db import connections
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    from api import warmup
+
+    summary = warmup.run()
+    worker.log.info('Worker %s warmed up: %s', worker.pid, summary)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges from the shared metrics files
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,10 @@
 """
 ASGI config for spotify_controller project.
+
+Serves the async playlist and auth views when SERVER_MODE=asgi (or
+SPOTIFY_ASYNC_VIEWS=True) is set. Run with e.g.
+    SERVER_MODE=asgi uvicorn spotify_controller.asgi:application --workers 4
+or under gunicorn with SERVER_MODE=asgi (see gunicorn.conf.py).
 """
 
 import os
@@ -8,4 +13,30 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_controller.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Load tokens, open pooled connections to Spotify and resume queued
+# playlist jobs, including ones interrupted by a restart (api/warmup.py)
+from api import spotify_async_client, warmup  # noqa: E402
+
+warmup.start()
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI app plus lifespan handling, so the async client's pool is
+    warmed on startup and closed cleanly on shutdown.
+    """
+    if scope['type'] != 'lifespan':
+        await django_application(scope, receive, send)
+        return
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await spotify_async_client.warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await spotify_async_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
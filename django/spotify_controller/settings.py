@@ -31,6 +31,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.TimingMiddleware',
+    'api.middleware.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -38,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'spotify_controller.urls'
@@ -102,6 +106,145 @@ SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIFY_REDIRECT_URI')
 
+# Where Spotify lives. Point these at benchmarks/spotify_stub.py to run
+# without the real service (e.g. for load tests).
+SPOTIFY_API_BASE_URL = os.environ.get('SPOTIFY_API_BASE_URL', 'https://api.spotify.com/v1').rstrip('/')
+SPOTIFY_ACCOUNTS_BASE_URL = os.environ.get('SPOTIFY_ACCOUNTS_BASE_URL', 'https://accounts.spotify.com').rstrip('/')
+
+# Access tokens are renewed in the background this many seconds before they
+# expire; requests only block on a refresh once the token is within
+# SPOTIFY_TOKEN_EXPIRY_SKEW seconds of expiring.
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.environ.get('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+SPOTIFY_TOKEN_EXPIRY_SKEW = int(os.environ.get('SPOTIFY_TOKEN_EXPIRY_SKEW', '30'))
+SPOTIFY_BACKGROUND_REFRESH = os.environ.get('SPOTIFY_BACKGROUND_REFRESH', 'True') == 'True'
+
+# Publish the tokens to a shared-memory buffer next to the token file so
+# reads need no system calls (api/token_shm.py); otherwise every read
+# stat()s the token file.
+SPOTIFY_TOKEN_SHARED_MEMORY = os.environ.get('SPOTIFY_TOKEN_SHARED_MEMORY', 'False') == 'True'
+
+# Several Spotify accounts can be logged in at once (api/token_manager.py).
+# Requests that name no account use SPOTIFY_DEFAULT_ACCOUNT (a Spotify user
+# id), or the first account that logged in if it is empty. At most
+# SPOTIFY_TOKEN_CACHE_MAX_ACCOUNTS accounts' tokens are cached per process.
+SPOTIFY_DEFAULT_ACCOUNT = os.environ.get('SPOTIFY_DEFAULT_ACCOUNT', '')
+SPOTIFY_TOKEN_CACHE_MAX_ACCOUNTS = int(os.environ.get('SPOTIFY_TOKEN_CACHE_MAX_ACCOUNTS', '256'))
+
+# /auth/status answers from a cached Spotify profile for this many seconds
+# instead of calling /v1/me on every hit (?verify=1 always checks live).
+AUTH_STATUS_CACHE_TTL = int(os.environ.get('AUTH_STATUS_CACHE_TTL', '300'))
+
+# Pooled HTTP client used for every Spotify call (api/spotify_client.py).
+# POOL_CONNECTIONS is the number of hosts kept pooled, POOL_MAXSIZE the
+# number of kept-alive connections per host; with POOL_BLOCK the per-host
+# limit is enforced instead of opening overflow connections.
+SPOTIFY_HTTP_POOL_CONNECTIONS = int(os.environ.get('SPOTIFY_HTTP_POOL_CONNECTIONS', '4'))
+SPOTIFY_HTTP_POOL_MAXSIZE = int(os.environ.get('SPOTIFY_HTTP_POOL_MAXSIZE', '20'))
+SPOTIFY_HTTP_POOL_BLOCK = os.environ.get('SPOTIFY_HTTP_POOL_BLOCK', 'False') == 'True'
+SPOTIFY_HTTP_KEEPALIVE = os.environ.get('SPOTIFY_HTTP_KEEPALIVE', 'True') == 'True'
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.environ.get('SPOTIFY_HTTP_CONNECT_TIMEOUT', '3.05'))
+SPOTIFY_HTTP_READ_TIMEOUT = float(os.environ.get('SPOTIFY_HTTP_READ_TIMEOUT', '10'))
+SPOTIFY_HTTP_WARM_UP = os.environ.get('SPOTIFY_HTTP_WARM_UP', 'True') == 'True'
+# Longest a process spends warming up (loading tokens, refreshing ones
+# close to expiry, opening pooled connections) before /ready reports it
+# ready (api/warmup.py)
+SPOTIFY_WARM_UP_TIMEOUT = float(os.environ.get('SPOTIFY_WARM_UP_TIMEOUT', '10'))
+# Seconds an idle connection is kept in the async client's pool
+SPOTIFY_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('SPOTIFY_HTTP_KEEPALIVE_EXPIRY', '60'))
+
+# Serve the views that call Spotify as async views (api/views/*_async.py).
+# On by default with SERVER_MODE=asgi; otherwise the sync views are used.
+# Decided here rather than in asgi.py: importing the spotify_controller
+# package already loads the settings.
+SPOTIFY_ASYNC_VIEWS = os.environ.get(
+    'SPOTIFY_ASYNC_VIEWS',
+    str(os.environ.get('SERVER_MODE') == 'asgi')
+) == 'True'
+
+# Pacing of Spotify Web API calls (api/rate_limiter.py). Requests that
+# can't be scheduled within RATE_LIMIT_MAX_WAIT seconds fail with a 503.
+# 429s and 5xx responses of idempotent requests are retried up to
+# MAX_RETRIES times, starting from RETRY_BACKOFF seconds. The rate is per
+# worker process: Spotify sees up to workers x containers times as many.
+SPOTIFY_RATE_LIMIT_PER_SECOND = float(os.environ.get('SPOTIFY_RATE_LIMIT_PER_SECOND', '10'))
+SPOTIFY_RATE_LIMIT_BURST = int(os.environ.get('SPOTIFY_RATE_LIMIT_BURST', '20'))
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(os.environ.get('SPOTIFY_RATE_LIMIT_MAX_WAIT', '10'))
+SPOTIFY_MAX_RETRIES = int(os.environ.get('SPOTIFY_MAX_RETRIES', '3'))
+SPOTIFY_RETRY_BACKOFF = float(os.environ.get('SPOTIFY_RETRY_BACKOFF', '0.5'))
+
+# Circuit breaker per Spotify host (api/circuit_breaker.py): opens after
+# FAILURE_THRESHOLD failed calls in a row (0 disables it), lets
+# HALF_OPEN_PROBES calls through after RESET_TIMEOUT seconds and closes
+# again once one of them succeeds.
+SPOTIFY_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('SPOTIFY_BREAKER_FAILURE_THRESHOLD', '5'))
+SPOTIFY_BREAKER_RESET_TIMEOUT = float(os.environ.get('SPOTIFY_BREAKER_RESET_TIMEOUT', '30'))
+SPOTIFY_BREAKER_HALF_OPEN_PROBES = int(os.environ.get('SPOTIFY_BREAKER_HALF_OPEN_PROBES', '1'))
+
+# Seconds a request may spend on Spotify calls in total, token refresh and
+# retries included (api/deadline.py); 0 disables the budget.
+SPOTIFY_REQUEST_DEADLINE = float(os.environ.get('SPOTIFY_REQUEST_DEADLINE', '15'))
+
+# Stage timings of each request (api/timing.py): sent in a Server-Timing
+# header, and requests slower than SLOW_REQUEST_THRESHOLD_MS are logged to
+# api.slow_requests (a SLOW_REQUEST_LOG_SAMPLE_RATE share of them).
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'True') == 'True'
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '1000'))
+SLOW_REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_LOG_SAMPLE_RATE', '1.0'))
+
+# Upper bound on songs accepted by the batch playlist endpoints
+# (Spotify playlists hold at most 10,000 items).
+SPOTIFY_BATCH_MAX_ITEMS = int(os.environ.get('SPOTIFY_BATCH_MAX_ITEMS', '10000'))
+
+# Single-track adds/removes to the same playlist arriving within this many
+# milliseconds are sent to Spotify as one call (0 disables coalescing).
+# At most COALESCE_MAX_PENDING tracks are buffered per process; beyond
+# that requests are sent on their own.
+SPOTIFY_COALESCE_WINDOW_MS = int(os.environ.get('SPOTIFY_COALESCE_WINDOW_MS', '10'))
+SPOTIFY_COALESCE_MAX_PENDING = int(os.environ.get('SPOTIFY_COALESCE_MAX_PENDING', '5000'))
+
+# Identical single-track adds/removes (same playlist, track and account)
+# arriving while one is in flight wait for its result instead of calling
+# Spotify again (api/single_flight.py)
+SPOTIFY_SINGLE_FLIGHT = os.environ.get('SPOTIFY_SINGLE_FLIGHT', 'True') == 'True'
+
+# Asynchronous playlist jobs (api/jobs.py): worker threads per serving
+# process, how long a claimed job is leased to its worker, and retries.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '2'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '8'))
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', '2'))
+
+# Idempotency keys on playlist mutations (api/idempotency.py): how long
+# responses are kept, how many at most, how long a repeat waits for the
+# original request, and after how long an unfinished one is presumed dead.
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', '100000'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '30'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '300'))
+IDEMPOTENCY_PRUNE_PROBABILITY = float(os.environ.get('IDEMPOTENCY_PRUNE_PROBABILITY', '0.01'))
+
+# ISRCs resolved through Spotify search are cached in the database
+# (api/track_resolver.py): found tracks for TRACK_RESOLVER_CACHE_TTL
+# seconds, ISRCs Spotify doesn't know for TRACK_RESOLVER_NEGATIVE_TTL, and
+# at most TRACK_RESOLVER_CACHE_MAX_ENTRIES of them (least recently used go).
+# ISRCs that aren't cached are searched TRACK_RESOLVER_SEARCH_CONCURRENCY at
+# a time.
+TRACK_RESOLVER_CACHE_TTL = int(os.environ.get('TRACK_RESOLVER_CACHE_TTL', str(30 * 86400)))
+TRACK_RESOLVER_NEGATIVE_TTL = int(os.environ.get('TRACK_RESOLVER_NEGATIVE_TTL', '86400'))
+TRACK_RESOLVER_CACHE_MAX_ENTRIES = int(os.environ.get('TRACK_RESOLVER_CACHE_MAX_ENTRIES', '100000'))
+TRACK_RESOLVER_PRUNE_PROBABILITY = float(os.environ.get('TRACK_RESOLVER_PRUNE_PROBABILITY', '0.01'))
+TRACK_RESOLVER_SEARCH_CONCURRENCY = int(os.environ.get('TRACK_RESOLVER_SEARCH_CONCURRENCY', '8'))
+
+# Local playlist mirror (api/playlist_mirror.py): trusted without asking
+# Spotify for CHECK_INTERVAL seconds, fully re-fetched after MAX_AGE seconds.
+PLAYLIST_MIRROR_CHECK_INTERVAL = int(os.environ.get('PLAYLIST_MIRROR_CHECK_INTERVAL', '5'))
+PLAYLIST_MIRROR_MAX_AGE = int(os.environ.get('PLAYLIST_MIRROR_MAX_AGE', '600'))
+# Pages of a playlist fetched at once when it is (re-)synced, and how many
+# playlists' track lists each process keeps in memory for GET .../tracks.
+SPOTIFY_PAGE_FETCH_CONCURRENCY = int(os.environ.get('SPOTIFY_PAGE_FETCH_CONCURRENCY', '4'))
+PLAYLIST_READ_CACHE_ENTRIES = int(os.environ.get('PLAYLIST_READ_CACHE_ENTRIES', '16'))
+
 # Session configuration for storing tokens
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 3600  # 1 hour
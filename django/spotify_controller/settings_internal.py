@@ -0,0 +1,32 @@
+"""
+Django settings for the internal API (port 8001).
+
+Same configuration as spotify_controller.settings, minus everything only
+the OAuth site needs. The internal views never use sessions, users,
+messages or CSRF tokens, so the middleware for them is left out; with the
+database session engine and SESSION_SAVE_EVERY_REQUEST that spares every
+VM call a session write. Only the OAuth endpoints on port 80 keep the
+full stack.
+
+Select it with DJANGO_SETTINGS_MODULE=spotify_controller.settings_internal
+(see the django_internal service in docker-compose.yml).
+"""
+
+from spotify_controller.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'api',
+]
+
+MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.TimingMiddleware',
+    'api.middleware.DeadlineMiddleware',
+    'api.middleware.ViewTimingMiddleware',
+]
+
+ROOT_URLCONF = 'spotify_controller.urls_internal'
+
+# Nothing here renders templates
+TEMPLATES = []
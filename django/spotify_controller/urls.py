@@ -3,9 +3,13 @@ URL configuration for spotify_controller project.
 """
 from django.contrib import admin
 from django.urls import path, include
+from api.views.metrics import metrics_view
+from api.views.ready import ready_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('api.urls.auth')),
     path('api/', include('api.urls.api')),
+    path('metrics', metrics_view, name='metrics'),
+    path('ready', ready_view, name='ready'),
 ]
@@ -0,0 +1,12 @@
+"""
+URL configuration for the internal API (see settings_internal).
+"""
+from django.urls import path, include
+from api.views.metrics import metrics_view
+from api.views.ready import ready_view
+
+urlpatterns = [
+    path('api/', include('api.urls.api')),
+    path('metrics', metrics_view, name='metrics'),
+    path('ready', ready_view, name='ready'),
+]
@@ -9,3 +9,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_controller.settings')
 
 application = get_wsgi_application()
+
+# Load tokens, open pooled connections to Spotify and resume queued
+# playlist jobs, including ones interrupted by a restart (api/warmup.py)
+from api import warmup  # noqa: E402
+
+warmup.start()